@@ -0,0 +1,209 @@
+"""
+对话分析结果缓存
+内存 LRU 在前，磁盘（analysis_outputs/cache）在后，键为规范化后对话文本的哈希
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_dialog_text(dialog_text: str) -> str:
+    """规范化对话文本：统一Unicode形式、换行和空白，避免无意义差异导致缓存未命中"""
+    text = unicodedata.normalize('NFC', dialog_text or '')
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [re.sub(r'[ \t　]+', ' ', line).strip() for line in text.split('\n')]
+    # 连续空行合并为一个
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def dialog_hash(dialog_text: str) -> str:
+    """计算对话的内容哈希"""
+    normalized = normalize_dialog_text(dialog_text)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    def __init__(self, cache_dir: str = "analysis_outputs/cache", max_memory_entries: int = 256,
+                 max_disk_entries: int = 2048, ttl_seconds: int = 7 * 24 * 3600):
+        """
+        初始化分析结果缓存
+
+        Args:
+            cache_dir: 磁盘缓存目录
+            max_memory_entries: 内存中最多保留的条目数
+            max_disk_entries: 磁盘上最多保留的条目数
+            ttl_seconds: 条目有效期（秒），<= 0 表示不过期
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 正在计算中的键，同一对话的并发请求只调用一次模型
+        self._inflight: Dict[str, threading.Event] = {}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        if self.ttl_seconds <= 0:
+            return False
+        return time.time() - entry.get('created_at', 0) > self.ttl_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        """放入内存 LRU（调用方需持有锁）"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取分析缓存失败 {path}: {e}")
+            return None
+
+        if self._is_expired(entry):
+            self._remove_disk(key)
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入分析缓存失败 {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._prune_disk()
+
+    def _remove_disk(self, key: str) -> None:
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _prune_disk(self) -> None:
+        """删除过期条目，并在超过容量时按修改时间淘汰最旧的条目"""
+        try:
+            files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.endswith('.json')]
+        except OSError:
+            return
+
+        now = time.time()
+        alive = []
+        for path in files:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self.ttl_seconds > 0 and now - mtime > self.ttl_seconds:
+                self._safe_remove(path)
+            else:
+                alive.append((mtime, path))
+
+        overflow = len(alive) - self.max_disk_entries
+        if overflow > 0:
+            alive.sort()
+            for _, path in alive[:overflow]:
+                self._safe_remove(path)
+
+    @staticmethod
+    def _safe_remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，依次查找内存和磁盘"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_expired(entry):
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+                    return entry['result']
+
+        entry = self._read_disk(key)
+        if entry is None:
+            return None
+
+        with self._lock:
+            self._remember(key, entry)
+        return entry['result']
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """写入缓存（内存和磁盘）"""
+        entry = {
+            'key': key,
+            'created_at': time.time(),
+            'result': result
+        }
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict[str, Any]],
+                       cacheable: Callable[[Dict[str, Any]], bool] = lambda r: True) -> Dict[str, Any]:
+        """
+        命中则直接返回，否则调用 compute 计算并写入缓存
+
+        同一个键的并发请求只有一个会真正执行 compute，其余等待其结果
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                logger.info(f"分析缓存命中: {key[:12]}")
+                return cached
+
+            with self._lock:
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self._inflight[key] = threading.Event()
+                    break
+            waiter.wait()
+            # 计算方完成后重新查缓存；若其结果不可缓存则由本请求自行计算
+
+        try:
+            result = compute()
+            if cacheable(result):
+                self.put(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def clear(self) -> None:
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                self._safe_remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,116 @@
+"""
+生成产物存储
+每次生成任务写入独立的目录，文件按内容哈希命名；写入先落到临时文件再原子重命名，
+相同内容只在 objects/ 下保存一份，任务目录中以硬链接引用
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def new_job_id() -> str:
+    """生成新的任务ID"""
+    return uuid.uuid4().hex
+
+
+def guess_image_extension(data: bytes, default: str = 'png') -> str:
+    """根据文件头识别图片格式"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    return default
+
+
+class ArtifactStore:
+    def __init__(self, root: str = "output"):
+        """
+        初始化产物存储
+
+        Args:
+            root: 存储根目录；任务目录为 root/<job_id>，去重对象位于 root/objects
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+
+    def job_dir(self, job_id: str) -> str:
+        """获取（并创建）任务目录"""
+        if not _JOB_ID_PATTERN.match(job_id):
+            raise ValueError(f"非法的任务ID: {job_id}")
+        path = os.path.join(self.root, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes) -> None:
+        """先写临时文件再重命名，读取方不会看到写了一半的文件"""
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _atomic_link(source: str, path: str) -> None:
+        """把已有对象以硬链接放到目标位置；不支持硬链接时退回复制"""
+        directory = os.path.dirname(path)
+        tmp_path = os.path.join(directory, f".tmp-{uuid.uuid4().hex}")
+        try:
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _object_path(self, digest: str, ext: str) -> str:
+        directory = os.path.join(self.objects_dir, digest[:2])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{digest}.{ext}")
+
+    def save_bytes(self, job_id: str, data: bytes, ext: str) -> str:
+        """
+        保存一份产物
+
+        Args:
+            job_id: 任务ID
+            data: 文件内容
+            ext: 扩展名（不含点）
+
+        Returns:
+            任务目录下的文件路径，文件名为内容哈希
+        """
+        ext = ext.lower().lstrip('.') or 'bin'
+        digest = hashlib.sha256(data).hexdigest()
+
+        object_path = self._object_path(digest, ext)
+        if not os.path.exists(object_path):
+            self._atomic_write(object_path, data)
+
+        path = os.path.join(self.job_dir(job_id), f"{digest[:32]}.{ext}")
+        if not os.path.exists(path):
+            self._atomic_link(object_path, path)
+        else:
+            logger.info(f"相同内容的产物已存在，跳过写入: {path}")
+        return path
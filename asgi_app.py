@@ -0,0 +1,397 @@
+"""
+ASGI 入口（异步模式）
+以模型、图像和 MCP 调用为主的接口在事件循环中用异步客户端处理，等待上游期间不占用线程，
+单个进程可以同时承载数百个进行中的请求：
+
+    POST /chat、/chat_stream
+    POST /extract、/generate_html、/generate_poster（请求体带 "async": true 时除外）
+    POST /publish_xiaohongshu（请求体带 "sync": true 时；默认的入队发布除外）
+
+其余接口（页面、静态文件、任务查询、后台任务模式、流水线等）交给 Flask 应用处理，
+需要安装 asgiref（WsgiToAsgi 在线程池中执行这些同步视图）
+
+用法：
+    pip install uvicorn asgiref
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import json
+import logging
+import time
+import traceback
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+import main_deepssek as core
+import metrics
+import tracing
+from mcp import MCPError
+from model_gateway import gateway
+from publish_queue import PublishError
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = 'x-request-id'
+
+# 其余接口交给 Flask 应用处理
+flask_app = WsgiToAsgi(core.app) if WsgiToAsgi is not None else None
+if flask_app is None:
+    logger.warning("未安装 asgiref，异步模式下只提供模型相关接口；其余接口请安装 asgiref 或使用 Flask 模式")
+
+
+class Request:
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+
+    def json(self) -> Optional[Any]:
+        """解析 JSON 请求体，无效时返回 None"""
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+    def with_client_id(self) -> Dict[str, Any]:
+        """同 main_deepssek.with_client_id：补上请求头 X-Client-Id 中的客户端ID"""
+        data = self.json()
+        data = dict(data) if isinstance(data, dict) else {}
+        if not data.get('client_id'):
+            data['client_id'] = self.headers.get('x-client-id')
+        return data
+
+
+class EventStream:
+    """SSE 响应：逐个发送异步生成器产出的事件"""
+
+    def __init__(self, events: AsyncIterator[str]):
+        self.events = events
+
+
+# 处理函数返回 (响应数据, HTTP状态码)、EventStream，或 None 表示交给 Flask 应用处理
+Handler = Callable[[Request], Awaitable[Any]]
+
+
+# ===== 接口 =====
+
+async def chat(request: Request):
+    """聊天接口（同 Flask 模式的 /chat）"""
+    try:
+        data = request.json()
+        if not data:
+            return {'error': '请求数据为空'}, 400
+
+        user_message = data.get('message', '')
+
+        if not user_message:
+            return {'error': '消息不能为空'}, 400
+
+        logger.info(f"收到用户消息: {user_message[:100]}...")
+
+        # 会话保存在状态存储中（SQLite/Redis 后端会读写磁盘或网络），放到线程中执行
+        with metrics.stage('prompt_build'):
+            messages, session = await asyncio.to_thread(core.prepare_chat_messages, data, user_message)
+        if messages is None:
+            return {'error': '会话不存在或已过期', 'code': 'session_expired'}, 404
+
+        response = await core.chat_model.acall(messages if len(messages) > 1 else user_message)
+
+        result = {
+            'response': response,
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        }
+        if session is not None:
+            await asyncio.to_thread(core.chat_sessions.append_turn, session, user_message, response)
+            result['session_id'] = session.id
+        return result, 200
+
+    except Exception as e:
+        logger.error(f"Chat error: {e}")
+        traceback.print_exc()
+        return {'error': f'聊天服务出错: {str(e)}'}, 500
+
+
+async def chat_stream(request: Request):
+    """流式聊天接口（同 Flask 模式的 /chat_stream）"""
+    try:
+        data = request.json()
+        if not data:
+            return {'error': '请求数据为空'}, 400
+
+        user_message = data.get('message', '')
+
+        if not user_message:
+            return {'error': '消息不能为空'}, 400
+
+        logger.info(f"收到用户消息(流式): {user_message[:100]}...")
+
+        # 会话保存在状态存储中（SQLite/Redis 后端会读写磁盘或网络），放到线程中执行
+        with metrics.stage('prompt_build'):
+            messages, session = await asyncio.to_thread(core.prepare_chat_messages, data, user_message)
+        if messages is None:
+            return {'error': '会话不存在或已过期', 'code': 'session_expired'}, 404
+
+        # 在返回响应前建立流，连接/鉴权错误仍能以普通JSON错误返回
+        deltas = await core.chat_model.astream(messages if len(messages) > 1 else user_message)
+    except Exception as e:
+        logger.error(f"Chat stream error: {e}")
+        traceback.print_exc()
+        return {'error': f'聊天服务出错: {str(e)}'}, 500
+
+    async def generate():
+        try:
+            reply = []
+            async for delta in deltas:
+                reply.append(delta)
+                yield core.sse_event({'delta': delta})
+
+            done = {'done': True, 'timestamp': datetime.now().strftime('%H:%M:%S')}
+            if session is not None:
+                # 只有完整收到的回复才写入会话历史
+                await asyncio.to_thread(core.chat_sessions.append_turn, session, user_message, ''.join(reply))
+                done['session_id'] = session.id
+            yield core.sse_event(done)
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}")
+            yield core.sse_event({'error': f'聊天服务出错: {str(e)}'})
+        finally:
+            await deltas.aclose()
+
+    return EventStream(generate())
+
+
+def task_route(task: Callable[[Dict[str, Any]], Awaitable[Tuple[Dict[str, Any], int]]]) -> Handler:
+    """需求提取/HTML/海报接口：默认在请求内异步执行，"async": true 的后台任务模式交给 Flask 应用"""
+    async def handler(request: Request):
+        data = request.with_client_id()
+        if data.get('async'):
+            return None
+        return await task(data)
+    return handler
+
+
+async def publish_xiaohongshu(request: Request):
+    """同步发布（sync: true）在事件循环中等待 MCP 响应；默认的入队发布交给 Flask 应用"""
+    data = request.json()
+    if not isinstance(data, dict) or not data.get('sync'):
+        return None
+    try:
+        kind, payload, error = core.parse_publish_request(data)
+        if error:
+            return {'error': error}, 400
+
+        logger.info(f"开始发布小红书内容，标题: {payload['title']}")
+
+        try:
+            result = await core.apublish_to_xiaohongshu(kind, payload)
+        except MCPError as e:
+            logger.error(f"MCP客户端不可用: {e}")
+            return {'error': str(e)}, 500
+        except PublishError as e:
+            logger.error(f"发布失败: {e}")
+            return {
+                'status': 'error',
+                'error': f"发布失败: {e}"
+            }, 500
+
+        return {
+            'status': 'success',
+            'message': '发布成功！',
+            'result': result
+        }, 200
+
+    except Exception as e:
+        logger.error(f"发布小红书内容出错: {e}")
+        traceback.print_exc()
+        return {'error': f'发布失败: {str(e)}'}, 500
+
+
+ROUTES: Dict[str, Handler] = {
+    '/chat': chat,
+    '/chat_stream': chat_stream,
+    '/extract': task_route(core.aextract_task),
+    '/generate_html': task_route(core.agenerate_html_task),
+    '/generate_poster': task_route(core.agenerate_poster_task),
+    '/publish_xiaohongshu': publish_xiaohongshu
+}
+
+
+# ===== ASGI 传输 =====
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def response_headers(request: Request, content_type: str, trace_id: str,
+                     extra: Optional[Dict[str, str]] = None) -> List[Tuple[bytes, bytes]]:
+    headers = {'content-type': content_type, 'x-request-id': trace_id}
+    # 与 Flask 模式的 CORS(app) 一致
+    if 'origin' in request.headers:
+        headers['access-control-allow-origin'] = '*'
+    headers.update(extra or {})
+    return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+
+
+async def send_json(send, request: Request, trace_id: str, payload: Any, status: int) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': response_headers(request, 'application/json', trace_id)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_events(send, receive, request: Request, trace_id: str, stream: EventStream) -> None:
+    """发送 SSE 响应；客户端断开时停止迭代，生成器的 finally 负责释放上游连接"""
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': response_headers(request, 'text/event-stream; charset=utf-8', trace_id, {
+                'cache-control': 'no-cache',
+                'x-accel-buffering': 'no'
+            })
+        })
+        async for event in stream.events:
+            if disconnected.is_set():
+                break
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        await stream.events.aclose()
+
+
+async def delegate(scope, receive, send, body: Optional[bytes] = None) -> None:
+    """交给 Flask 应用处理；已读取的请求体原样重放"""
+    if flask_app is None:
+        await send({
+            'type': 'http.response.start',
+            'status': 501,
+            'headers': [(b'content-type', b'application/json')]
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': json.dumps({'error': '异步模式下该接口需要安装 asgiref'}, ensure_ascii=False).encode('utf-8')
+        })
+        return
+
+    if body is not None:
+        replayed = False
+
+        async def receive_replayed():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+
+        await flask_app(scope, receive_replayed, send)
+    else:
+        await flask_app(scope, receive, send)
+
+
+def start_trace(request: Request) -> tracing.Trace:
+    """同 tracing.init_app：沿用请求头中合理的 trace ID"""
+    incoming = (request.headers.get(TRACE_HEADER) or '').strip()
+    trace_id = incoming if incoming and len(incoming) <= 128 and incoming.isprintable() else None
+    new_trace = tracing.Trace(f"{request.method} {request.path}", trace_id, path=request.path, mode='asgi')
+    tracing.activate(new_trace)
+    return new_trace
+
+
+async def handle_http(scope, receive, send) -> None:
+    handler = ROUTES.get(scope['path']) if scope['method'] == 'POST' else None
+    if handler is None:
+        await delegate(scope, receive, send)
+        return
+
+    request = Request(scope, await read_body(receive))
+    current = start_trace(request)
+    route = request.path
+    started = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+    status = 500
+    error = None
+    try:
+        try:
+            result = await handler(request)
+        except Exception as e:
+            logger.error(f"Internal server error: {e}")
+            traceback.print_exc()
+            result = ({'error': '服务器内部错误'}, 500)
+
+        if result is None:
+            # 交给 Flask 应用，由它自己的钩子记录指标和 trace
+            current.root.set(delegated=True)
+            await delegate(scope, receive, send, request.body)
+            return
+
+        if isinstance(result, EventStream):
+            status = 200
+            current.root.set(status=status)
+            await send_events(send, receive, request, current.trace_id, result)
+        else:
+            payload, status = result
+            current.root.set(status=status)
+            await send_json(send, request, current.trace_id, payload, status)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+        if not current.root.attributes.get('delegated'):
+            metrics.REQUEST_DURATION.observe(time.perf_counter() - started, route=route, method='POST', status=status)
+            if status >= 400:
+                metrics.REQUEST_ERRORS.inc(route=route, status=status)
+            tracing.finish(current, error)
+
+
+async def handle_lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # 异步连接池绑定在服务器的事件循环上，在这里关闭
+            await gateway.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    """ASGI 应用"""
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+    elif flask_app is not None:
+        await flask_app(scope, receive, send)
@@ -0,0 +1,433 @@
+"""
+压测用的本地替身服务器，不访问任何外部服务：
+- DeepSeek（OpenAI 兼容的 /v1/chat/completions）：可配置首 token 延迟和每秒 token 数，支持流式输出和 usage
+- OpenRouter 图像接口（call_image_model 使用的 /api/v1/chat/completions）：返回 data URL 形式的 PNG
+- 小红书 MCP 服务器（/mcp）：JSON-RPC，支持会话ID、批量请求，以 JSON 或 SSE 返回
+
+用法：
+    python benchmarks/fake_servers.py --latency 0.5 --tokens-per-second 50 --image-latency 3 --mcp-latency 1
+启动后按提示设置环境变量再启动应用
+"""
+
+import argparse
+import base64
+import json
+import logging
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 每个 token 按两个字符计
+TOKEN_CHARS = 2
+
+_FILLER_WORDS = ['创业', '用户', '产品', '市场', '团队', '增长', '体验', '数据', '社区', '校园',
+                 '效率', '平台', '智能', '服务', '方案', '价值', '场景', '需求', '创新', '落地']
+
+
+def _filler(chars: int, rng: random.Random) -> str:
+    """生成指定长度的填充文本"""
+    words = []
+    while len(words) * 2 < chars:
+        words.append(rng.choice(_FILLER_WORDS))
+    return ''.join(words)[:chars]
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, list):
+            content = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+        parts.append(content or '')
+    return '\n'.join(parts)
+
+
+def _png(width: int, height: int, rng: random.Random) -> bytes:
+    """生成一张纯色 PNG（颜色随机，保证每次内容不同）"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    color = bytes(rng.randrange(256) for _ in range(3))
+    raw = (b'\x00' + color * width) * height
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _dispatch(self, method: str) -> None:
+        handler = getattr(self.server.fake, f"handle_{method}", None)
+        if handler is None:
+            self.send_empty(405)
+            return
+        try:
+            handler(self)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如取消流式请求）
+            self.close_connection = True
+
+    def do_GET(self):
+        self._dispatch('get')
+
+    def do_POST(self):
+        self._dispatch('post')
+
+    def do_DELETE(self):
+        self._dispatch('delete')
+
+    def read_json(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null')
+
+    def send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def start_event_stream(self, headers: Optional[Dict[str, str]] = None) -> None:
+        """开始一个分块传输的 SSE 响应"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def end_event_stream(self) -> None:
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认的 listen 队列只有 5，压测异步模式时数百个连接同时到达会被拒绝
+    request_queue_size = 1024
+
+
+class FakeServer:
+    """在后台线程中运行的替身服务器"""
+
+    name = 'fake'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def handle_get(self, handler: _Handler) -> None:
+        # 模型列表：应用的每个 worker 启动时请求它来预热连接
+        if handler.path.rstrip('/').endswith('/models'):
+            handler.send_json(200, {'object': 'list', 'data': []})
+            return
+        handler.send_json(404, {'error': {'message': 'not found'}})
+
+
+# ===== DeepSeek =====
+
+class FakeDeepSeekServer(FakeServer):
+    name = 'fake-deepseek'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.5,
+                 tokens_per_second: float = 50, completion_tokens: int = 300):
+        """
+        Args:
+            latency: 首 token 延迟（秒）
+            tokens_per_second: 生成速度，<= 0 表示不限速
+            completion_tokens: 每次回复的 token 数
+        """
+        super().__init__(host, port)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.address}/v1"
+
+    def _reply_text(self, prompt: str, rng: random.Random) -> str:
+        """按提示词类型生成格式合适的回复：HTML 页面、分析结果 JSON 或普通文本"""
+        budget = self.completion_tokens * TOKEN_CHARS
+        if 'HTML代码' in prompt:
+            body = _filler(max(0, budget - 200), rng)
+            return ("```html\n<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Demo</title>\n"
+                    "<style>body { margin: 0; font-family: sans-serif; }</style></head>\n"
+                    f"<body><h1>压测页面</h1><p>{body}</p></body></html>\n```")
+        if '"image_prompt"' in prompt:
+            return json.dumps({
+                'image_prompt': '一张科技感的创业海报，蓝紫色渐变背景',
+                'html_prompt': '制作一个单页的项目介绍网站',
+                'xiaohongshu_title': '我的黑客松项目',
+                'xiaohongshu_content': _filler(max(0, budget - 150), rng)
+            }, ensure_ascii=False)
+        return _filler(budget, rng)
+
+    def _pace(self, started: float, emitted: int) -> None:
+        """按首 token 延迟和生成速度等待到第 emitted 个 token 应该产出的时间"""
+        target = started + self.latency
+        if self.tokens_per_second > 0:
+            target += emitted / self.tokens_per_second
+        delay = target - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle_post(self, handler: _Handler) -> None:
+        if not handler.path.rstrip('/').endswith('/chat/completions'):
+            handler.send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        started = time.monotonic()
+        body = handler.read_json() or {}
+        prompt = _prompt_text(body.get('messages'))
+        text = self._reply_text(prompt, random.Random())
+        tokens = [text[i:i + TOKEN_CHARS] for i in range(0, len(text), TOKEN_CHARS)]
+        usage = {
+            'prompt_tokens': math.ceil(len(prompt) / TOKEN_CHARS),
+            'completion_tokens': len(tokens),
+            'total_tokens': math.ceil(len(prompt) / TOKEN_CHARS) + len(tokens)
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get('model', 'deepseek-chat')
+
+        if not body.get('stream'):
+            self._pace(started, len(tokens))
+            handler.send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': usage
+            })
+            return
+
+        def event(choices: List[Dict[str, Any]], **extra) -> bytes:
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': choices, **extra}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        handler.start_event_stream()
+        for i, token in enumerate(tokens):
+            self._pace(started, i)
+            handler.write_chunk(event([{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]))
+        handler.write_chunk(event([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            handler.write_chunk(event([], usage=usage))
+        handler.write_chunk(b'data: [DONE]\n\n')
+        handler.end_event_stream()
+
+
+# ===== OpenRouter =====
+
+class FakeOpenRouterServer(FakeServer):
+    name = 'fake-openrouter'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 3.0,
+                 width: int = 512, height: int = 768):
+        """
+        Args:
+            latency: 每次生成图片的耗时（秒）
+            width, height: 返回图片的尺寸
+        """
+        super().__init__(host, port)
+        self.latency = latency
+        self.width = width
+        self.height = height
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.address}/api/v1"
+
+    def handle_post(self, handler: _Handler) -> None:
+        if not handler.path.rstrip('/').endswith('/chat/completions'):
+            handler.send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        body = handler.read_json() or {}
+        rng = random.Random(body.get('seed'))
+        time.sleep(self.latency)
+
+        message: Dict[str, Any] = {'role': 'assistant', 'content': ''}
+        if 'image' in (body.get('modalities') or []):
+            image = base64.b64encode(_png(self.width, self.height, rng)).decode('ascii')
+            message['images'] = [{'type': 'image_url', 'image_url': {'url': f"data:image/png;base64,{image}"}}]
+        else:
+            # 品牌文案等纯文本请求
+            message['content'] = _filler(400, rng)
+
+        handler.send_json(200, {
+            'id': f"gen-{uuid.uuid4().hex}", 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}]
+        })
+
+
+# ===== 小红书 MCP =====
+
+MCP_TOOLS = ['check_login_status', 'get_login_qrcode', 'list_feeds', 'search_feeds', 'get_feed_detail',
+             'like_feed', 'favorite_feed', 'post_comment_to_feed', 'user_profile', 'publish_content',
+             'publish_with_video']
+
+
+class FakeMCPServer(FakeServer):
+    name = 'fake-mcp'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 1.0,
+                 response_mode: str = 'sse'):
+        """
+        Args:
+            latency: 每次工具调用的耗时（秒）
+            response_mode: 响应格式，sse 或 json
+        """
+        super().__init__(host, port)
+        self.latency = latency
+        self.response_mode = response_mode
+        self._sessions = set()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.address}/mcp"
+
+    def _result(self, message: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        method = message.get('method')
+        params = message.get('params') or {}
+        if method == 'initialize':
+            result = {
+                'protocolVersion': params.get('protocolVersion', '2025-03-26'),
+                'capabilities': {'tools': {}},
+                'serverInfo': {'name': 'fake-xiaohongshu-mcp', 'version': '0.0.0'}
+            }
+        elif method == 'ping':
+            result = {}
+        elif method == 'tools/list':
+            result = {'tools': [{'name': name, 'inputSchema': {'type': 'object'}} for name in MCP_TOOLS]}
+        elif method == 'tools/call':
+            name = params.get('name')
+            if name not in MCP_TOOLS:
+                return {'jsonrpc': '2.0', 'id': message.get('id'),
+                        'error': {'code': -32602, 'message': f"unknown tool: {name}"}}
+            time.sleep(self.latency)
+            text = '发布成功' if name.startswith('publish') else json.dumps({'tool': name, 'session': session_id})
+            result = {'content': [{'type': 'text', 'text': text}], 'isError': False}
+        else:
+            return {'jsonrpc': '2.0', 'id': message.get('id'),
+                    'error': {'code': -32601, 'message': f"method not found: {method}"}}
+        return {'jsonrpc': '2.0', 'id': message.get('id'), 'result': result}
+
+    def handle_post(self, handler: _Handler) -> None:
+        body = handler.read_json()
+        messages = body if isinstance(body, list) else [body]
+
+        session_id = handler.headers.get('Mcp-Session-Id')
+        initializing = any(m.get('method') == 'initialize' for m in messages if isinstance(m, dict))
+        with self._lock:
+            if initializing:
+                session_id = uuid.uuid4().hex
+                self._sessions.add(session_id)
+            elif session_id not in self._sessions:
+                handler.send_empty(404)
+                return
+
+        requests_ = [m for m in messages if isinstance(m, dict) and 'id' in m and 'method' in m]
+        if not requests_:
+            # 只有通知或响应
+            handler.send_empty(202)
+            return
+
+        headers = {'Mcp-Session-Id': session_id}
+        results = [self._result(m, session_id) for m in requests_]
+        if self.response_mode == 'json':
+            handler.send_json(200, results if isinstance(body, list) else results[0], headers)
+            return
+
+        handler.start_event_stream(headers)
+        for result in results:
+            handler.write_chunk(f"event: message\ndata: {json.dumps(result, ensure_ascii=False)}\n\n".encode('utf-8'))
+        handler.end_event_stream()
+
+    def handle_get(self, handler: _Handler) -> None:
+        # 不提供服务器推送流，客户端收到 405 后不再尝试
+        handler.send_empty(405)
+
+    def handle_delete(self, handler: _Handler) -> None:
+        with self._lock:
+            self._sessions.discard(handler.headers.get('Mcp-Session-Id'))
+        handler.send_empty(200)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='启动 DeepSeek、OpenRouter 和小红书 MCP 的本地替身服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--deepseek-port', type=int, default=18001)
+    parser.add_argument('--openrouter-port', type=int, default=18002)
+    parser.add_argument('--mcp-port', type=int, default=18003)
+    parser.add_argument('--latency', type=float, default=0.5, help='DeepSeek 首 token 延迟（秒）')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='DeepSeek 每秒生成的 token 数，<= 0 不限速')
+    parser.add_argument('--completion-tokens', type=int, default=300, help='DeepSeek 每次回复的 token 数')
+    parser.add_argument('--image-latency', type=float, default=3.0, help='每张图片的生成耗时（秒）')
+    parser.add_argument('--mcp-latency', type=float, default=1.0, help='每次 MCP 工具调用的耗时（秒）')
+    parser.add_argument('--mcp-mode', choices=['sse', 'json'], default='sse', help='MCP 响应格式')
+    parser.add_argument('--verbose', action='store_true', help='打印每个请求')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    deepseek = FakeDeepSeekServer(args.host, args.deepseek_port, args.latency, args.tokens_per_second,
+                                  args.completion_tokens).start()
+    openrouter = FakeOpenRouterServer(args.host, args.openrouter_port, args.image_latency).start()
+    mcp = FakeMCPServer(args.host, args.mcp_port, args.mcp_latency, args.mcp_mode).start()
+
+    print("替身服务器已启动，启动应用前设置以下环境变量：")
+    print(f"export OPENAI_BASE_URL={deepseek.base_url}")
+    print(f"export OPENROUTER_BASE_URL={openrouter.base_url}")
+    print(f"export MCP_BASE_URL={mcp.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in (deepseek, openrouter, mcp):
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+HackerChain 接口压测工具
+按接口依次发起并发请求，统计吞吐量和 p50/p95/p99 延迟
+
+用法：
+    python benchmarks/load_test.py --base-url http://127.0.0.1:5001 --requests 100 --concurrency 8
+    python benchmarks/load_test.py --endpoints chat,extract --json results.json
+配合 benchmarks/fake_servers.py 使用时，模型和 MCP 的耗时由替身服务器的参数决定
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+_TOPICS = ['大学生实习匹配', '老年人智能手机助手', '社区二手交换', '校园跑腿', '宠物健康记录', '独立音乐人发行',
+           '农产品直播带货', '远程办公协作', '儿童编程启蒙', '健身饮食规划', '旧衣回收', '城市骑行路线']
+_ASPECTS = ['目标用户是谁', '怎么盈利', '技术上怎么实现', '有哪些竞品', '第一步做什么', '怎么在黑客松上演示',
+            '需要什么样的团队', '怎么获取第一批用户', '有哪些风险', '数据从哪里来']
+
+
+def _dialog(rng: random.Random) -> List[Dict[str, str]]:
+    """随机生成一段对话；主题和追问各不相同，不会命中分析缓存和近似对话复用"""
+    topic = rng.choice(_TOPICS)
+    dialog = [{'role': 'user', 'content': f"我想做一个{topic}的项目，参加黑客马拉松，请帮我梳理一下思路。"}]
+    for aspect in rng.sample(_ASPECTS, 4):
+        dialog.append({'role': 'assistant', 'content': f"关于{topic}，{aspect}是关键问题之一，编号 {rng.getrandbits(128):032x}。"})
+        dialog.append({'role': 'user', 'content': f"那{aspect}具体应该怎么考虑？"})
+    return dialog
+
+
+def _analysis(rng: random.Random) -> Dict[str, str]:
+    topic = rng.choice(_TOPICS)
+    return {
+        'image_prompt': f"{topic}项目的宣传海报，科技感，蓝紫色渐变（{rng.getrandbits(32):08x}）",
+        'html_prompt': f"为{topic}项目制作一个介绍页面",
+        'xiaohongshu_title': f"{topic}项目"[:20],
+        'xiaohongshu_content': f"我们在黑客松上做了一个{topic}的项目。"
+    }
+
+
+# 接口名 -> (路径, 请求体生成函数)
+ENDPOINTS: Dict[str, Tuple[str, Callable[[random.Random, argparse.Namespace], Dict[str, Any]]]] = {
+    'chat': ('/chat', lambda rng, args: {
+        'message': f"{rng.choice(_TOPICS)}这个方向{rng.choice(_ASPECTS)}？",
+        'dialog_history': _dialog(rng)[:3]
+    }),
+    'extract': ('/extract', lambda rng, args: {'dialog': _dialog(rng)}),
+    'generate_html': ('/generate_html', lambda rng, args: {'analysis': _analysis(rng)}),
+    'generate_poster': ('/generate_poster', lambda rng, args: {'analysis': _analysis(rng)}),
+    'publish_xiaohongshu': ('/publish_xiaohongshu', lambda rng, args: {
+        'title': f"压测{rng.randrange(10000)}",
+        'content': '压测内容',
+        'images': [],
+        'sync': args.publish_sync
+    })
+}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法百分位数（sorted_values 需已排序）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class EndpointResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.error_samples: List[str] = []
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            if error is not None:
+                self.errors += 1
+                if len(self.error_samples) < 3:
+                    self.error_samples.append(error)
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'endpoint': self.name,
+            'requests': count,
+            'errors': self.errors,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(count / self.elapsed, 2) if self.elapsed > 0 else 0.0,
+            'mean': round(sum(latencies) / count, 4) if count else 0.0,
+            'p50': round(percentile(latencies, 50), 4),
+            'p95': round(percentile(latencies, 95), 4),
+            'p99': round(percentile(latencies, 99), 4),
+            'max': round(latencies[-1], 4) if count else 0.0,
+            'error_samples': self.error_samples
+        }
+
+
+def run_endpoint(name: str, args: argparse.Namespace) -> EndpointResult:
+    """对一个接口发起 args.requests 个请求，最多 args.concurrency 个同时在途"""
+    path, build_body = ENDPOINTS[name]
+    url = args.base_url.rstrip('/') + path
+    result = EndpointResult(name)
+    local = threading.local()
+
+    def session() -> requests.Session:
+        # 每个线程一个连接、一个客户端ID
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.headers['X-Client-Id'] = f"bench-{uuid.uuid4().hex[:12]}"
+        return local.session
+
+    def one(index: int, measured: bool) -> None:
+        rng = random.Random(f"{args.seed}-{name}-{index}")
+        body = build_body(rng, args)
+        started = time.perf_counter()
+        error = None
+        try:
+            response = session().post(url, json=body, timeout=args.timeout,
+                                      headers={'Idempotency-Key': uuid.uuid4().hex})
+            if response.status_code >= 400:
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+        except requests.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+        if measured:
+            result.record(time.perf_counter() - started, error)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        # 预热请求不计入统计（建立连接、初始化客户端池等）
+        list(executor.map(lambda i: one(i, False), range(args.warmup)))
+        started = time.perf_counter()
+        list(executor.map(lambda i: one(args.warmup + i, True), range(args.requests)))
+        result.elapsed = time.perf_counter() - started
+    return result
+
+
+def print_table(summaries: List[Dict[str, Any]]) -> None:
+    print(f"{'endpoint':<22}{'requests':>9}{'errors':>8}{'req/s':>9}{'mean(s)':>10}"
+          f"{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}{'max(s)':>10}")
+    for s in summaries:
+        print(f"{s['endpoint']:<22}{s['requests']:>9}{s['errors']:>8}{s['throughput']:>9.2f}{s['mean']:>10.3f}"
+              f"{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}")
+    for summary in summaries:
+        for sample in summary['error_samples']:
+            print(f"[{summary['endpoint']}] {sample}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='HackerChain 接口压测')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5001', help='应用地址')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help=f"要压测的接口，逗号分隔（可选：{', '.join(ENDPOINTS)}）")
+    parser.add_argument('--requests', type=int, default=50, help='每个接口的请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('--warmup', type=int, default=2, help='每个接口不计入统计的预热请求数')
+    parser.add_argument('--timeout', type=float, default=600, help='单个请求的超时（秒）')
+    parser.add_argument('--publish-sync', action='store_true',
+                        help='/publish_xiaohongshu 在请求内直接发布（默认只测入队）')
+    parser.add_argument('--seed', default='hackerchain', help='请求内容的随机种子，相同种子生成相同的请求')
+    parser.add_argument('--json', dest='json_path', help='把结果写入 JSON 文件，便于比较不同版本')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"未知的接口: {', '.join(unknown)}")
+
+    summaries = []
+    for name in names:
+        print(f"压测 {name}：{args.requests} 个请求，并发 {args.concurrency}...", file=sys.stderr)
+        summaries.append(run_endpoint(name, args).summary())
+    print_table(summaries)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'base_url': args.base_url,
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'publish_sync': args.publish_sync,
+                'results': summaries
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
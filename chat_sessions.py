@@ -0,0 +1,215 @@
+"""
+服务端聊天会话
+保存每个会话的对话历史，客户端每轮只需发送新消息；
+历史超过 token 阈值后，较早的轮次会被压缩进滚动摘要，限制每轮发给模型的上下文长度。
+会话保存在状态存储中，使用 SQLite/Redis 后端时多个进程共享同一批会话
+"""
+
+import logging
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from state_store import MemoryStateStore, StateStore
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个计，其余字符按 4 个 1 个计"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ChatSession:
+    """会话快照；修改都通过 ChatSessionStore 写回状态存储"""
+
+    def __init__(self, session_id: str, summary: str = '', messages: Optional[List[Dict[str, str]]] = None,
+                 created_at: Optional[float] = None, updated_at: Optional[float] = None):
+        self.id = session_id
+        self.summary = summary
+        self.messages: List[Dict[str, str]] = messages or []
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    def token_count(self) -> int:
+        return estimate_tokens(self.summary) + sum(estimate_tokens(m['content']) for m in self.messages)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'summary': self.summary,
+            'messages': self.messages,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> 'ChatSession':
+        return cls(record['id'], record.get('summary', ''), record.get('messages', []),
+                   record.get('created_at'), record.get('updated_at'))
+
+
+class ChatSessionStore:
+    # 会话在状态存储中的键前缀
+    KEY_PREFIX = 'chat:'
+    # 压缩占用会话的最长时间（秒），执行压缩的进程异常退出后，超时即可由其他进程重新压缩
+    COMPACTION_LEASE = 600
+
+    def __init__(self, summarizer: Callable[[str, List[Dict[str, str]]], str], max_sessions: int = 1000,
+                 idle_ttl: int = 24 * 3600, token_threshold: int = 6000, keep_recent_turns: int = 6,
+                 store: Optional[StateStore] = None):
+        """
+        初始化会话存储
+
+        Args:
+            summarizer: 摘要函数 (已有摘要, 待压缩的消息) -> 新摘要
+            max_sessions: 最多保留的会话数，超过时淘汰最久未使用的（仅对默认的进程内存储生效）
+            idle_ttl: 会话闲置多久后过期（秒）
+            token_threshold: 摘要加历史的估算 token 数超过该值时触发压缩
+            keep_recent_turns: 压缩时保留原文的最近轮数
+            store: 保存会话的状态存储，None 表示只保存在本进程内
+        """
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_threshold = token_threshold
+        self.keep_recent_turns = keep_recent_turns
+        self.store = store if store is not None else MemoryStateStore(max_entries=max_sessions)
+
+        # 摘要在后台执行，不拖慢当前这一轮回复
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-summary')
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"{ChatSessionStore.KEY_PREFIX}{session_id}"
+
+    def _remaining_ttl(self, record: Dict[str, Any]) -> float:
+        """保持会话原有的过期时间（按最后一轮对话计算）"""
+        return max(1.0, record['updated_at'] + self.idle_ttl - time.time())
+
+    def create(self, history: Optional[List[Dict[str, str]]] = None) -> ChatSession:
+        """新建会话，可用客户端已有的对话历史作为初始内容"""
+        session = ChatSession(uuid.uuid4().hex)
+        for item in history or []:
+            if item.get('role') in ('user', 'assistant') and item.get('content'):
+                session.messages.append({'role': item['role'], 'content': item['content']})
+
+        self.store.set(self._key(session.id), session.to_dict(), ttl=self.idle_ttl)
+
+        logger.info(f"新建聊天会话: {session.id}（初始消息 {len(session.messages)} 条）")
+        self.schedule_compaction(session)
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        record = self.store.get(self._key(session_id))
+        if record is None:
+            return None
+        return ChatSession.from_dict(record)
+
+    def build_messages(self, session: ChatSession, user_message: str) -> List[Dict[str, str]]:
+        """构建发给模型的上下文：滚动摘要 + 最近的对话 + 当前消息"""
+        messages = []
+        if session.summary:
+            messages.append({
+                'role': 'system',
+                'content': f"以下是你与用户此前对话的摘要，请在回答时参考：\n{session.summary}"
+            })
+        messages.extend(session.messages)
+        messages.append({'role': 'user', 'content': user_message})
+        return messages
+
+    def append_turn(self, session: ChatSession, user_message: str, reply: str) -> None:
+        """记录一轮完整的问答，并在需要时触发压缩；会话已过期时不再记录"""
+        def append(record):
+            if record is None:
+                return None
+            record['messages'] = record['messages'] + [
+                {'role': 'user', 'content': user_message},
+                {'role': 'assistant', 'content': reply}
+            ]
+            record['updated_at'] = time.time()
+            return record
+
+        # 在状态存储中原子追加，同一会话的并发请求（可能在不同进程中）不会互相覆盖
+        record = self.store.update(self._key(session.id), append, ttl=self.idle_ttl)
+        if record is None:
+            logger.info(f"会话 {session.id} 已过期，本轮未记录")
+            return
+        updated = ChatSession.from_dict(record)
+        session.summary, session.messages, session.updated_at = updated.summary, updated.messages, updated.updated_at
+        self.schedule_compaction(session)
+
+    def schedule_compaction(self, session: ChatSession) -> None:
+        if session.token_count() <= self.token_threshold:
+            return
+        if len(session.messages) <= self.keep_recent_turns * 2:
+            return
+
+        claimed = False
+
+        def claim(record):
+            # 同一时间只有一个进程压缩该会话
+            nonlocal claimed
+            claimed = False
+            if record is None or record.get('compacting_until', 0) > time.time():
+                return record
+            claimed = True
+            record['compacting_until'] = time.time() + self.COMPACTION_LEASE
+            return record
+
+        record = self.store.get(self._key(session.id))
+        if record is None:
+            return
+        self.store.update(self._key(session.id), claim, ttl=self._remaining_ttl(record))
+        if claimed:
+            self._executor.submit(self._compact, session.id)
+
+    def _compact(self, session_id: str) -> None:
+        """把较早的轮次合并进摘要，只保留最近 keep_recent_turns 轮原文"""
+        key = self._key(session_id)
+        # (cutoff, 被摘要的消息, 原摘要, 新摘要)
+        result = None
+        try:
+            record = self.store.get(key)
+            if record is not None:
+                cutoff = len(record['messages']) - self.keep_recent_turns * 2
+                if cutoff > 0:
+                    old_messages = record['messages'][:cutoff]
+                    previous_summary = record.get('summary', '')
+                    summary = self.summarizer(previous_summary, old_messages).strip()
+                    result = (cutoff, old_messages, previous_summary, summary)
+        except Exception as e:
+            logger.error(f"会话摘要失败 {session_id}: {e}")
+
+        applied = False
+
+        def apply(current):
+            # 写回摘要并释放压缩占用
+            nonlocal applied
+            applied = False
+            if current is None:
+                return None
+            current.pop('compacting_until', None)
+            if result is not None:
+                cutoff, old_messages, previous_summary, summary = result
+                # 压缩期间只会在末尾追加新消息；前 cutoff 条已不是被摘要的那部分时放弃本次结果
+                if current['messages'][:cutoff] == old_messages and current.get('summary', '') == previous_summary:
+                    current['messages'] = current['messages'][cutoff:]
+                    current['summary'] = summary
+                    applied = True
+            return current
+
+        current = self.store.get(key)
+        if current is None:
+            return
+        record = self.store.update(key, apply, ttl=self._remaining_ttl(current))
+        if applied:
+            tokens = ChatSession.from_dict(record).token_count()
+            logger.info(f"会话 {session_id} 已压缩 {len(result[1])} 条消息，当前约 {tokens} tokens")
@@ -0,0 +1,276 @@
+"""
+近似对话检测
+对规范化后的对话文本取字符 shingle 计算 64 位 SimHash，按分段（banding）建倒排索引，
+只比较至少一段完全相同的候选，找出与历史对话相似度不低于阈值的分析结果
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，此时不加文件锁（只适合单进程）
+    fcntl = None
+
+from analysis_cache import normalize_dialog_text
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+
+
+def _shingles(text: str, size: int) -> Counter:
+    """字符级 shingle（中文没有空格分词，按字符切分更稳定），返回 shingle -> 出现次数"""
+    text = ''.join(normalize_dialog_text(text).lower().split())
+    if len(text) <= size:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+def simhash(text: str, shingle_size: int = 4) -> int:
+    """
+    计算文本的 64 位 SimHash
+
+    Args:
+        text: 对话文本
+        shingle_size: 每个 shingle 的字符数
+
+    Returns:
+        指纹；内容相近的文本指纹的汉明距离也小
+    """
+    weights = [0] * FINGERPRINT_BITS
+    for shingle, count in _shingles(text, shingle_size).items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def similarity(a: int, b: int) -> float:
+    """两个指纹的相似度：1 - 汉明距离 / 64"""
+    return 1 - bin(a ^ b).count('1') / FINGERPRINT_BITS
+
+
+class SimHashIndex:
+    def __init__(self, threshold: float = 0.9, max_entries: int = 10000, path: Optional[str] = None,
+                 shingle_size: int = 4, min_length: int = 50, min_length_ratio: float = 0.8):
+        """
+        初始化相似对话索引
+
+        Args:
+            threshold: 相似度阈值（0~1），不低于该值视为近似对话
+            max_entries: 最多保留的对话数，超出时淘汰最久未使用的
+            path: 持久化文件（JSONL，追加写入，可被多个进程共享），None 表示只保存在内存中
+            shingle_size: 每个 shingle 的字符数
+            min_length: 规范化后短于该长度的对话不参与匹配（短文本的指纹不可靠）
+            min_length_ratio: 两段对话长度之比低于该值时不视为近似
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+        self.shingle_size = shingle_size
+        self.min_length = min_length
+        self.min_length_ratio = min_length_ratio
+
+        # 汉明距离不超过 max_distance 的两个指纹，分成 max_distance + 1 段后至少有一段完全相同
+        self.max_distance = max(0, int((1 - threshold) * FINGERPRINT_BITS + 1e-9))
+        self._bands = self._split_bands(min(self.max_distance + 1, FINGERPRINT_BITS))
+
+        # 键 -> (指纹, 规范化后的长度)
+        self._entries: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+        self._persisted_lines = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    @staticmethod
+    def _split_bands(count: int) -> List[Tuple[int, int]]:
+        """把 64 位尽量均分为 count 段，返回 (起始位, 掩码) 列表"""
+        bands = []
+        start = 0
+        for i in range(count):
+            width = FINGERPRINT_BITS // count + (1 if i < FINGERPRINT_BITS % count else 0)
+            bands.append((start, (1 << width) - 1))
+            start += width
+        return bands
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        return [(i, fingerprint >> start & mask) for i, (start, mask) in enumerate(self._bands)]
+
+    def _measure(self, text: str) -> Tuple[int, int]:
+        length = len(''.join(normalize_dialog_text(text).split()))
+        return simhash(text, self.shingle_size), length
+
+    def _insert(self, key: str, fingerprint: int, length: int) -> bool:
+        """加入索引（调用方需持有锁），返回是否为新条目"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return False
+        self._entries[key] = (fingerprint, length)
+        for band in self._band_keys(fingerprint):
+            self._buckets.setdefault(band, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._delete(oldest)
+        return True
+
+    def _delete(self, key: str) -> None:
+        """移出索引（调用方需持有锁）"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in self._band_keys(entry[0]):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def add(self, key: str, text: str) -> None:
+        """
+        记录一段对话
+
+        Args:
+            key: 对话的缓存键（dialog_hash）
+            text: 对话文本
+        """
+        fingerprint, length = self._measure(text)
+        if length < self.min_length:
+            return
+        with self._lock:
+            if self._insert(key, fingerprint, length) and self.path:
+                self._append(key, fingerprint, length)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._delete(key)
+
+    def find(self, text: str) -> Optional[Tuple[str, float]]:
+        """
+        查找最相似的历史对话
+
+        Args:
+            text: 对话文本
+
+        Returns:
+            (缓存键, 相似度)，没有不低于阈值的对话时返回 None
+        """
+        fingerprint, length = self._measure(text)
+        if length < self.min_length:
+            return None
+
+        best = None
+        with self._lock:
+            candidates = set()
+            for band in self._band_keys(fingerprint):
+                candidates |= self._buckets.get(band, set())
+
+            for key in candidates:
+                other, other_length = self._entries[key]
+                # 长度差距过大（如在原对话后追加了大段新内容）时不算近似
+                if min(length, other_length) / max(length, other_length) < self.min_length_ratio:
+                    continue
+                score = similarity(fingerprint, other)
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (key, score)
+
+            if best is not None:
+                self._entries.move_to_end(best[0])
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ===== 持久化 =====
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._persisted_lines += 1
+                    try:
+                        record = json.loads(line)
+                        self._insert(record['key'], int(record['fingerprint'], 16), int(record['length']))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"读取相似对话索引失败 {self.path}: {e}")
+            return
+        logger.info(f"已加载相似对话索引: {len(self._entries)} 条")
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """
+        跨进程的文件锁：多个 worker 共享同一个持久化文件，
+        压缩时的重写与其他进程的追加互斥，避免追加写到已被替换的旧文件中而丢失
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, key: str, fingerprint: int, length: int) -> None:
+        """追加一条记录（调用方需持有锁）；记录数超过容量两倍时压缩文件"""
+        record = {'key': key, 'fingerprint': f"{fingerprint:016x}", 'length': length}
+        try:
+            with self._file_lock():
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + '\n')
+                self._persisted_lines += 1
+                if self._persisted_lines >= 2 * self.max_entries:
+                    self._compact()
+        except OSError as e:
+            logger.warning(f"写入相似对话索引失败 {self.path}: {e}")
+
+    def _compact(self) -> None:
+        """
+        重写持久化文件，每个键只保留最后一条记录、最多 max_entries 条（调用方需持有锁和文件锁）。
+        以文件内容而不是本进程的内存索引为准，其他进程写入的条目不会丢失
+        """
+        records: "OrderedDict[str, str]" = OrderedDict()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        key = json.loads(line)['key']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    # 后写入的记录更新，移到末尾
+                    records.pop(key, None)
+                    records[key] = line if line.endswith('\n') else line + '\n'
+            while len(records) > self.max_entries:
+                records.popitem(last=False)
+
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(records.values())
+            os.replace(tmp_path, self.path)
+            self._persisted_lines = len(records)
+        except OSError as e:
+            logger.warning(f"压缩相似对话索引失败 {self.path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
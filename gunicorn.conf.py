@@ -0,0 +1,46 @@
+"""
+多进程部署配置（gunicorn 预派生 worker）
+
+用法：
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py    # 每个 worker 运行异步模式，需要 uvicorn 和 asgiref
+
+聊天会话、后台任务和每个客户端最新的分析结果保存在共享状态存储中（默认 sqlite，
+可设置 STATE_BACKEND=redis），请求落在任意 worker 上都能取到
+"""
+
+import multiprocessing
+import os
+
+# 多个 worker 之间必须共享状态；未显式配置时使用同一台机器上的 SQLite
+os.environ.setdefault('STATE_BACKEND', 'sqlite')
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('FLASK_PORT', '5001')}")
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+
+if os.getenv('SERVER_MODE', 'wsgi').lower() == 'asgi':
+    wsgi_app = 'asgi_app:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'main_deepssek:app'
+    # 请求大部分时间在等待上游模型，每个 worker 用线程承载并发
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# 推理模型和图像生成可能需要数分钟，SSE 流式响应期间 worker 也不能被判定为超时
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '600'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '60'))
+keepalive = 5
+
+# 不在 master 中预加载应用：模块导入时会启动线程池、MCP 预热线程和发布队列 worker，
+# 并创建连接池和 SQLite 连接，这些都不能跨 fork 使用，因此每个 worker 自行导入
+preload_app = False
+
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """worker fork 并加载应用后，预先建立到模型服务的连接"""
+    import main_deepssek
+    main_deepssek.warm_up_worker()
@@ -0,0 +1,195 @@
+"""
+生成页面的发布优化
+压缩HTML，把内联的 CSS/JS 抽成按内容哈希命名的外部文件（相同内容只保存一份），
+并预先生成 gzip/brotli 压缩版本，供 /pages/ 按 Accept-Encoding 直接返回
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 内容原样保留、不压缩空白的元素
+_PRESERVED_BLOCK = re.compile(r'(<(pre|textarea|script|style)\b[^>]*>.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+# 条件注释（<!--[if IE]>）保留
+_HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+_WHITESPACE = re.compile(r'\s+')
+_INLINE_STYLE = re.compile(r'<style\b([^>]*)>(.*?)</style\s*>', re.IGNORECASE | re.DOTALL)
+_INLINE_SCRIPT = re.compile(r'<script\b([^>]*)>(.*?)</script\s*>', re.IGNORECASE | re.DOTALL)
+_TYPE_ATTR = re.compile(r'\btype\s*=\s*["\']?([^"\'\s>]+)', re.IGNORECASE)
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+_CSS_PUNCTUATION = re.compile(r'\s*([{};])\s*')
+
+# 只有这些类型的脚本会被抽出（JSON 数据、模板等保持内联）
+_CLASSIC_SCRIPT_TYPES = ('', 'text/javascript', 'application/javascript', 'module')
+
+_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+MIMETYPES = {
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.js': 'application/javascript'
+}
+
+
+def minify_css(css: str) -> str:
+    """去掉注释、合并空白，删除花括号和分号两侧的空白"""
+    css = _CSS_COMMENT.sub('', css)
+    css = _WHITESPACE.sub(' ', css)
+    return _CSS_PUNCTUATION.sub(r'\1', css).strip()
+
+
+def minify_html(html: str) -> str:
+    """去掉注释并合并连续空白；pre/textarea/script/style 中的内容保持不变"""
+    parts = _PRESERVED_BLOCK.split(html)
+    output = []
+    # split 的结果依次为：普通文本、保留块、保留块的标签名、普通文本……
+    for i in range(0, len(parts), 3):
+        text = _HTML_COMMENT.sub('', parts[i])
+        output.append(_WHITESPACE.sub(' ', text))
+        if i + 1 < len(parts):
+            output.append(parts[i + 1])
+    return ''.join(output).strip()
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """解析 Accept-Encoding，返回 编码 -> q 值"""
+    accepted = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+class HTMLOptimizer:
+    def __init__(self, root: str = "generated_pages", url_prefix: str = "/pages",
+                 min_compress_size: int = 256):
+        """
+        初始化页面优化器
+
+        Args:
+            root: 优化后页面和静态资源的保存目录
+            url_prefix: 页面对外访问的URL前缀
+            min_compress_size: 小于该字节数的文件不生成压缩版本
+        """
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+        self.min_compress_size = min_compress_size
+        os.makedirs(os.path.join(root, 'assets'), exist_ok=True)
+
+    @property
+    def encodings(self) -> Tuple[str, ...]:
+        """预压缩的编码，按优先顺序"""
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _store(self, relative_path: str, data: bytes) -> None:
+        """保存文件及其压缩版本；文件名含内容哈希，已存在时跳过"""
+        path = os.path.join(self.root, relative_path)
+        if os.path.exists(path):
+            return
+        if len(data) >= self.min_compress_size:
+            # mtime 固定为 0，相同内容得到相同的 gzip 文件
+            self._atomic_write(path + _SUFFIXES['gzip'], gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._atomic_write(path + _SUFFIXES['br'], brotli.compress(data, mode=brotli.MODE_TEXT))
+        # 原始文件最后写入，它存在即表示压缩版本也已就绪
+        self._atomic_write(path, data)
+
+    def _store_asset(self, content: str, ext: str) -> str:
+        """保存抽出的 CSS/JS，返回其URL"""
+        data = content.encode('utf-8')
+        name = f"{hashlib.sha256(data).hexdigest()[:16]}{ext}"
+        self._store(f"assets/{name}", data)
+        return f"{self.url_prefix}/assets/{name}"
+
+    def _extract_style(self, match: re.Match) -> str:
+        attrs, css = match.group(1), match.group(2)
+        css = minify_css(css)
+        if not css:
+            return ''
+        media = re.search(r'\bmedia\s*=\s*(["\'][^"\']*["\'])', attrs, re.IGNORECASE)
+        media_attr = f" media={media.group(1)}" if media else ''
+        return f'<link rel="stylesheet" href="{self._store_asset(css, ".css")}"{media_attr}>'
+
+    def _extract_script(self, match: re.Match) -> str:
+        attrs, js = match.group(1), match.group(2)
+        script_type = _TYPE_ATTR.search(attrs)
+        script_type = script_type.group(1).lower() if script_type else ''
+        if 'src=' in attrs.lower() or script_type not in _CLASSIC_SCRIPT_TYPES or not js.strip():
+            return match.group(0)
+        # 外部经典脚本同样在原位置同步执行，顺序不变
+        type_attr = ' type="module"' if script_type == 'module' else ''
+        return f'<script src="{self._store_asset(js.strip(), ".js")}"{type_attr}></script>'
+
+    def optimize(self, html: str) -> Dict[str, object]:
+        """
+        优化并发布一个页面
+
+        Args:
+            html: 原始HTML
+
+        Returns:
+            包含 page_url（内容哈希URL）、path、original_size、optimized_size 的字典
+        """
+        optimized = _INLINE_STYLE.sub(self._extract_style, html)
+        optimized = _INLINE_SCRIPT.sub(self._extract_script, optimized)
+        optimized = minify_html(optimized)
+
+        data = optimized.encode('utf-8')
+        name = f"{hashlib.sha256(data).hexdigest()[:16]}.html"
+        self._store(name, data)
+
+        original_size = len(html.encode('utf-8'))
+        logger.info(f"页面已优化: {name}（{original_size} -> {len(data)} 字节）")
+        return {
+            'page_url': f"{self.url_prefix}/{name}",
+            'path': os.path.join(self.root, name),
+            'original_size': original_size,
+            'optimized_size': len(data)
+        }
+
+    def choose_variant(self, filename: str, accept_encoding: Optional[str]) -> Tuple[str, Optional[str]]:
+        """
+        根据 Accept-Encoding 选择要返回的文件
+
+        Returns:
+            (相对 root 的文件名, Content-Encoding 或 None)
+        """
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in self.encodings:
+            q = accepted[encoding] if encoding in accepted else accepted.get('*', 0.0)
+            variant = filename + _SUFFIXES[encoding]
+            if q > 0 and os.path.isfile(os.path.join(self.root, variant)):
+                return variant, encoding
+        return filename, None
@@ -0,0 +1,111 @@
+"""
+流式生成HTML的辅助工具
+模型输出边到达边清理（去掉 markdown 代码块标记、补上 doctype），
+同时写入临时文件，生成完成后再原子重命名为正式文件
+"""
+
+import logging
+import os
+import re
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DOCTYPE = '<!DOCTYPE'
+_FENCES = ('```html', '```')
+_FENCE_TAIL = re.compile(r'`+(?:h(?:t(?:m(?:l)?)?)?)?$')
+
+
+def _strip_fences(text: str) -> str:
+    for fence in _FENCES:
+        text = text.replace(fence, '')
+    return text
+
+
+class HTMLStreamCleaner:
+    """
+    clean_html_response 的增量版本：逐段输入模型输出，返回可以立即转发的HTML。
+    跨段的代码块标记、开头的空白和末尾的空白会暂缓输出，拼接结果与一次性清理相同
+    （仅连续多组反引号嵌套这类病态输出可能略有差别）
+    """
+
+    def __init__(self):
+        # 末尾可能是代码块标记前半部分的文本
+        self._pending = ''
+        # 开头尚不足以判断是否以 doctype 开始的文本
+        self._head = ''
+        # 末尾的空白，后面还有内容时才输出
+        self._trailing = ''
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        """输入一段模型输出，返回清理后可输出的部分"""
+        text = self._pending + text
+        # 结尾的反引号（及其后的 html 前缀）可能与下一段组成代码块标记，等下一段再判断
+        match = _FENCE_TAIL.search(text)
+        cut = match.start() if match else len(text)
+        cleaned = _strip_fences(text[:cut])
+        # 去掉标记后露出的结尾反引号同样可能与后文组成标记
+        kept = cleaned.rstrip('`')
+        self._pending = cleaned[len(kept):] + text[cut:]
+        return self._emit(kept)
+
+    def close(self) -> str:
+        """输入结束，返回剩余的部分（末尾空白丢弃）"""
+        text = _strip_fences(self._pending)
+        self._pending = ''
+        output = self._emit(text, final=True)
+        self._trailing = ''
+        return output
+
+    def _emit(self, text: str, final: bool = False) -> str:
+        if not self._started:
+            text = (self._head + text).lstrip()
+            if not final and len(text) < len(DOCTYPE) and DOCTYPE.startswith(text):
+                self._head = text
+                return ''
+            self._head = ''
+            if not text:
+                return ''
+            self._started = True
+            if not text.startswith(DOCTYPE):
+                text = '<!DOCTYPE html>\n' + text
+
+        text = self._trailing + text
+        stripped = text.rstrip()
+        self._trailing = text[len(stripped):]
+        return stripped
+
+
+class AtomicFileWriter:
+    """
+    边写边落盘到同目录下独占的临时文件（<文件名>.xxxx.part），commit 时重命名为正式文件；
+    中途失败则删除临时文件。多个请求同时写同一个正式文件时不会互相截断临时文件
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, self.part_path = tempfile.mkstemp(dir=directory or '.', prefix=f"{os.path.basename(path)}.",
+                                              suffix='.part')
+        # mkstemp 创建的文件只有所有者可读，改为与普通写入的文件一致
+        os.chmod(self.part_path, 0o644)
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+
+    def write(self, text: str) -> None:
+        if text:
+            self._file.write(text)
+
+    def commit(self) -> str:
+        self._file.close()
+        os.replace(self.part_path, self.path)
+        logger.info(f"HTML已保存到: {self.path}")
+        return self.path
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
@@ -0,0 +1,150 @@
+"""
+生成图片的衍生版本
+在后台线程池中为原图生成缩略图以及 WebP/AVIF 版本，前端先加载小图，需要时再取原图。
+依赖 Pillow；未安装时该功能自动关闭
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = "derived"
+
+
+def _avif_supported() -> bool:
+    if Image is None:
+        return False
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+
+class DerivativePipeline:
+    def __init__(self, max_workers: int = 2, thumbnail_size=(360, 540), webp_quality: int = 80,
+                 avif_quality: int = 60, enable_avif: bool = True):
+        """
+        初始化衍生图片处理
+
+        Args:
+            max_workers: 后台处理线程数
+            thumbnail_size: 缩略图最大宽高（保持比例）
+            webp_quality: WebP 压缩质量
+            avif_quality: AVIF 压缩质量
+            enable_avif: 是否生成 AVIF（还需要 Pillow 支持该格式）
+        """
+        self.thumbnail_size = tuple(thumbnail_size)
+        self.webp_quality = webp_quality
+        self.avif_quality = avif_quality
+        self.avif = enable_avif and _avif_supported()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivative')
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        if not self.enabled:
+            logger.warning("未安装 Pillow，缩略图与 WebP/AVIF 衍生图已关闭")
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def derivative_paths(self, source: str) -> Dict[str, str]:
+        """原图对应的各衍生文件路径（原图按内容哈希命名，衍生文件名随之确定，可直接作为缓存）"""
+        directory, filename = os.path.split(source)
+        stem = os.path.splitext(filename)[0]
+        derived = os.path.join(directory, DERIVED_DIR)
+        paths = {
+            'thumb': os.path.join(derived, f"{stem}.thumb.webp"),
+            'webp': os.path.join(derived, f"{stem}.webp")
+        }
+        if self.avif:
+            paths['avif'] = os.path.join(derived, f"{stem}.avif")
+        return paths
+
+    def submit(self, source: str) -> Optional[Future]:
+        """提交原图的衍生处理；已全部生成时直接返回，正在处理时复用同一个任务"""
+        if not self.enabled:
+            return None
+
+        source = os.path.abspath(source)
+        paths = self.derivative_paths(source)
+        if all(os.path.exists(path) for path in paths.values()):
+            future = Future()
+            future.set_result(paths)
+            return future
+
+        with self._lock:
+            future = self._pending.get(source)
+            if future is None:
+                future = self._executor.submit(self._process, source, paths)
+                self._pending[source] = future
+                future.add_done_callback(lambda _: self._forget(source))
+            return future
+
+    def _forget(self, source: str) -> None:
+        with self._lock:
+            self._pending.pop(source, None)
+
+    def wait_for(self, derivative_path: str, timeout: float) -> bool:
+        """
+        等待某个衍生文件生成完成
+
+        Returns:
+            文件是否已存在
+        """
+        derivative_path = os.path.abspath(derivative_path)
+        if os.path.exists(derivative_path):
+            return True
+
+        with self._lock:
+            futures = list(self._pending.items())
+        for source, future in futures:
+            if derivative_path in (os.path.abspath(p) for p in self.derivative_paths(source).values()):
+                try:
+                    future.result(timeout=timeout)
+                except Exception as e:
+                    logger.warning(f"等待衍生图片失败 {derivative_path}: {e}")
+                break
+        return os.path.exists(derivative_path)
+
+    def _save(self, image, path: str, fmt: str, **options) -> None:
+        """先写临时文件再重命名"""
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        os.close(fd)
+        try:
+            image.save(tmp_path, format=fmt, **options)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _process(self, source: str, paths: Dict[str, str]) -> Dict[str, str]:
+        os.makedirs(os.path.dirname(paths['thumb']), exist_ok=True)
+
+        with Image.open(source) as original:
+            original.load()
+            image = original if original.mode in ('RGB', 'RGBA') else original.convert('RGBA')
+
+            if not os.path.exists(paths['webp']):
+                self._save(image, paths['webp'], 'WEBP', quality=self.webp_quality, method=4)
+
+            if not os.path.exists(paths['thumb']):
+                thumbnail = image.copy()
+                thumbnail.thumbnail(self.thumbnail_size, Image.LANCZOS)
+                self._save(thumbnail, paths['thumb'], 'WEBP', quality=self.webp_quality, method=4)
+
+            if 'avif' in paths and not os.path.exists(paths['avif']):
+                self._save(image, paths['avif'], 'AVIF', quality=self.avif_quality)
+
+        logger.info(f"衍生图片已生成: {os.path.basename(source)}")
+        return paths
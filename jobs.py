@@ -0,0 +1,295 @@
+"""
+后台任务管理
+长耗时的生成请求交给有界线程池执行，HTTP 请求立即返回任务ID，客户端再轮询状态与结果。
+配置共享的状态存储后，任务状态和结果同步写入其中，多进程部署时任意进程都能查询和取消任务
+"""
+
+import logging
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import tracing
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# 未完成任务在状态存储中的有效期（秒）；执行它的进程异常退出后，记录到期自动清除
+UNFINISHED_TTL = 24 * 3600
+
+
+class JobQueueFullError(Exception):
+    """排队任务过多，拒绝新任务"""
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.http_status: Optional[int] = None
+        self.error: Optional[str] = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        """任务状态（不含结果）"""
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        """保存到状态存储的完整记录（含结果）"""
+        return {
+            **self.to_dict(),
+            'result': self.result,
+            'http_status': self.http_status,
+            'cancel_requested': self.cancel_requested.is_set()
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'Job':
+        """由状态存储中的记录还原任务（其他进程提交的任务）"""
+        job = cls(record['kind'])
+        job.id = record['job_id']
+        job.status = record['status']
+        job.created_at = record['created_at']
+        job.started_at = record.get('started_at')
+        job.finished_at = record.get('finished_at')
+        job.error = record.get('error')
+        job.result = record.get('result')
+        job.http_status = record.get('http_status')
+        if record.get('cancel_requested'):
+            job.cancel_requested.set()
+        return job
+
+
+class JobManager:
+    # 任务记录在状态存储中的键前缀
+    KEY_PREFIX = 'job:'
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 32, result_ttl: int = 3600,
+                 store: Optional[StateStore] = None):
+        """
+        初始化任务管理器
+
+        Args:
+            max_workers: 同时执行的任务数
+            max_pending: 排队加执行中的任务上限（按进程计），超过则拒绝
+            result_ttl: 已完成任务保留时间（秒）
+            store: 共享任务状态的状态存储，None 表示只在本进程内可见
+        """
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[..., Tuple[Dict[str, Any], int]], *args, **kwargs) -> Job:
+        """
+        提交任务
+
+        Args:
+            kind: 任务类型（extract / generate_html / generate_poster 等）
+            fn: 任务函数，返回 (响应数据, HTTP状态码)
+
+        Returns:
+            新建的任务
+        """
+        job = Job(kind)
+        with self._lock:
+            self._prune()
+            active = sum(1 for j in self._jobs.values() if not j.finished)
+            if active >= self.max_pending:
+                raise JobQueueFullError(f"当前排队任务过多（{active}），请稍后重试")
+            self._jobs[job.id] = job
+        self._save(job)
+
+        # 任务在自己的 trace 中执行，记录提交它的请求的 trace ID 以便关联
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs, tracing.current_trace_id())
+        logger.info(f"任务已提交: {kind} {job.id}")
+        return job
+
+    def _run(self, job: Job, fn, args, kwargs, parent_trace_id: Optional[str] = None) -> None:
+        if not self._start(job):
+            return
+
+        try:
+            with tracing.trace(f"job {job.kind}", job_id=job.id, parent_trace_id=parent_trace_id) as job_trace:
+                payload, http_status = fn(*args, **kwargs)
+                job_trace.root.set(status=http_status)
+            error = payload.get('error') if http_status >= 400 else None
+        except Exception as e:
+            logger.error(f"任务执行失败 {job.kind} {job.id}: {e}")
+            traceback.print_exc()
+            payload, http_status, error = {'error': str(e)}, 500, str(e)
+
+        self._sync_cancel(job)
+        with self._lock:
+            job.finished_at = time.time()
+            if job.cancel_requested.is_set():
+                # 模型调用无法中途打断，取消后丢弃结果
+                job.status = CANCELLED
+            else:
+                job.result = payload
+                job.http_status = http_status
+                job.error = error
+                job.status = FAILED if http_status >= 400 else SUCCEEDED
+        self._save(job, finishing=True)
+        logger.info(f"任务完成: {job.kind} {job.id} -> {job.status}")
+
+    # ===== 共享状态 =====
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"{JobManager.KEY_PREFIX}{job_id}"
+
+    def _save(self, job: Job, finishing: bool = False) -> None:
+        """把任务状态写入状态存储；任务结束时若其他进程已请求取消，以取消为准"""
+        if self.store is None:
+            return
+        ttl = self.result_ttl if job.finished else UNFINISHED_TTL
+        record = job.to_record()
+        try:
+            if not finishing:
+                self.store.set(self._key(job.id), record, ttl=ttl)
+                return
+
+            def finish(current):
+                if current is not None and current.get('cancel_requested') and record['status'] != CANCELLED:
+                    record.update({'status': CANCELLED, 'result': None, 'http_status': None, 'error': None,
+                                   'cancel_requested': True})
+                return record
+            self.store.update(self._key(job.id), finish, ttl=ttl)
+        except Exception as e:
+            logger.warning(f"写入任务状态失败 {job.id}: {e}")
+
+    def _start(self, job: Job) -> bool:
+        """
+        把任务从排队中改为执行中；任务已被取消（包括其他进程的取消请求）时返回 False
+
+        共享存储中的状态通过 update() 原子地修改，与其他进程的取消请求不会互相覆盖
+        """
+        started_at = time.time()
+        record = None
+        if self.store is not None and not job.cancel_requested.is_set():
+            def start(current):
+                current = current if current is not None else job.to_record()
+                if current.get('cancel_requested') or current['status'] != QUEUED:
+                    return current
+                current.update({'status': RUNNING, 'started_at': started_at})
+                return current
+            try:
+                record = self.store.update(self._key(job.id), start, ttl=UNFINISHED_TTL)
+            except Exception as e:
+                logger.warning(f"写入任务状态失败 {job.id}: {e}")
+
+        with self._lock:
+            if record is not None and (record['status'] != RUNNING or record.get('started_at') != started_at):
+                job.cancel_requested.set()
+            if not job.cancel_requested.is_set():
+                job.status = RUNNING
+                job.started_at = started_at
+                return True
+            if not job.finished:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+        self._save(job, finishing=True)
+        return False
+
+    def _sync_cancel(self, job: Job) -> None:
+        """读取其他进程对该任务的取消请求"""
+        if self.store is None or job.cancel_requested.is_set():
+            return
+        try:
+            record = self.store.get(self._key(job.id))
+        except Exception as e:
+            logger.warning(f"读取任务状态失败 {job.id}: {e}")
+            return
+        if record and record.get('cancel_requested'):
+            job.cancel_requested.set()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """查询任务；本进程没有时从状态存储读取（其他进程提交的任务）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        record = self.store.get(self._key(job_id))
+        return Job.from_record(record) if record else None
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        取消任务：排队中的任务直接取消；执行中的任务标记为取消，完成后丢弃其结果
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job.finished:
+                    return job
+                job.cancel_requested.set()
+                if job.status == QUEUED or (job.future is not None and job.future.cancel()):
+                    job.status = CANCELLED
+                    job.finished_at = time.time()
+        if job is not None:
+            self._save(job)
+            return job
+        return self._cancel_remote(job_id)
+
+    def _cancel_remote(self, job_id: str) -> Optional[Job]:
+        """取消其他进程中的任务：记录取消请求，由执行它的进程在开始和结束时检查"""
+        if self.store is None:
+            return None
+        record = self.store.get(self._key(job_id))
+        if record is None or record['status'] in FINISHED_STATES:
+            return Job.from_record(record) if record else None
+
+        def request_cancel(record):
+            if record is None or record['status'] in FINISHED_STATES:
+                return record
+            record['cancel_requested'] = True
+            if record['status'] == QUEUED:
+                record['status'] = CANCELLED
+                record['finished_at'] = time.time()
+            return record
+
+        record = self.store.update(self._key(job_id), request_cancel, ttl=UNFINISHED_TTL)
+        return Job.from_record(record) if record else None
+
+    def _prune(self) -> None:
+        """清理过期的已完成任务（调用方需持有锁）"""
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
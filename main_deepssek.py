@@ -1,25 +1,54 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, url_for, send_from_directory
 from flask_cors import CORS
-from openai import OpenAI
 from datetime import datetime
+import asyncio
+import functools
+import glob
 import json
 import os
 import traceback
 import logging
-import base64
-from typing import List, Dict, Any
-from mcp import XiaohongshuMCPClient
-from poster_designer import design
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import quote
+from mcp import XiaohongshuMCPClientPool, MCPError, DEFAULT_CACHE_TTLS
+from poster_designer import design, design_variants, acall_image_model, OPENROUTER_API_KEY, OPENROUTER_BASE_URL
+from model_gateway import gateway
+from artifact_store import new_job_id
+from image_derivatives import DerivativePipeline, DERIVED_DIR
+from analysis_cache import AnalysisCache, dialog_hash
+from dialog_similarity import SimHashIndex
+from jobs import JobManager, JobQueueFullError, CANCELLED
+from chat_sessions import ChatSessionStore
+from state_store import create_state_store
+from publish_queue import PublishQueue, PublishError
+from html_stream import HTMLStreamCleaner, AtomicFileWriter
+from html_optimizer import HTMLOptimizer, MIMETYPES as HTML_MIMETYPES
+import metrics
+import tracing
 
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
 )
+# 日志中带上当前请求的 trace ID
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(tracing.TraceIdFilter())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+# 请求耗时、在途请求数等指标，/metrics 输出
+metrics.init_app(app)
+# 每个请求一个 trace，响应头 X-Request-Id 返回 trace ID
+tracing.init_app(app)
+
+# 生成的图片等产物所在目录，通过 /artifacts/ 对外提供
+ARTIFACT_ROOT = "output"
 
 # ===== 配置管理 =====
 class Config:
@@ -30,87 +59,188 @@ class Config:
         self.deepseek_model = os.getenv('DEEPSEEK_MODEL', 'deepseek-reasoner')
         self.flask_debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
         self.flask_port = int(os.getenv('FLASK_PORT', '5001'))
+        # 对话分析结果缓存
+        self.analysis_cache_memory_entries = int(os.getenv('ANALYSIS_CACHE_MEMORY_ENTRIES', '256'))
+        self.analysis_cache_disk_entries = int(os.getenv('ANALYSIS_CACHE_DISK_ENTRIES', '2048'))
+        self.analysis_cache_ttl = int(os.getenv('ANALYSIS_CACHE_TTL', str(7 * 24 * 3600)))
+        # 近似对话复用：reuse 直接返回相似对话的分析结果，preview 先返回它再后台重新分析，off 关闭
+        self.dialog_similarity_mode = os.getenv('DIALOG_SIMILARITY_MODE', 'preview').lower()
+        self.dialog_similarity_threshold = float(os.getenv('DIALOG_SIMILARITY_THRESHOLD', '0.9'))
+        self.dialog_similarity_max_entries = int(os.getenv('DIALOG_SIMILARITY_MAX_ENTRIES', '10000'))
+        # 后台任务（/extract、/generate_html、/generate_poster 的异步模式）
+        self.job_workers = int(os.getenv('JOB_WORKERS', '4'))
+        self.job_max_pending = int(os.getenv('JOB_MAX_PENDING', '32'))
+        self.job_result_ttl = int(os.getenv('JOB_RESULT_TTL', '3600'))
+        # 会话级状态存储（memory 仅限单进程；多进程部署请使用 sqlite 或 redis）
+        self.state_backend = os.getenv('STATE_BACKEND', 'memory')
+        self.state_sqlite_path = os.getenv('STATE_SQLITE_PATH', os.path.join('state', 'state.db'))
+        self.state_redis_url = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+        self.state_max_entries = int(os.getenv('STATE_MAX_ENTRIES', '10000'))
+        self.state_max_bytes = int(os.getenv('STATE_MAX_BYTES', str(64 * 1024 * 1024)))
+        self.analysis_state_ttl = int(os.getenv('ANALYSIS_STATE_TTL', str(24 * 3600)))
+        # 服务端聊天会话
+        self.chat_session_max = int(os.getenv('CHAT_SESSION_MAX', '1000'))
+        self.chat_session_ttl = int(os.getenv('CHAT_SESSION_TTL', str(24 * 3600)))
+        self.chat_summary_token_threshold = int(os.getenv('CHAT_SUMMARY_TOKEN_THRESHOLD', '6000'))
+        self.chat_keep_recent_turns = int(os.getenv('CHAT_KEEP_RECENT_TURNS', '6'))
+        # 单次请求最多生成的海报变体数
+        self.poster_max_variants = int(os.getenv('POSTER_MAX_VARIANTS', '8'))
+        # 单个图像 prompt 的最大字符数
+        self.poster_max_prompt_chars = int(os.getenv('POSTER_MAX_PROMPT_CHARS', '4000'))
+        # 图片衍生版本（缩略图、WebP/AVIF，需要 Pillow）
+        self.derivative_workers = int(os.getenv('DERIVATIVE_WORKERS', '2'))
+        self.derivative_wait_timeout = float(os.getenv('DERIVATIVE_WAIT_TIMEOUT', '10'))
+        self.derivative_avif = os.getenv('DERIVATIVE_AVIF', 'True').lower() == 'true'
+        # 小红书 MCP 服务器与客户端池
+        self.mcp_base_url = os.getenv('MCP_BASE_URL', 'http://localhost:18060/mcp')
+        self.mcp_pool_size = int(os.getenv('MCP_POOL_SIZE', '2'))
+        self.mcp_health_check_interval = float(os.getenv('MCP_HEALTH_CHECK_INTERVAL', '60'))
+        self.mcp_warm_up = os.getenv('MCP_WARM_UP', 'True').lower() == 'true'
+        self.mcp_cache = os.getenv('MCP_CACHE', 'False').lower() == 'true'
+        # 小红书发布队列（速率限制按所有进程合计）
+        self.publish_queue_path = os.getenv('PUBLISH_QUEUE_PATH', os.path.join('state', 'publish_queue.db'))
+        self.publish_rate_limit = int(os.getenv('PUBLISH_RATE_LIMIT', '1'))
+        self.publish_rate_window = float(os.getenv('PUBLISH_RATE_WINDOW', '60'))
+        self.publish_max_attempts = int(os.getenv('PUBLISH_MAX_ATTEMPTS', '5'))
+        self.publish_retry_base = float(os.getenv('PUBLISH_RETRY_BASE', '30'))
+        self.publish_worker = os.getenv('PUBLISH_WORKER', 'True').lower() == 'true'
+        # 优化后的生成页面保存目录（/pages/ 提供访问）
+        self.pages_dir = os.getenv('PAGES_DIR', 'generated_pages')
+        # 慢请求日志：耗时超过阈值（秒）的请求连同各调用的耗时明细写入 JSONL，小于 0 关闭
+        self.slow_request_threshold = float(os.getenv('SLOW_REQUEST_THRESHOLD', '10'))
+        self.slow_request_log = os.getenv('SLOW_REQUEST_LOG', os.path.join('logs', 'slow_requests.jsonl'))
+        # 流水线模式中并行执行各生成阶段的线程数
+        self.pipeline_workers = int(os.getenv('PIPELINE_WORKERS', '6'))
 
 config = Config()
+tracing.configure(config.slow_request_log, config.slow_request_threshold)
 
 # ===== 模型定义 =====
-    
-class DeepSeekReasoner:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url
-        )
 
-    def __call__(self, messages) -> str:
+class DeepSeekModel:
+    """DeepSeek 模型调用入口；连接池、并发限制、重试和熔断统一由 model_gateway 处理"""
+
+    model_name = None
+
+    def __call__(self, messages, stream: bool = False):
         try:
-            if isinstance(messages, str):
-                formatted_messages = [{'role': 'user', 'content': messages}]
-            elif isinstance(messages, list):
-                formatted_messages = []
-                for msg in messages:
-                    if isinstance(msg, dict):
-                        formatted_messages.append(msg)
-                    elif hasattr(msg, 'content'):
-                        role = 'user'
-                        if hasattr(msg, 'type'):
-                            role = 'user' if msg.type == 'human' else 'assistant'
-                        formatted_messages.append({
-                            'role': role,
-                            'content': msg.content
-                        })
-            else:
-                formatted_messages = [{'role': 'user', 'content': str(messages)}]
+            if stream:
+                # 流式模式：返回逐段产出文本增量的生成器；span 持续到流读完
+                span = tracing.start_span(f"model {self.model_name} (stream)")
+                try:
+                    chunks = gateway.stream_chat_completion(
+                        self.model_name,
+                        messages,
+                        base_url=config.base_url,
+                        api_key=config.api_key,
+                        max_tokens=8192,
+                        temperature=0.7
+                    )
+                except Exception as e:
+                    if span is not None:
+                        span.end(e)
+                    raise
+                return self._iter_deltas(chunks, span)
+
+            with tracing.span(f"model {self.model_name}"):
+                response = gateway.chat_completion(
+                    self.model_name,
+                    messages,
+                    base_url=config.base_url,
+                    api_key=config.api_key,
+                    max_tokens=8192,
+                    temperature=0.7
+                )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"DeepSeek API Error: {e}")
+            raise e
 
-            response = self.client.chat.completions.create(
-                model='deepseek-reasoner',  # 恢复使用reasoner模型
-                messages=formatted_messages,
-                max_tokens=8192,            # 恢复更大的token限制
-                temperature=0.7
-            )
+    def _iter_deltas(self, chunks, span=None):
+        """从流式响应中逐个取出文本增量"""
+        error = None
+        try:
+            for chunk in chunks:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            error = e
+            logger.error(f"DeepSeek stream error: {e}")
+            raise
+        finally:
+            chunks.close()
+            if span is not None:
+                span.end(error)
+
+    async def acall(self, messages) -> str:
+        """非流式调用的 asyncio 版本（ASGI 模式），等待上游期间不占用线程"""
+        try:
+            with tracing.span(f"model {self.model_name}"):
+                response = await gateway.achat_completion(
+                    self.model_name,
+                    messages,
+                    base_url=config.base_url,
+                    api_key=config.api_key,
+                    max_tokens=8192,
+                    temperature=0.7
+                )
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"DeepSeek API Error: {e}")
             raise e
 
-    
-class DeepSeekChat:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url
-        )
+    async def astream(self, messages):
+        """
+        流式调用的 asyncio 版本：建立流后返回逐段产出文本增量的异步生成器
 
-    def __call__(self, messages) -> str:
+        连接错误在返回生成器之前抛出；中途放弃时对生成器调用 aclose() 以释放并发配额
+        """
+        span = tracing.start_span(f"model {self.model_name} (stream)")
         try:
-            if isinstance(messages, str):
-                formatted_messages = [{'role': 'user', 'content': messages}]
-            elif isinstance(messages, list):
-                formatted_messages = []
-                for msg in messages:
-                    if isinstance(msg, dict):
-                        formatted_messages.append(msg)
-                    elif hasattr(msg, 'content'):
-                        role = 'user'
-                        if hasattr(msg, 'type'):
-                            role = 'user' if msg.type == 'human' else 'assistant'
-                        formatted_messages.append({
-                            'role': role,
-                            'content': msg.content
-                        })
-            else:
-                formatted_messages = [{'role': 'user', 'content': str(messages)}]
-
-            response = self.client.chat.completions.create(
-                model='deepseek-chat',
-                messages=formatted_messages,
+            chunks = await gateway.astream_chat_completion(
+                self.model_name,
+                messages,
+                base_url=config.base_url,
+                api_key=config.api_key,
                 max_tokens=8192,
                 temperature=0.7
             )
-            return response.choices[0].message.content
         except Exception as e:
             logger.error(f"DeepSeek API Error: {e}")
-            raise e
+            if span is not None:
+                span.end(e)
+            raise
+        return self._aiter_deltas(chunks, span)
+
+    async def _aiter_deltas(self, chunks, span=None):
+        """_iter_deltas 的 asyncio 版本"""
+        error = None
+        try:
+            async for chunk in chunks:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            error = e
+            logger.error(f"DeepSeek stream error: {e}")
+            raise
+        finally:
+            await chunks.aclose()
+            if span is not None:
+                span.end(error)
+
+
+class DeepSeekReasoner(DeepSeekModel):
+    model_name = 'deepseek-reasoner'
+
+
+class DeepSeekChat(DeepSeekModel):
+    model_name = 'deepseek-chat'
 
 
 # ===== 辅助函数 =====
@@ -130,19 +260,216 @@ def clean_html_response(response: str) -> str:
     return cleaned
 
 
-def render_html(html_content: str, filename: str = None) -> str:
-    """保存HTML内容到文件"""
+def build_chat_messages(user_message: str, dialog_history: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """构建完整的对话历史，包括当前消息"""
+    messages = []
+    for item in dialog_history:
+        if item.get('role') == 'user':
+            messages.append({"role": "user", "content": item.get('content', '')})
+        elif item.get('role') == 'assistant':
+            messages.append({"role": "assistant", "content": item.get('content', '')})
+
+    # 添加当前用户消息
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def format_dialog_text(dialog_history: List[Dict[str, Any]]) -> str:
+    """将对话历史格式化为文本"""
+    dialog_text = ""
+    for msg in dialog_history:
+        if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
+            continue
+        role = "用户" if msg['role'] == 'user' else "助手"
+        dialog_text += f"{role}: {msg['content']}\n\n"
+    return dialog_text
+
+
+def with_client_id(data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    复制请求数据并补上客户端ID（请求体 client_id 或请求头 X-Client-Id），
+    用于隔离不同用户的分析状态；后台任务在请求上下文之外执行，因此需要提前取出
+    """
+    data = dict(data or {})
+    if not data.get('client_id'):
+        data['client_id'] = request.headers.get('X-Client-Id')
+    return data
+
+
+def save_latest_analysis(client_id: Optional[str], analysis: Dict[str, Any]) -> None:
+    """保存客户端最新的分析结果；没有客户端ID时不保存，避免不同用户互相覆盖"""
+    if client_id:
+        state_store.set(f"analysis:{client_id}", analysis, ttl=config.analysis_state_ttl)
+
+
+def load_latest_analysis(client_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """读取客户端最新的分析结果"""
+    if not client_id:
+        return None
+    return state_store.get(f"analysis:{client_id}")
+
+
+def prepare_chat_messages(data: Dict[str, Any], user_message: str):
+    """
+    构建本轮发给模型的消息
+
+    请求体包含 session_id 字段时使用服务端会话（为空则新建，可用 dialog_history 作为初始历史），
+    否则沿用客户端每次上传完整 dialog_history 的方式
+
+    Returns:
+        (消息列表, 会话)；会话不存在或已过期时返回 (None, None)
+    """
+    if 'session_id' not in data:
+        return build_chat_messages(user_message, data.get('dialog_history', [])), None
+
+    session_id = data.get('session_id')
+    if session_id:
+        session = chat_sessions.get(session_id)
+        if session is None:
+            return None, None
+    else:
+        session = chat_sessions.create(data.get('dialog_history', []))
+
+    return chat_sessions.build_messages(session, user_message), session
+
+
+def summarize_chat_history(previous_summary: str, messages: List[Dict[str, str]]) -> str:
+    """把较早的对话压缩成摘要，供会话的滚动摘要使用"""
+    dialog_text = format_dialog_text(messages)
+    prompt = f"""请把下面的对话压缩成一段简洁的摘要，供后续对话参考。
+保留用户的创业想法或项目方向、关键需求和约束、已经确定的结论，以及尚未解决的问题；省略寒暄和重复内容。
+直接输出摘要正文，不要添加标题或解释。
+
+【已有摘要】
+{previous_summary or '（无）'}
+
+【需要合并进摘要的对话】
+{dialog_text}"""
+    return chat_model(prompt)
+
+
+def file_digest(file_path: str) -> str:
+    """按块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_digest(file_path: str, mtime_ns: int, size: int) -> str:
+    """按修改时间和大小缓存文件哈希，文件未变化时不重复读取"""
+    return file_digest(file_path)
+
+
+def artifact_version(file_path: str) -> Optional[str]:
+    """
+    产物链接中版本号 v 的正确取值：原图为自身内容哈希，衍生图片沿用原图的内容哈希
+
+    Returns:
+        版本号；文件（或衍生图片的原图）不存在时返回 None
+    """
+    directory, filename = os.path.split(file_path)
+    if os.path.basename(directory) == DERIVED_DIR:
+        # 衍生文件名为 原图名（不含扩展名）+ .thumb.webp / .webp / .avif，见 DerivativePipeline.derivative_paths
+        stem = re.sub(r'(\.thumb)?\.(webp|avif)$', '', filename)
+        pattern = os.path.join(glob.escape(os.path.dirname(directory)), f"{glob.escape(stem)}.*")
+        sources = [path for path in glob.glob(pattern)
+                   if os.path.isfile(path) and os.path.splitext(os.path.basename(path))[0] == stem]
+        if not sources:
+            return None
+        file_path = sources[0]
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return _cached_digest(file_path, stat.st_mtime_ns, stat.st_size)[:16]
+
+
+def artifact_link(file_path: str, version: str) -> Optional[str]:
+    """生成产物访问链接；文件不在产物目录下时返回 None"""
+    root = os.path.abspath(ARTIFACT_ROOT)
+    abs_path = os.path.abspath(file_path)
+    if os.path.commonpath([root, abs_path]) != root:
+        return None
+    relative = os.path.relpath(abs_path, root).replace(os.sep, '/')
+    return f"/artifacts/{quote(relative)}?v={version}"
+
+
+def artifact_url(file_path: str) -> Optional[str]:
+    """生成带内容哈希的产物访问链接；文件不存在或不在产物目录下时返回 None"""
+    if not os.path.isfile(file_path):
+        return None
+    return artifact_link(file_path, file_digest(file_path)[:16])
+
+
+def describe_images(file_paths: List[str]) -> List[Dict[str, Any]]:
+    """把生成的图片路径转换为前端使用的描述（文件名、访问链接、大小）"""
+    image_data = []
+    for file_path in file_paths:
+        url = artifact_url(file_path)
+        if url is None:
+            logger.error(f"生成的图片不在 {ARTIFACT_ROOT} 目录下，无法提供访问链接: {file_path}")
+            continue
+        image = {
+            'filename': os.path.basename(file_path),
+            'url': url,
+            'path': file_path,
+            'size': os.path.getsize(file_path)
+        }
+
+        # 缩略图和 WebP/AVIF 在后台生成；衍生文件由原图内容决定，沿用原图的版本号
+        if derivatives.enabled:
+            derivatives.submit(file_path)
+            version = url.rsplit('v=', 1)[1]
+            for kind, derived_path in derivatives.derivative_paths(os.path.abspath(file_path)).items():
+                image[f'{kind}_url'] = artifact_link(derived_path, version)
+
+        image_data.append(image)
+    return image_data
+
+
+def sse_event(payload: Dict[str, Any], event: str = None) -> str:
+    """把一条消息编码为 SSE 事件"""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(payload, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(events) -> Response:
+    """把事件生成器包装为 text/event-stream 响应，并关闭代理缓冲"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+def html_output_path(filename: str = None) -> str:
+    """生成HTML文件的保存路径"""
     output_dir = "generated_html"
     os.makedirs(output_dir, exist_ok=True)
 
     if filename is None:
+        # 时间戳只精确到秒，加上随机后缀避免同一秒内的多个请求写到同一个文件
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"visualization_{timestamp}.html"
+        filename = f"visualization_{timestamp}_{new_job_id()[:8]}.html"
 
-    filepath = os.path.join(output_dir, filename)
+    return os.path.join(output_dir, filename)
+
+
+def render_html(html_content: str, filename: str = None) -> str:
+    """保存HTML内容到文件"""
+    filepath = html_output_path(filename)
 
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
+        with metrics.stage('file_write'), open(filepath, 'w', encoding='utf-8') as f:
             f.write(html_content)
         logger.info(f"HTML已保存到: {filepath}")
         return filepath
@@ -151,10 +478,103 @@ def render_html(html_content: str, filename: str = None) -> str:
         raise
 
 
-def analyze_dialog(dialog_text: str) -> Dict[str, Any]:
-    """分析对话内容"""
-
-    prompt = f"""你是一位商业、创业和黑客马拉松专家，给你一位想要创业或者参加黑客马拉松的用户和大模型的对话历史，你要做的就是仔细研读用户的对话，然后针对该用户需求，生成以下内容：
+def analyze_dialog(dialog_text: str, allow_similar: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    分析对话内容，相同对话（规范化后）直接返回缓存结果
+
+    Args:
+        dialog_text: 对话文本
+        allow_similar: 是否复用近似对话的分析结果，默认在 DIALOG_SIMILARITY_MODE=reuse 时复用；
+            复用时结果带有 reused_from（历史对话的缓存键）和 similarity
+    """
+    if allow_similar is None:
+        allow_similar = config.dialog_similarity_mode == 'reuse'
+    if allow_similar:
+        similar = find_similar_analysis(dialog_text)
+        if similar is not None:
+            return reused_analysis(similar)
+
+    key = dialog_hash(dialog_text)
+    result = analysis_cache.get_or_compute(
+        key,
+        lambda: _analyze_dialog_uncached(dialog_text),
+        cacheable=lambda result: not result.get('error')
+    )
+    if not result.get('error') and config.dialog_similarity_mode != 'off':
+        similarity_index.add(key, dialog_text)
+    return result
+
+
+def find_similar_analysis(dialog_text: str) -> Optional[Tuple[Dict[str, Any], float, str]]:
+    """
+    查找与对话近似（相似度不低于阈值）的历史对话的缓存分析结果
+
+    Returns:
+        (分析结果, 相似度, 历史对话的缓存键)，没有时返回 None
+    """
+    match = similarity_index.find(dialog_text)
+    if match is None:
+        return None
+
+    key, score = match
+    result = analysis_cache.get(key)
+    if result is None:
+        # 缓存条目已过期或被淘汰
+        similarity_index.remove(key)
+        return None
+    logger.info(f"找到近似对话 {key[:12]}（相似度 {score:.2f}）")
+    return result, score, key
+
+
+def reused_analysis(similar: Tuple[Dict[str, Any], float, str]) -> Dict[str, Any]:
+    """把近似对话的分析结果标记为复用（不修改缓存中的对象），让调用方知道结果并非针对当前对话"""
+    analysis, score, key = similar
+    return {**analysis, 'reused_from': key, 'similarity': round(score, 3)}
+
+
+# 进行中的异步分析：缓存键 -> Task，相同对话的并发请求等待同一个 Task（ASGI 进程只有一个事件循环）
+_analysis_tasks: Dict[str, 'asyncio.Task'] = {}
+
+
+async def aanalyze_dialog(dialog_text: str, allow_similar: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    analyze_dialog 的 asyncio 版本（ASGI 模式）
+
+    缓存和近似对话索引的读写涉及磁盘，放到线程中执行；相同对话同时到达时只调用一次模型
+    """
+    if allow_similar is None:
+        allow_similar = config.dialog_similarity_mode == 'reuse'
+    if allow_similar:
+        similar = await asyncio.to_thread(find_similar_analysis, dialog_text)
+        if similar is not None:
+            return reused_analysis(similar)
+
+    key = dialog_hash(dialog_text)
+    result = await asyncio.to_thread(analysis_cache.get, key)
+    if result is None:
+        task = _analysis_tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(_aanalyze_and_cache(key, dialog_text))
+            _analysis_tasks[key] = task
+            task.add_done_callback(lambda _: _analysis_tasks.pop(key, None))
+        # 发起请求的客户端断开时分析继续进行，其余等待者仍能拿到结果
+        result = await asyncio.shield(task)
+    if not result.get('error') and config.dialog_similarity_mode != 'off':
+        await asyncio.to_thread(similarity_index.add, key, dialog_text)
+    return result
+
+
+async def _aanalyze_and_cache(key: str, dialog_text: str) -> Dict[str, Any]:
+    result = await _aanalyze_dialog_uncached(dialog_text)
+    if not result.get('error'):
+        await asyncio.to_thread(analysis_cache.put, key, result)
+    return result
+
+
+def build_analysis_prompt(dialog_text: str) -> str:
+    """构建分析对话的提示词"""
+    with metrics.stage('prompt_build'):
+        return f"""你是一位商业、创业和黑客马拉松专家，给你一位想要创业或者参加黑客马拉松的用户和大模型的对话历史，你要做的就是仔细研读用户的对话，然后针对该用户需求，生成以下内容：
 
 1. 生成用于文生图的prompt
 2. 生成用于制作该主题HTML页面的prompt
@@ -173,60 +593,82 @@ def analyze_dialog(dialog_text: str) -> Dict[str, Any]:
 
 请直接输出JSON对象："""
 
-    try:
-        response = reasoner_model(prompt)
+
+def parse_analysis_response(response: str) -> Dict[str, Any]:
+    """解析推理模型返回的分析结果，补全必要字段并保存到 analysis_outputs；不是有效 JSON 时抛出 JSONDecodeError"""
+    with metrics.stage('json_parse'):
         cleaned_response = clean_json_response(response)
         result_dict = json.loads(cleaned_response)
 
-        # 确保必要字段存在
-        default_fields = {
-            'image_prompt': '',
-            'html_prompt': '',
-            'xiaohongshu_title': '',
-            'xiaohongshu_content': ''
-        }
-        
-        for field, default_value in default_fields.items():
-            if field not in result_dict:
-                result_dict[field] = default_value
+    # 确保必要字段存在
+    default_fields = {
+        'image_prompt': '',
+        'html_prompt': '',
+        'xiaohongshu_title': '',
+        'xiaohongshu_content': ''
+    }
+    
+    for field, default_value in default_fields.items():
+        if field not in result_dict:
+            result_dict[field] = default_value
+
+    # 保存结果
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = "analysis_outputs"
+    os.makedirs(output_dir, exist_ok=True)
+
+    output_path = os.path.join(output_dir, f"analysis_{timestamp}.json")
+    with metrics.stage('file_write'), open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(result_dict, f, indent=2, ensure_ascii=False)
+
+    logger.info(f"分析结果已保存到: {output_path}")
+    return result_dict
 
-        # 保存结果
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = "analysis_outputs"
-        os.makedirs(output_dir, exist_ok=True)
 
-        output_path = os.path.join(output_dir, f"analysis_{timestamp}.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result_dict, f, indent=2, ensure_ascii=False)
+def analysis_failure(error: str) -> Dict[str, Any]:
+    """分析失败时的结果：带错误信息，其余字段为空"""
+    return {
+        "error": error,
+        "image_prompt": "",
+        "html_prompt": "",
+        "xiaohongshu_title": "",
+        "xiaohongshu_content": ""
+    }
 
-        logger.info(f"分析结果已保存到: {output_path}")
-        return result_dict
 
+def _analyze_dialog_uncached(dialog_text: str) -> Dict[str, Any]:
+    """调用推理模型分析对话内容"""
+    prompt = build_analysis_prompt(dialog_text)
+    try:
+        return parse_analysis_response(reasoner_model(prompt))
     except json.JSONDecodeError as e:
         logger.error(f"JSON解析错误: {e}")
-        return {
-            "error": "JSON解析失败",
-            "image_prompt": "",
-            "html_prompt": "",
-            "xiaohongshu_title": "",
-            "xiaohongshu_content": ""
-        }
+        return analysis_failure("JSON解析失败")
     except Exception as e:
         logger.error(f"分析出错: {str(e)}")
         traceback.print_exc()
-        return {
-            "error": f"分析失败: {str(e)}",
-            "image_prompt": "",
-            "html_prompt": "",
-            "xiaohongshu_title": "",
-            "xiaohongshu_content": ""
-        }
+        return analysis_failure(f"分析失败: {str(e)}")
 
 
-def generate_html_from_analysis(analysis_result: Dict[str, Any]) -> Dict[str, Any]:
-    """根据分析结果生成HTML"""
+async def _aanalyze_dialog_uncached(dialog_text: str) -> Dict[str, Any]:
+    """_analyze_dialog_uncached 的 asyncio 版本，解析和写文件在线程中执行"""
+    prompt = build_analysis_prompt(dialog_text)
+    try:
+        response = await reasoner_model.acall(prompt)
+        return await asyncio.to_thread(parse_analysis_response, response)
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON解析错误: {e}")
+        return analysis_failure("JSON解析失败")
+    except Exception as e:
+        logger.error(f"分析出错: {str(e)}")
+        traceback.print_exc()
+        return analysis_failure(f"分析失败: {str(e)}")
 
-    html_generate_prompt = f"""
+
+def build_html_prompt(analysis_result: Dict[str, Any]) -> str:
+    """构建生成HTML页面的提示词"""
+    with metrics.stage('prompt_build'):
+        return f"""
 任务：你是一个专业的前端开发者，你需要根据以下分析结果制作一个现代化、美观的HTML页面。
 
 分析结果如下：
@@ -235,21 +677,54 @@ def generate_html_from_analysis(analysis_result: Dict[str, Any]) -> Dict[str, An
 输出要求：仅输出完整可运行的HTML代码，不需要任何解释或额外文本。请直接输出HTML，不要添加任何前缀、后缀或解释文字，不要使用```html或任何代码块标记。
 """
 
+
+def publish_page(html_content: str) -> Optional[str]:
+    """压缩页面并生成预压缩版本，返回 /pages/ 下的访问链接；失败时返回 None，不影响生成结果"""
     try:
-        response = reasoner_model(html_generate_prompt)
+        with metrics.stage('page_optimize'):
+            return html_optimizer.optimize(html_content)['page_url']
+    except Exception as e:
+        logger.warning(f"页面优化失败: {e}")
+        return None
+
+
+def save_generated_html(response: str) -> Dict[str, Any]:
+    """清理模型返回的HTML并保存"""
+    with metrics.stage('html_clean'):
         cleaned_html = clean_html_response(response)
 
-        if not cleaned_html.startswith('<!DOCTYPE'):
-            cleaned_html = '<!DOCTYPE html>\n' + cleaned_html
+    if not cleaned_html.startswith('<!DOCTYPE'):
+        cleaned_html = '<!DOCTYPE html>\n' + cleaned_html
+
+    # 保存HTML
+    filepath = render_html(cleaned_html)
+
+    return {
+        'success': True,
+        'filepath': filepath,
+        'html': cleaned_html
+    }
 
-        # 保存HTML
-        filepath = render_html(cleaned_html)
 
+def generate_html_from_analysis(analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+    """根据分析结果生成HTML"""
+    try:
+        response = reasoner_model(build_html_prompt(analysis_result))
+        return save_generated_html(response)
+    except Exception as e:
+        logger.error(f"生成HTML出错: {str(e)}")
+        traceback.print_exc()
         return {
-            'success': True,
-            'filepath': filepath,
-            'html': cleaned_html
+            'success': False,
+            'error': str(e)
         }
+
+
+async def agenerate_html_from_analysis(analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+    """generate_html_from_analysis 的 asyncio 版本"""
+    try:
+        response = await reasoner_model.acall(build_html_prompt(analysis_result))
+        return await asyncio.to_thread(save_generated_html, response)
     except Exception as e:
         logger.error(f"生成HTML出错: {str(e)}")
         traceback.print_exc()
@@ -259,15 +734,141 @@ def generate_html_from_analysis(analysis_result: Dict[str, Any]) -> Dict[str, An
         }
 
 
-# 存储最新的分析结果
-latest_analysis = None
+def stream_html_from_analysis(analysis_result: Dict[str, Any]):
+    """
+    流式生成HTML：逐段产出清理后的HTML，同时写入 .part 临时文件，
+    全部生成后原子重命名为正式文件，最后产出 {'filepath': 路径}；中途失败或客户端断开时删除临时文件
+
+    模型请求在调用时即发出，连接错误会在返回生成器之前抛出
+    """
+    deltas = reasoner_model(build_html_prompt(analysis_result), stream=True)
+
+    def generate():
+        cleaner = HTMLStreamCleaner()
+        writer = AtomicFileWriter(html_output_path())
+        try:
+            for delta in deltas:
+                chunk = cleaner.feed(delta)
+                if chunk:
+                    writer.write(chunk)
+                    yield chunk
+            chunk = cleaner.close()
+            if chunk:
+                writer.write(chunk)
+                yield chunk
+            yield {'filepath': writer.commit()}
+        except BaseException:
+            writer.abort()
+            deltas.close()
+            raise
+
+    return generate()
+
+
+def finalize_xiaohongshu_copy(analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+    """整理小红书文案：标题截断到20字，并从正文中提取话题标签"""
+    title = (analysis_result.get('xiaohongshu_title') or '').strip()
+    content = (analysis_result.get('xiaohongshu_content') or '').strip()
+
+    if not title and content:
+        title = content.split('\n', 1)[0].strip()
+    title = title[:20]
+
+    tags = []
+    for tag in re.findall(r'#([^\s#]+)', content):
+        if tag not in tags:
+            tags.append(tag)
+
+    return {
+        'title': title,
+        'content': content,
+        'tags': tags
+    }
+
+
 
 # 初始化模型
 chat_model = DeepSeekChat()      # 用于聊天的快速模型
 reasoner_model = DeepSeekReasoner()  # 用于分析的推理模型
 
-# 初始化小红书MCP客户端（延迟初始化）
-xiaohongshu_client = None
+# 会话级状态（每个客户端最新的分析结果）
+state_store = create_state_store(
+    backend=config.state_backend,
+    sqlite_path=config.state_sqlite_path,
+    max_entries=config.state_max_entries,
+    max_bytes=config.state_max_bytes,
+    redis_url=config.state_redis_url,
+    # 聊天会话和后台任务记录只按有效期过期，不会因分析结果过多而被容量淘汰
+    pinned_prefixes=(ChatSessionStore.KEY_PREFIX, JobManager.KEY_PREFIX)
+)
+# 聊天会话和后台任务只在共享后端中保存；进程内后端不跨进程共享，由各自的组件维护
+shared_state_store = state_store if config.state_backend != 'memory' else None
+
+# 服务端聊天会话（超过阈值后较早的轮次压缩为滚动摘要）
+chat_sessions = ChatSessionStore(
+    summarizer=summarize_chat_history,
+    max_sessions=config.chat_session_max,
+    idle_ttl=config.chat_session_ttl,
+    token_threshold=config.chat_summary_token_threshold,
+    keep_recent_turns=config.chat_keep_recent_turns,
+    store=shared_state_store
+)
+
+# 对话分析结果缓存（内存 LRU + analysis_outputs/cache 磁盘层）
+analysis_cache = AnalysisCache(
+    cache_dir=os.path.join("analysis_outputs", "cache"),
+    max_memory_entries=config.analysis_cache_memory_entries,
+    max_disk_entries=config.analysis_cache_disk_entries,
+    ttl_seconds=config.analysis_cache_ttl
+)
+
+# 历史对话的 SimHash 索引，用于复用近似对话的分析结果
+similarity_index = SimHashIndex(
+    threshold=config.dialog_similarity_threshold,
+    max_entries=config.dialog_similarity_max_entries,
+    path=os.path.join("analysis_outputs", "similarity_index.jsonl")
+)
+
+# 长耗时生成请求的后台任务池
+job_manager = JobManager(
+    max_workers=config.job_workers,
+    max_pending=config.job_max_pending,
+    result_ttl=config.job_result_ttl,
+    store=shared_state_store
+)
+
+# 生成图片的缩略图与 WebP/AVIF 版本，在后台线程池中处理
+derivatives = DerivativePipeline(
+    max_workers=config.derivative_workers,
+    enable_avif=config.derivative_avif
+)
+
+# 生成页面的压缩与预压缩，通过 /pages/ 提供
+html_optimizer = HTMLOptimizer(root=config.pages_dir)
+
+# 流水线模式（/pipeline）各阶段共用的线程池
+pipeline_executor = ThreadPoolExecutor(max_workers=config.pipeline_workers, thread_name_prefix='pipeline')
+
+# 小红书MCP客户端池：按需创建客户端，会话失效时自动重新握手
+mcp_pool = XiaohongshuMCPClientPool(
+    base_url=config.mcp_base_url,
+    size=config.mcp_pool_size,
+    health_check_interval=config.mcp_health_check_interval,
+    cache_ttls=DEFAULT_CACHE_TTLS if config.mcp_cache else None
+)
+if config.mcp_warm_up:
+    # 在后台预热，MCP 服务器未启动时不影响应用启动
+    threading.Thread(target=mcp_pool.warm_up, name='mcp-warm-up', daemon=True).start()
+
+
+def warm_up_worker() -> None:
+    """
+    预热本进程的模型客户端（多进程部署时由 gunicorn.conf.py 在每个 worker 启动后调用）
+
+    连接池不能跨 fork 共享，因此每个 worker 各自建立到 DeepSeek 和 OpenRouter 的长连接
+    """
+    gateway.warm_up(config.base_url, config.api_key)
+    gateway.warm_up(OPENROUTER_BASE_URL, OPENROUTER_API_KEY)
 
 
 @app.route('/')
@@ -289,34 +890,32 @@ def chat():
             return jsonify({'error': '请求数据为空'}), 400
             
         user_message = data.get('message', '')
-        dialog_history = data.get('dialog_history', [])
 
         if not user_message:
             return jsonify({'error': '消息不能为空'}), 400
 
         logger.info(f"收到用户消息: {user_message[:100]}...")
-        
-        # 构建完整的对话历史，包括当前消息
-        messages = []
-        for item in dialog_history:
-            if item.get('role') == 'user':
-                messages.append({"role": "user", "content": item.get('content', '')})
-            elif item.get('role') == 'assistant':
-                messages.append({"role": "assistant", "content": item.get('content', '')})
-        
-        # 添加当前用户消息
-        messages.append({"role": "user", "content": user_message})
-        
+
+        with metrics.stage('prompt_build'):
+            messages, session = prepare_chat_messages(data, user_message)
+        if messages is None:
+            return jsonify({'error': '会话不存在或已过期', 'code': 'session_expired'}), 404
+
         # 如果没有历史对话，直接传递单条消息
         if len(messages) == 1:
             response = chat_model(user_message)
         else:
             response = chat_model(messages)
 
-        return jsonify({
+        result = {
             'response': response,
             'timestamp': datetime.now().strftime('%H:%M:%S')
-        })
+        }
+        if session is not None:
+            chat_sessions.append_turn(session, user_message, response)
+            result['session_id'] = session.id
+
+        return jsonify(result)
 
     except Exception as e:
         logger.error(f"Chat error: {e}")
@@ -324,196 +923,462 @@ def chat():
         return jsonify({'error': f'聊天服务出错: {str(e)}'}), 500
 
 
-@app.route('/extract', methods=['POST'])
-def extract_requirements():
-    """处理需求提取请求"""
-    global latest_analysis
-
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """流式聊天接口（SSE），模型生成的文本增量到达即转发给前端"""
     try:
         data = request.json
         if not data:
             return jsonify({'error': '请求数据为空'}), 400
-            
-        dialog_history = data.get('dialog', [])
 
-        if not dialog_history:
-            return jsonify({'error': '对话历史为空'}), 400
-
-        # 将对话历史格式化为文本
-        dialog_text = ""
-        for msg in dialog_history:
-            if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
-                continue
-            role = "用户" if msg['role'] == 'user' else "助手"
-            dialog_text += f"{role}: {msg['content']}\n\n"
-
-        logger.info(f"开始分析对话，长度: {len(dialog_text)}")
-
-        # 分析对话
-        analysis_result = analyze_dialog(dialog_text)
-
-        # 保存最新的分析结果
-        latest_analysis = analysis_result
-
-        # 检查是否有错误
-        if 'error' in analysis_result and analysis_result['error'] and not any([
-            analysis_result.get('knowledge_points'),
-            analysis_result.get('solution_steps'),
-            analysis_result.get('image_prompt'),
-            analysis_result.get('html_prompt'),
-            analysis_result.get('xiaohongshu_title'),
-            analysis_result.get('xiaohongshu_content')
-        ]):
-            return jsonify({'error': analysis_result['error']}), 500
+        user_message = data.get('message', '')
 
-        return jsonify({
-            'status': 'success',
-            'analysis': analysis_result,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        if not user_message:
+            return jsonify({'error': '消息不能为空'}), 400
+
+        logger.info(f"收到用户消息(流式): {user_message[:100]}...")
+
+        with metrics.stage('prompt_build'):
+            messages, session = prepare_chat_messages(data, user_message)
+        if messages is None:
+            return jsonify({'error': '会话不存在或已过期', 'code': 'session_expired'}), 404
+
+        # 在返回响应前发起请求，连接/鉴权错误仍能以普通JSON错误返回
+        deltas = chat_model(messages if len(messages) > 1 else user_message, stream=True)
+    except Exception as e:
+        logger.error(f"Chat stream error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'聊天服务出错: {str(e)}'}), 500
+
+    def generate():
+        try:
+            reply = []
+            for delta in deltas:
+                reply.append(delta)
+                yield sse_event({'delta': delta})
+
+            done = {'done': True, 'timestamp': datetime.now().strftime('%H:%M:%S')}
+            if session is not None:
+                # 只有完整收到的回复才写入会话历史
+                chat_sessions.append_turn(session, user_message, ''.join(reply))
+                done['session_id'] = session.id
+            yield sse_event(done)
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}")
+            yield sse_event({'error': f'聊天服务出错: {str(e)}'})
+
+    return sse_response(generate())
+
+
+def begin_extract(data: Dict[str, Any]) -> Tuple[Optional[str], Optional[Tuple[Dict[str, Any], int]]]:
+    """
+    需求提取中调用模型之前的部分：校验请求、格式化对话，preview 模式下直接给出临时结果
+
+    Returns:
+        (对话文本, None)；不需要再分析时为 (None, (响应数据, HTTP状态码))
+    """
+    if not data:
+        return None, ({'error': '请求数据为空'}, 400)
+
+    dialog_history = data.get('dialog', [])
+
+    if not dialog_history:
+        return None, ({'error': '对话历史为空'}, 400)
+
+    # 将对话历史格式化为文本
+    dialog_text = format_dialog_text(dialog_history)
+
+    logger.info(f"开始分析对话，长度: {len(dialog_text)}")
+
+    # preview 模式：有近似对话时先返回其分析结果作为临时结果，同时在后台重新分析
+    if config.dialog_similarity_mode == 'preview' and not data.get('fresh'):
+        preview = preview_similar_analysis(data, dialog_text)
+        if preview is not None:
+            return None, (preview, 200)
+    return dialog_text, None
+
+
+def finish_extract(data: Dict[str, Any], dialog_text: str, analysis_result: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """保存分析结果并构造需求提取的响应"""
+    # 复用近似对话的结果时，把标记移到响应顶层（与 preview 模式的 similarity 一致），前端据此提供重新分析
+    analysis_result = dict(analysis_result)
+    reused = {field: analysis_result.pop(field) for field in ('reused_from', 'similarity') if field in analysis_result}
+
+    # 保存该客户端最新的分析结果
+    save_latest_analysis(data.get('client_id'), analysis_result)
+
+    # 检查是否有错误
+    if 'error' in analysis_result and analysis_result['error'] and not any([
+        analysis_result.get('knowledge_points'),
+        analysis_result.get('solution_steps'),
+        analysis_result.get('image_prompt'),
+        analysis_result.get('html_prompt'),
+        analysis_result.get('xiaohongshu_title'),
+        analysis_result.get('xiaohongshu_content')
+    ]):
+        return {'error': analysis_result['error']}, 500
+
+    return {
+        'status': 'success',
+        'analysis': analysis_result,
+        **reused,
+        'dialog_hash': dialog_hash(dialog_text),
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }, 200
+
+
+def extract_task(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """需求提取，返回 (响应数据, HTTP状态码)"""
+    try:
+        dialog_text, early = begin_extract(data)
+        if early is not None:
+            return early
+
+        # 分析对话（fresh 表示必须重新分析，不复用近似对话）
+        analysis_result = analyze_dialog(dialog_text, allow_similar=False if data.get('fresh') else None)
+        return finish_extract(data, dialog_text, analysis_result)
 
     except Exception as e:
         logger.error(f"Extract error: {e}")
         traceback.print_exc()
-        return jsonify({'error': f'需求提取失败: {str(e)}'}), 500
+        return {'error': f'需求提取失败: {str(e)}'}, 500
 
 
-@app.route('/generate_html', methods=['POST'])
-def generate_html():
-    """生成HTML可视化"""
-    global latest_analysis
+async def aextract_task(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """extract_task 的 asyncio 版本（ASGI 模式）"""
+    try:
+        # preview 模式查找近似对话、保存分析结果都会读写磁盘，放到线程中执行
+        dialog_text, early = await asyncio.to_thread(begin_extract, data)
+        if early is not None:
+            return early
+
+        analysis_result = await aanalyze_dialog(dialog_text, allow_similar=False if data.get('fresh') else None)
+        return await asyncio.to_thread(finish_extract, data, dialog_text, analysis_result)
+
+    except Exception as e:
+        logger.error(f"Extract error: {e}")
+        traceback.print_exc()
+        return {'error': f'需求提取失败: {str(e)}'}, 500
+
+
+def preview_similar_analysis(data: Dict[str, Any], dialog_text: str) -> Optional[Dict[str, Any]]:
+    """
+    返回近似对话的分析结果作为临时结果，并提交重新分析的后台任务
+
+    Returns:
+        响应数据；没有近似对话、与已缓存对话完全相同或任务队列已满时返回 None
+    """
+    similar = find_similar_analysis(dialog_text)
+    current_key = dialog_hash(dialog_text)
+    if similar is None or similar[2] == current_key:
+        return None
 
     try:
-        data = request.json
-        if not data:
-            data = {}
+        job = job_manager.submit('extract', extract_task, {**data, 'fresh': True})
+    except JobQueueFullError:
+        return None
+
+    analysis, score, _ = similar
+    save_latest_analysis(data.get('client_id'), analysis)
+    return {
+        'status': 'success',
+        'analysis': analysis,
+        'provisional': True,
+        'similarity': round(score, 3),
+        'dialog_hash': current_key,
+        'job_id': job.id,
+        # 可能在后台任务线程中执行，没有请求上下文，不能使用 url_for
+        'result_url': f"/jobs/{job.id}/result",
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
 
-        # 可以传入分析结果，或使用最新的分析结果
-        analysis = data.get('analysis')
 
-        if not analysis:
-            if latest_analysis:
-                analysis = latest_analysis
-            else:
-                dialog_history = data.get('dialog', [])
-                if not dialog_history:
-                    return jsonify({'error': '需要先进行需求分析或提供对话历史'}), 400
+@app.route('/extract', methods=['POST'])
+def extract_requirements():
+    """处理需求提取请求，请求体带 "async": true 时作为后台任务执行"""
+    data = with_client_id(request.get_json(silent=True))
+    if data.get('async'):
+        return submit_job('extract', extract_task, data)
+    payload, status = extract_task(data)
+    return jsonify(payload), status
+
+
+def resolve_html_analysis(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """取生成HTML所用的分析结果：请求传入的、该客户端最新的，或根据对话历史重新分析；都没有时返回 None"""
+    # 可以传入分析结果，或使用该客户端最新的分析结果
+    analysis = data.get('analysis') or load_latest_analysis(data.get('client_id'))
+
+    if not analysis:
+        dialog_history = data.get('dialog', [])
+        if not dialog_history:
+            return None
+
+        analysis = analyze_dialog(format_dialog_text(dialog_history))
+        save_latest_analysis(data.get('client_id'), analysis)
+    return analysis
+
 
-                dialog_text = ""
-                for msg in dialog_history:
-                    if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
-                        continue
-                    role = "用户" if msg['role'] == 'user' else "助手"
-                    dialog_text += f"{role}: {msg['content']}\n\n"
+async def aresolve_html_analysis(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """resolve_html_analysis 的 asyncio 版本，状态存储的读写放到线程中执行"""
+    analysis = data.get('analysis') or await asyncio.to_thread(load_latest_analysis, data.get('client_id'))
 
-                analysis = analyze_dialog(dialog_text)
-                latest_analysis = analysis
+    if not analysis:
+        dialog_history = data.get('dialog', [])
+        if not dialog_history:
+            return None
+
+        analysis = await aanalyze_dialog(format_dialog_text(dialog_history))
+        await asyncio.to_thread(save_latest_analysis, data.get('client_id'), analysis)
+    return analysis
+
+
+def html_task_response(result: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """把HTML生成结果转换为响应，成功时同时发布优化后的页面"""
+    if result['success']:
+        # 返回完整的HTML内容，以及优化后可分享的页面链接
+        return {
+            'status': 'success',
+            'html_content': result['html'],
+            'filename': os.path.basename(result['filepath']),
+            'page_url': publish_page(result['html'])
+        }, 200
+    else:
+        return {'error': result['error']}, 500
+
+
+def generate_html_task(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """生成HTML可视化，返回 (响应数据, HTTP状态码)"""
+    try:
+        analysis = resolve_html_analysis(data or {})
+        if not analysis:
+            return {'error': '需要先进行需求分析或提供对话历史'}, 400
 
         logger.info("开始生成HTML页面")
 
         # 生成HTML
         result = generate_html_from_analysis(analysis)
+        return html_task_response(result)
 
-        if result['success']:
-            # 返回完整的HTML内容
-            return jsonify({
-                'status': 'success',
-                'html_content': result['html'],
-                'filename': os.path.basename(result['filepath'])
-            })
-        else:
-            return jsonify({'error': result['error']}), 500
+    except Exception as e:
+        logger.error(f"Generate HTML error: {e}")
+        traceback.print_exc()
+        return {'error': f'HTML生成失败: {str(e)}'}, 500
+
+
+async def agenerate_html_task(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """generate_html_task 的 asyncio 版本（ASGI 模式）"""
+    try:
+        analysis = await aresolve_html_analysis(data or {})
+        if not analysis:
+            return {'error': '需要先进行需求分析或提供对话历史'}, 400
+
+        logger.info("开始生成HTML页面")
+
+        result = await agenerate_html_from_analysis(analysis)
+        # 页面压缩是 CPU 密集的，放到线程中执行
+        return await asyncio.to_thread(html_task_response, result)
 
     except Exception as e:
         logger.error(f"Generate HTML error: {e}")
         traceback.print_exc()
+        return {'error': f'HTML生成失败: {str(e)}'}, 500
+
+
+@app.route('/generate_html', methods=['POST'])
+def generate_html():
+    """生成HTML可视化，请求体带 "async": true 时作为后台任务执行"""
+    data = with_client_id(request.get_json(silent=True))
+    if data.get('async'):
+        return submit_job('generate_html', generate_html_task, data)
+    payload, status = generate_html_task(data)
+    return jsonify(payload), status
+
+
+@app.route('/generate_html_stream', methods=['POST'])
+def generate_html_stream():
+    """流式生成HTML（SSE）：HTML片段到达即推送，前端可边生成边渲染预览"""
+    try:
+        data = with_client_id(request.get_json(silent=True))
+        analysis = resolve_html_analysis(data)
+        if not analysis:
+            return jsonify({'error': '需要先进行需求分析或提供对话历史'}), 400
+
+        logger.info("开始流式生成HTML页面")
+        chunks = stream_html_from_analysis(analysis)
+    except Exception as e:
+        logger.error(f"Generate HTML stream error: {e}")
+        traceback.print_exc()
         return jsonify({'error': f'HTML生成失败: {str(e)}'}), 500
 
+    def generate():
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, dict):
+                    with open(chunk['filepath'], 'r', encoding='utf-8') as f:
+                        page_url = publish_page(f.read())
+                    yield sse_event({
+                        'done': True,
+                        'filename': os.path.basename(chunk['filepath']),
+                        'page_url': page_url
+                    })
+                else:
+                    yield sse_event({'delta': chunk})
+        except Exception as e:
+            logger.error(f"Generate HTML stream error: {e}")
+            yield sse_event({'error': f'HTML生成失败: {str(e)}'})
+
+    return sse_response(generate())
+
+
+def publish_to_xiaohongshu(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    通过 MCP 客户端池发布内容（发布队列和同步发布共用）
+
+    Args:
+        kind: publish_content（图文）或 publish_video（视频）
+        payload: 对应客户端方法的参数
+
+    Returns:
+        MCP 工具返回的结果；发布失败时抛出 PublishError
+    """
+    if kind == 'publish_video':
+        result = mcp_pool.call(lambda client: client.publish_video(**payload, progress=log_upload_progress))
+    else:
+        result = mcp_pool.call(lambda client: client.publish_content(**payload))
+    return check_publish_result(result)
+
+
+async def apublish_to_xiaohongshu(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """publish_to_xiaohongshu 的 asyncio 版本（ASGI 模式的同步发布）"""
+    if kind == 'publish_video':
+        result = await mcp_pool.acall(lambda client: client.apublish_video(**payload, progress=log_upload_progress))
+    else:
+        result = await mcp_pool.acall(lambda client: client.apublish_content(**payload))
+    return check_publish_result(result)
+
+
+def log_upload_progress(params: Dict[str, Any]) -> None:
+    logger.info(f"视频上传进度: {params.get('progress')}/{params.get('total', '?')} {params.get('message', '')}")
+
+
+def check_publish_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """检查 MCP 工具的发布结果，返回结果内容；发布失败时抛出 PublishError"""
+    logger.info(f"发布结果: {result}")
+
+    # 检查发布结果
+    if 'error' in result:
+        error_info = result['error']
+        error_message = error_info.get('message', '未知错误') if isinstance(error_info, dict) else str(error_info)
+        raise PublishError(error_message)
+
+    if 'result' not in result:
+        return result
+
+    result_content = result['result']
+    for content_item in result_content.get('content', []):
+        if content_item.get('type') == 'text':
+            logger.info(f"服务器响应: {content_item.get('text', '')}")
+    if result_content.get('isError'):
+        texts = [item.get('text', '') for item in result_content.get('content', []) if item.get('type') == 'text']
+        raise PublishError('；'.join(texts) or '未知错误')
+    return result_content
+
+
+# 发布队列：发布请求先持久化，由后台线程按速率限制执行，未送达的失败自动重试
+publish_queue = PublishQueue(
+    publisher=publish_to_xiaohongshu,
+    path=config.publish_queue_path,
+    rate_limit=config.publish_rate_limit,
+    rate_window=config.publish_rate_window,
+    max_attempts=config.publish_max_attempts,
+    retry_base=config.publish_retry_base,
+    # 只重试确定没有送达 MCP 服务器的失败，其余失败可能已经发布
+    retryable=mcp_pool.not_delivered
+)
+if config.publish_worker:
+    publish_queue.start()
+
+
+def parse_publish_request(data: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[str]]:
+    """
+    校验发布请求
+
+    Returns:
+        (kind, 发布参数, None)；参数无效时为 (None, None, 错误信息)
+    """
+    if not data:
+        return None, None, '请求数据为空'
+
+    # 获取发布参数
+    title = data.get('title', '')
+    content = data.get('content', '')
+    images = data.get('images', [])
+    video = data.get('video', '')
+    tags = data.get('tags', [])
+
+    # 参数验证
+    if not title:
+        return None, None, '标题不能为空'
+    if not content:
+        return None, None, '内容不能为空'
+    
+    # 图片是可选的，如果没有提供则设为空列表
+    if not images:
+        images = []
+
+    # 检查标题长度（最多20个中文字）
+    if len(title) > 20:
+        return None, None, '标题不能超过20个字符'
+
+    if video:
+        return 'publish_video', {'title': title, 'content': content, 'video': video, 'tags': tags or None}, None
+    return 'publish_content', {'title': title, 'content': content, 'images': images, 'tags': tags or None}, None
+
 
 @app.route('/publish_xiaohongshu', methods=['POST'])
 def publish_xiaohongshu():
-    """发布内容到小红书"""
-    global latest_analysis, xiaohongshu_client
+    """
+    发布内容到小红书
 
+    默认加入发布队列并返回 202 和任务ID，通过 /publish_jobs/<任务ID> 查询结果；
+    请求体带 sync: true 时在请求内直接发布
+    """
     try:
         data = request.json
-        if not data:
-            return jsonify({'error': '请求数据为空'}), 400
-
-        # 获取发布参数
-        title = data.get('title', '')
-        content = data.get('content', '')
-        images = data.get('images', [])
-        tags = data.get('tags', [])
-
-        # 参数验证
-        if not title:
-            return jsonify({'error': '标题不能为空'}), 400
-        if not content:
-            return jsonify({'error': '内容不能为空'}), 400
-        
-        # 图片是可选的，如果没有提供则设为空列表
-        if not images:
-            images = []
-
-        # 检查标题长度（最多20个中文字）
-        if len(title) > 20:
-            return jsonify({'error': '标题不能超过20个字符'}), 400
-
-        logger.info(f"开始发布小红书内容，标题: {title}")
-
-        # 初始化MCP客户端连接（如果还没有初始化）
-        if xiaohongshu_client is None:
-            xiaohongshu_client = XiaohongshuMCPClient()
-        
-        # 确保客户端已初始化
-        if not xiaohongshu_client.initialized:
-            try:
-                init_result = xiaohongshu_client.initialize()
-                logger.info(f"MCP客户端初始化成功: {init_result}")
-            except Exception as e:
-                logger.error(f"MCP客户端初始化失败: {e}")
-                return jsonify({'error': f'MCP客户端初始化失败: {str(e)}'}), 500
-
-        # 调用发布方法
-        result = xiaohongshu_client.publish_content(
-            title=title,
-            content=content,
-            images=images,
-            tags=tags if tags else None
-        )
-
-        logger.info(f"发布结果: {result}")
-
-        # 检查发布结果
-        if 'result' in result:
-            result_content = result['result']
-            if 'content' in result_content:
-                content_list = result_content['content']
-                for content_item in content_list:
-                    if content_item.get('type') == 'text':
-                        response_text = content_item.get('text', '')
-                        logger.info(f"服务器响应: {response_text}")
-                        
+        kind, payload, error = parse_publish_request(data)
+        if error:
+            return jsonify({'error': error}), 400
+
+        if not data.get('sync'):
+            # 相同幂等键的请求（如客户端超时后重发）只会发布一次
+            idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+            job = publish_queue.enqueue(kind, payload, idempotency_key=idempotency_key)
+            logger.info(f"小红书发布任务已入队: {job['job_id']}，标题: {payload['title']}")
             return jsonify({
-                'status': 'success',
-                'message': '发布成功！',
-                'result': result['result']
-            })
-        elif 'error' in result:
-            error_info = result['error']
-            error_message = error_info.get('message', '未知错误') if isinstance(error_info, dict) else str(error_info)
-            logger.error(f"发布失败: {error_message}")
+                **job,
+                'status_url': url_for('get_publish_job', job_id=job['job_id'])
+            }), 202
+
+        logger.info(f"开始发布小红书内容，标题: {payload['title']}")
+
+        # 从客户端池借出已初始化的客户端调用发布方法
+        try:
+            result = publish_to_xiaohongshu(kind, payload)
+        except MCPError as e:
+            logger.error(f"MCP客户端不可用: {e}")
+            return jsonify({'error': str(e)}), 500
+        except PublishError as e:
+            logger.error(f"发布失败: {e}")
             return jsonify({
                 'status': 'error',
-                'error': f"发布失败: {error_message}"
+                'error': f"发布失败: {e}"
             }), 500
-        else:
-            return jsonify({
-                'status': 'success',
-                'message': '发布请求已提交',
-                'result': result
-            })
+
+        return jsonify({
+            'status': 'success',
+            'message': '发布成功！',
+            'result': result
+        })
 
     except Exception as e:
         logger.error(f"发布小红书内容出错: {e}")
@@ -521,71 +1386,306 @@ def publish_xiaohongshu():
         return jsonify({'error': f'发布失败: {str(e)}'}), 500
 
 
-@app.route('/generate_poster', methods=['POST'])
-def generate_poster():
-    """生成海报"""
-    global latest_analysis
+@app.route('/publish_jobs/<job_id>', methods=['GET'])
+def get_publish_job(job_id):
+    """查询发布任务状态"""
+    job = publish_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '发布任务不存在'}), 404
+    return jsonify(job)
+
+
+def poster_image_prompt(data: Dict[str, Any]) -> Tuple[Optional[str], Optional[Tuple[Dict[str, Any], int]]]:
+    """
+    取生成海报所用的 image_prompt
+
+    Returns:
+        (image_prompt, None)；缺少分析结果或 prompt 时为 (None, (响应数据, HTTP状态码))
+    """
+    # 可以传入分析结果，或使用该客户端最新的分析结果
+    analysis = data.get('analysis') or load_latest_analysis(data.get('client_id'))
+
+    if not analysis:
+        return None, ({'error': '需要先进行需求分析'}, 400)
+
+    # 获取image_prompt
+    image_prompt = analysis.get('image_prompt', '')
+    if not image_prompt:
+        return None, ({'error': '分析结果中没有找到image_prompt'}, 400)
+    return image_prompt, None
+
+
+def poster_task_response(job_id: str, saved_paths: List[str]) -> Tuple[Dict[str, Any], int]:
+    """把生成的海报转换为响应"""
+    output_dir = os.path.join(ARTIFACT_ROOT, job_id)
+
+    with metrics.stage('artifact_describe'):
+        image_data = describe_images(saved_paths)
 
+    if image_data:
+        return {
+            'status': 'success',
+            'message': '海报生成成功！',
+            'generated_files': [image['filename'] for image in image_data],
+            'job_id': job_id,
+            'output_dir': output_dir,
+            'images': image_data
+        }, 200
+    else:
+        return {'error': '海报生成失败，未找到生成的图片文件'}, 500
+
+
+def generate_poster_task(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """生成海报，返回 (响应数据, HTTP状态码)"""
     try:
-        data = request.json
-        if not data:
-            data = {}
+        image_prompt, early = poster_image_prompt(data or {})
+        if early is not None:
+            return early
 
-        # 可以传入分析结果，或使用最新的分析结果
-        analysis = data.get('analysis')
+        logger.info("开始生成海报")
 
-        if not analysis:
-            if latest_analysis:
-                analysis = latest_analysis
-            else:
-                return jsonify({'error': '需要先进行需求分析'}), 400
+        # 调用poster_designer的design函数，图片写入本次任务独立的目录
+        job_id = new_job_id()
+        saved_paths = design(idea="", output_dir=ARTIFACT_ROOT, image_prompt=image_prompt, job_id=job_id) or []
+        return poster_task_response(job_id, saved_paths)
 
-        # 获取image_prompt
-        image_prompt = analysis.get('image_prompt', '')
-        if not image_prompt:
-            return jsonify({'error': '分析结果中没有找到image_prompt'}), 400
+    except Exception as e:
+        logger.error(f"Generate poster error: {e}")
+        traceback.print_exc()
+        return {'error': f'海报生成失败: {str(e)}'}, 500
+
+
+async def agenerate_poster_task(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """generate_poster_task 的 asyncio 版本（ASGI 模式）"""
+    try:
+        image_prompt, early = await asyncio.to_thread(poster_image_prompt, data or {})
+        if early is not None:
+            return early
 
         logger.info("开始生成海报")
 
-        # 调用poster_designer的design函数
-        output_dir = "output"
-        design(idea="", output_dir=output_dir, image_prompt=image_prompt)
-
-        # 检查生成的图片文件
-        generated_files = []
-        image_data = []
-        if os.path.exists(output_dir):
-            for file in os.listdir(output_dir):
-                if file.startswith('generated_image_') and file.endswith(('.png', '.jpg', '.jpeg')):
-                    generated_files.append(file)
-                    # 读取图片文件并转换为base64
-                    file_path = os.path.join(output_dir, file)
-                    try:
-                        with open(file_path, 'rb') as img_file:
-                            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                            image_data.append({
-                                'filename': file,
-                                'base64': img_base64,
-                                'path': file_path
-                            })
-                    except Exception as e:
-                        logger.error(f"读取图片文件失败 {file}: {e}")
-
-        if generated_files:
-            return jsonify({
-                'status': 'success',
-                'message': '海报生成成功！',
-                'generated_files': generated_files,
-                'output_dir': output_dir,
-                'images': image_data
-            })
-        else:
-            return jsonify({'error': '海报生成失败，未找到生成的图片文件'}), 500
+        job_id = new_job_id()
+        saved_paths = await acall_image_model(OPENROUTER_API_KEY, image_prompt, ARTIFACT_ROOT, job_id) or []
+        # 计算内容哈希、提交衍生图片需要读文件，放到线程中执行
+        return await asyncio.to_thread(poster_task_response, job_id, saved_paths)
 
     except Exception as e:
         logger.error(f"Generate poster error: {e}")
         traceback.print_exc()
-        return jsonify({'error': f'海报生成失败: {str(e)}'}), 500
+        return {'error': f'海报生成失败: {str(e)}'}, 500
+
+
+@app.route('/generate_poster', methods=['POST'])
+def generate_poster():
+    """生成海报，请求体带 "async": true 时作为后台任务执行"""
+    data = with_client_id(request.get_json(silent=True))
+    if data.get('async'):
+        return submit_job('generate_poster', generate_poster_task, data)
+    payload, status = generate_poster_task(data)
+    return jsonify(payload), status
+
+
+@app.route('/pipeline', methods=['POST'])
+def pipeline():
+    """
+    流水线模式：基于同一份分析结果并行生成HTML、海报和小红书文案，
+    以 SSE 的形式按完成顺序逐个推送，总耗时取决于最慢的阶段
+    """
+    data = with_client_id(request.get_json(silent=True))
+    analysis = data.get('analysis')
+    dialog_history = data.get('dialog', [])
+
+    if not analysis and not dialog_history:
+        return jsonify({'error': '需要提供分析结果或对话历史'}), 400
+
+    def generate():
+        current = analysis
+
+        if not current:
+            payload, status = extract_task(data)
+            yield sse_event({'stage': 'analysis', 'status': status, **payload}, event='artifact')
+            if status >= 400:
+                yield sse_event({'done': True, 'failed': ['analysis']}, event='done')
+                return
+            current = payload['analysis']
+        else:
+            save_latest_analysis(data.get('client_id'), current)
+
+        stages = {
+            tracing.submit(pipeline_executor, generate_html_task, {**data, 'analysis': current}): 'html',
+            tracing.submit(pipeline_executor, generate_poster_task, {**data, 'analysis': current}): 'poster',
+            tracing.submit(pipeline_executor,
+                           lambda: ({'status': 'success', **finalize_xiaohongshu_copy(current)}, 200)): 'xiaohongshu'
+        }
+
+        failed = []
+        for future in as_completed(stages):
+            stage = stages[future]
+            try:
+                payload, status = future.result()
+            except Exception as e:
+                logger.error(f"流水线阶段失败 {stage}: {e}")
+                payload, status = {'error': str(e)}, 500
+            if status >= 400:
+                failed.append(stage)
+            logger.info(f"流水线阶段完成: {stage} ({status})")
+            yield sse_event({'stage': stage, 'status': status, **payload}, event='artifact')
+
+        yield sse_event({'done': True, 'failed': failed}, event='done')
+
+    return sse_response(generate())
+
+
+def submit_job(kind: str, fn, data: Dict[str, Any]):
+    """提交后台任务并立即返回任务ID"""
+    try:
+        job = job_manager.submit(kind, fn, data)
+    except JobQueueFullError as e:
+        logger.warning(f"拒绝任务 {kind}: {e}")
+        return jsonify({'error': str(e)}), 503
+
+    return jsonify({
+        'status': 'accepted',
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id)
+    }), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """查询任务状态"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """获取任务结果，未完成时返回 202"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    if job.status == CANCELLED:
+        return jsonify({'error': '任务已取消', 'job': job.to_dict()}), 409
+    if not job.finished:
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result), job.http_status
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    """取消任务"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/generate_poster_variants', methods=['POST'])
+def generate_poster_variants():
+    """
+    并发生成多个海报变体（同一 prompt 不同 seed，或多个 prompt），
+    每完成一个即以 SSE 推送，单个变体失败不影响其余变体
+    """
+    data = with_client_id(request.get_json(silent=True))
+
+    analysis = data.get('analysis') or load_latest_analysis(data.get('client_id'))
+    image_prompts = data.get('image_prompts') or None
+    image_prompt = (analysis or {}).get('image_prompt', '')
+
+    if image_prompts is not None:
+        if not isinstance(image_prompts, list) or not all(
+                isinstance(prompt, str) and prompt.strip() for prompt in image_prompts):
+            return jsonify({'error': 'image_prompts 必须是非空字符串组成的列表'}), 400
+        if len(image_prompts) > config.poster_max_variants:
+            return jsonify({'error': f'image_prompts 最多 {config.poster_max_variants} 个'}), 400
+        if any(len(prompt) > config.poster_max_prompt_chars for prompt in image_prompts):
+            return jsonify({'error': f'每个 image_prompt 不能超过 {config.poster_max_prompt_chars} 个字符'}), 400
+
+    if not image_prompts and not image_prompt:
+        return jsonify({'error': '需要先进行需求分析或提供 image_prompts'}), 400
+
+    try:
+        variants = int(data.get('variants', 4))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'variants 必须是整数'}), 400
+    if image_prompts:
+        variants = len(image_prompts)
+    if not 1 <= variants <= config.poster_max_variants:
+        return jsonify({'error': f'变体数量必须在 1 到 {config.poster_max_variants} 之间'}), 400
+
+    job_id = new_job_id()
+    logger.info(f"开始生成 {variants} 个海报变体，任务: {job_id}")
+
+    def generate():
+        succeeded, failed = 0, 0
+        for variant in design_variants(image_prompt=image_prompt, n=variants, image_prompts=image_prompts,
+                                       output_dir=ARTIFACT_ROOT, job_id=job_id):
+            images = describe_images(variant['paths'])
+            if images:
+                succeeded += 1
+            else:
+                failed += 1
+            yield sse_event({
+                'index': variant['index'],
+                'seed': variant['seed'],
+                'status': 'success' if images else 'error',
+                'error': variant['error'] or (None if images else '未生成图片'),
+                'images': images
+            }, event='variant')
+
+        yield sse_event({
+            'done': True,
+            'job_id': job_id,
+            'succeeded': succeeded,
+            'failed': failed
+        }, event='done')
+
+    return sse_response(generate())
+
+
+@app.route('/artifacts/<path:filename>', methods=['GET'])
+def serve_artifact(filename):
+    """
+    提供生成的图片等静态产物；支持 ETag/Last-Modified 条件请求和 Range 请求，
+    参数 v 与当前内容哈希一致的链接内容不会变化，可被浏览器长期缓存
+    """
+    root = os.path.abspath(ARTIFACT_ROOT)
+    file_path = os.path.join(root, filename)
+    if derivatives.enabled and not os.path.exists(file_path) and DERIVED_DIR in filename.split('/'):
+        # 衍生图片可能仍在后台生成，短暂等待；超时返回 404，前端回退到原图
+        derivatives.wait_for(file_path, timeout=config.derivative_wait_timeout)
+
+    response = send_from_directory(root, filename, conditional=True)
+    version = request.args.get('v')
+    # 版本号不匹配（手写或过期的链接）时不能长期缓存，否则文件更新后浏览器仍使用旧内容
+    if version and version == artifact_version(os.path.join(root, filename)):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/pages/<path:filename>', methods=['GET'])
+def serve_page(filename):
+    """
+    提供优化后的生成页面及其 CSS/JS；按 Accept-Encoding 直接返回预压缩的 br/gzip 文件。
+    文件名含内容哈希，内容不会变化，可被浏览器和代理长期缓存
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in HTML_MIMETYPES:
+        return jsonify({'error': '页面未找到'}), 404
+
+    variant, encoding = html_optimizer.choose_variant(filename, request.headers.get('Accept-Encoding'))
+    response = send_from_directory(os.path.abspath(html_optimizer.root), variant,
+                                   mimetype=HTML_MIMETYPES[ext], conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 
 @app.errorhandler(404)
@@ -2,44 +2,317 @@
 """
 小红书 MCP 客户端
 通过 HTTP/SSE 传输连接到小红书 MCP 服务器
+
+请求按 JSON-RPC id 匹配响应，多个请求可以同时在途：每个请求在 IO 线程池中发出 POST，
+响应无论来自 POST 本身还是持久的 GET SSE 流，都会分发给对应 id 的 Future
 """
 
+import asyncio
+import logging
 import requests
 import json
 import os
-from typing import Dict, Any, Optional, List
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable, Dict, Any, Optional, List, Iterator, Tuple
+
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class MCPError(Exception):
+    """MCP 传输层错误"""
+
+
+class MCPUnavailableError(MCPError):
+    """没有可用的客户端，请求尚未发出（客户端已关闭、等待空闲客户端超时、握手失败）"""
+
+
+# 只读工具的默认缓存有效期（秒），传给 XiaohongshuMCPClient(cache_ttls=...) 以启用缓存
+DEFAULT_CACHE_TTLS = {
+    "check_login_status": 30,
+    "list_feeds": 60,
+    "search_feeds": 120,
+    "get_feed_detail": 300,
+    "user_profile": 300,
+}
+
+
+class SSEEvent:
+    def __init__(self, event: str, data: bytes, event_id: Optional[str] = None):
+        self.event = event
+        self.data = data
+        self.id = event_id
+
+    def json(self) -> Any:
+        # json.loads 直接接受 bytes，省去一次解码出的中间字符串
+        return json.loads(self.data)
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器（按 WHATWG 规范）：
+    支持 CRLF/LF/CR 换行、多行 data、event、id 和 retry 字段，以及跨数据块的行；
+    数据以 bytes 累积，事件结束时才拼接一次
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # 缓冲区中已确认不含换行的前缀长度，超长的行跨多个数据块时不重复扫描
+        self._scanned = 0
+        self._data: List[bytes] = []
+        self._event = ''
+        self.last_event_id: Optional[str] = None
+        self.retry: Optional[int] = None
+
+    def reset(self) -> None:
+        """连接断开后丢弃未完成的事件，保留 last_event_id 和 retry 供重连使用"""
+        self._buffer = bytearray()
+        self._scanned = 0
+        self._data = []
+        self._event = ''
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一个数据块，返回其中已完整的事件"""
+        buffer = self._buffer
+        buffer.extend(chunk)
+        events = []
+        pos = 0
+        scan = self._scanned
+
+        while True:
+            lf = buffer.find(b'\n', scan)
+            cr = buffer.find(b'\r', scan, lf if lf != -1 else len(buffer))
+            if cr != -1:
+                if cr + 1 == len(buffer):
+                    # 末尾的 CR 可能是 CRLF 的前半，等下一个数据块再判断
+                    scan = cr
+                    break
+                end, next_pos = cr, cr + 2 if buffer[cr + 1] == 0x0A else cr + 1
+            elif lf != -1:
+                end, next_pos = lf, lf + 1
+            else:
+                scan = len(buffer)
+                break
+
+            event = self._process_line(bytes(buffer[pos:end]))
+            if event is not None:
+                events.append(event)
+            pos = scan = next_pos
+
+        del buffer[:pos]
+        self._scanned = scan - pos
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """
+        流结束时调用：末尾等待判断的 CR 此时确定是行尾，处理该行并返回因此完整的事件；
+        其余未以空行结束的数据按规范丢弃
+        """
+        events = []
+        if self._buffer.endswith(b'\r'):
+            event = self._process_line(bytes(self._buffer[:-1]))
+            if event is not None:
+                events.append(event)
+        self.reset()
+        return events
+
+    def _process_line(self, line: bytes) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+        if line.startswith(b':'):
+            # 注释行（常用作心跳）
+            return None
+
+        field, sep, value = line.partition(b':')
+        if sep and value.startswith(b' '):
+            value = value[1:]
+
+        if field == b'data':
+            self._data.append(value)
+        elif field == b'event':
+            self._event = value.decode('utf-8', errors='replace')
+        elif field == b'id':
+            if b'\0' not in value:
+                self.last_event_id = value.decode('utf-8', errors='replace')
+        elif field == b'retry':
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        """空行结束一个事件；没有 data 的事件按规范丢弃"""
+        data, event_type = self._data, self._event
+        self._data, self._event = [], ''
+        if not data:
+            return None
+        return SSEEvent(event_type or 'message', b'\n'.join(data), self.last_event_id)
+
+
+class ToolResponseCache:
+    """
+    只读工具的响应缓存：按工具设置 TTL，超出容量时按 LRU 淘汰；
+    写操作完成后清除可能受影响的缓存条目
+    """
+
+    # 写工具 -> [(受影响的只读工具, 需要相同取值的参数名)]；参数名为空表示清除该工具的全部缓存
+    INVALIDATES = {
+        "like_feed": [("get_feed_detail", ("feed_id",))],
+        "favorite_feed": [("get_feed_detail", ("feed_id",))],
+        "post_comment_to_feed": [("get_feed_detail", ("feed_id",))],
+        "publish_content": [("list_feeds", ()), ("user_profile", ())],
+        "publish_with_video": [("list_feeds", ()), ("user_profile", ())],
+        "get_login_qrcode": [("check_login_status", ())],
+    }
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 256):
+        """
+        初始化缓存
+        
+        Args:
+            ttls: 工具名称 -> 缓存有效期（秒）；不在其中的工具不缓存
+            max_entries: 最多保留的条目数
+        """
+        self.ttls = dict(ttls)
+        self.max_entries = max_entries
+        # (工具名称, 规范化参数) -> (过期时间, 参数, 序列化后的响应)
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def canonical_arguments(arguments: Optional[Dict[str, Any]]) -> str:
+        """参数的规范化 JSON，键顺序和空白不同的相同参数得到相同的缓存键"""
+        return json.dumps(arguments or {}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+    def get(self, tool_name: str, arguments: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if tool_name not in self.ttls:
+            return None
+        key = (tool_name, self.canonical_arguments(arguments))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, raw = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # 每次返回独立的副本，调用方修改结果不会影响缓存
+        return json.loads(raw)
+
+    def record(self, tool_name: str, arguments: Optional[Dict[str, Any]], response: Dict[str, Any]) -> None:
+        """记录一次工具调用的结果：缓存成功的只读调用，写调用则清除相关条目"""
+        self.invalidate_for(tool_name, arguments)
+
+        ttl = self.ttls.get(tool_name)
+        if not ttl or 'result' not in response or response['result'].get('isError'):
+            return
+        key = (tool_name, self.canonical_arguments(arguments))
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, dict(arguments or {}),
+                                  json.dumps(response, ensure_ascii=False))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_for(self, tool_name: str, arguments: Optional[Dict[str, Any]]) -> None:
+        """清除写工具调用可能影响的缓存条目"""
+        for target, match_keys in self.INVALIDATES.get(tool_name, []):
+            self.invalidate(target, {k: (arguments or {}).get(k) for k in match_keys})
+
+    def invalidate(self, tool_name: str, match: Optional[Dict[str, Any]] = None) -> None:
+        """清除某个工具的缓存；给出 match 时只清除参数取值与之相同的条目"""
+        match = match or {}
+        with self._lock:
+            for key in [key for key, (_, arguments, _) in self._entries.items()
+                        if key[0] == tool_name and all(arguments.get(k) == v for k, v in match.items())]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
 
 
 class XiaohongshuMCPClient:
-    def __init__(self, base_url: str = "http://localhost:18060/mcp"):
+    # 持久 SSE 流多久没有数据就重新连接（秒）
+    STREAM_IDLE_TIMEOUT = 120
+    # 批量请求得到这些状态码时，认为服务器不支持 JSON-RPC 批量消息
+    BATCH_REJECTED_STATUS = (400, 405, 415, 422, 501)
+
+    def __init__(self, base_url: str = "http://localhost:18060/mcp", max_in_flight: int = 8,
+                 request_timeout: float = 300, listen: bool = True,
+                 cache_ttls: Optional[Dict[str, float]] = None, cache_max_entries: int = 256,
+                 on_message: Optional[Callable[[Dict[str, Any]], None]] = None):
         """
         初始化小红书 MCP 客户端
         
         Args:
             base_url: MCP 服务器的 URL
+            max_in_flight: 同时在途的最大请求数（IO 线程数）
+            request_timeout: 同步调用等待响应的超时时间（秒）
+            listen: 初始化后是否保持一条 GET SSE 流接收服务器推送的消息
+            cache_ttls: 只读工具的缓存有效期（如 DEFAULT_CACHE_TTLS），None 表示不缓存
+            cache_max_entries: 缓存最多保留的条目数
+            on_message: 服务器主动发来的通知（如日志、资源变更）的回调；进度通知交给各调用自己的 progress 回调
         """
         self.base_url = base_url
         self.session = requests.Session()
+        # 在途请求各占一条连接，持久 SSE 流额外占一条
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight + 1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.message_id = 0
         self.initialized = False
         self.session_id = None
+        self.request_timeout = request_timeout
+        self.listen = listen
+        # 首次被服务器拒绝后置为 False，之后的批量调用直接逐条发送
+        self.batch_supported = True
+        self.cache = ToolResponseCache(cache_ttls, cache_max_entries) if cache_ttls else None
+        self.on_message = on_message
+        # progressToken -> 进度回调
+        self._progress_handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+        self._lock = threading.Lock()
+        self._pending: Dict[Any, Future] = {}
+        self._io_executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='mcp-io')
+        self._stream_thread: Optional[threading.Thread] = None
+        self._stream_response = None
+        self._closed = False
     
     def _get_next_id(self) -> int:
         """获取下一个消息 ID"""
-        self.message_id += 1
-        return self.message_id
-    
-    def _send_message(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """
-        发送 JSON-RPC 消息
-        
-        Args:
-            method: JSON-RPC 方法名
-            params: 方法参数
-        
-        Returns:
-            响应结果
-        """
+        with self._lock:
+            self.message_id += 1
+            return self.message_id
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json, text/event-stream"
+        }
+        # 添加 session ID（如果存在）
+        if self.session_id:
+            headers["Mcp-Session-Id"] = self.session_id
+        return headers
+
+    def _remember_session(self, response: requests.Response) -> None:
+        """保存服务器分配的 session ID"""
+        if 'Mcp-Session-Id' in response.headers:
+            self.session_id = response.headers['Mcp-Session-Id']
+
+    # ==================== 传输层：按 id 多路复用 ====================
+
+    def _register(self, method: str, params: Optional[Dict[str, Any]] = None):
+        """构造请求消息，并登记等待其响应的 Future"""
         message = {
             "jsonrpc": "2.0",
             "method": method,
@@ -48,53 +321,321 @@ class XiaohongshuMCPClient:
         
         if params is not None:
             message["params"] = params
+
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise MCPUnavailableError("MCP 客户端已关闭")
+            self._pending[message["id"]] = future
+        return message, future
+
+    def send_request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        发送 JSON-RPC 请求但不等待响应
         
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json, text/event-stream"
-        }
-        
-        # 添加 session ID（如果存在）
-        if self.session_id:
-            headers["Mcp-Session-Id"] = self.session_id
-        
-        response = self.session.post(
-            self.base_url,
-            json=message,
-            headers=headers,
-            stream=True
-        )
+        Args:
+            method: JSON-RPC 方法名
+            params: 方法参数
         
-        # 保存 session ID
-        if 'Mcp-Session-Id' in response.headers:
-            self.session_id = response.headers['Mcp-Session-Id']
+        Returns:
+            Future，结果为与该请求 id 匹配的完整响应消息
+        """
+        message, future = self._register(method, params)
+        self._io_executor.submit(self._post, message)
+        return future
+
+    def send_batch(self, calls: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Future]:
+        """
+        把多个请求放进一个 JSON-RPC 批量消息发送；服务器不支持批量时自动改为逐条并发发送
         
-        response.raise_for_status()
+        Args:
+            calls: (方法名, 参数) 列表
         
-        # 解析响应（可能是 JSON 或 SSE 格式）
+        Returns:
+            与 calls 顺序一致的 Future 列表
+        """
+        registered = [self._register(method, params) for method, params in calls]
+        messages = [message for message, _ in registered]
+        if self.batch_supported:
+            self._io_executor.submit(self._post, messages)
+        else:
+            for message in messages:
+                self._io_executor.submit(self._post, message)
+        return [future for _, future in registered]
+
+    def _post(self, payload: Any) -> None:
+        """在 IO 线程中发出 POST（单条或批量），并把响应体中的消息分发出去"""
+        ids = [m["id"] for m in payload] if isinstance(payload, list) else [payload["id"]]
+        method = 'batch' if isinstance(payload, list) else self._metric_method(payload)
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.base_url,
+                json=payload,
+                headers=self._headers(),
+                stream=True,
+                timeout=(10, self.request_timeout)
+            )
+            with response:
+                self._remember_session(response)
+                if isinstance(payload, list) and response.status_code in self.BATCH_REJECTED_STATUS:
+                    self._fallback_from_batch(payload, f"HTTP {response.status_code}")
+                    return
+                response.raise_for_status()
+                for reply in self._iter_response(response):
+                    # 服务器不认识批量消息时，会返回一条 id 为 null 的错误
+                    if isinstance(payload, list) and isinstance(reply, dict) and reply.get('id') is None \
+                            and 'error' in reply:
+                        self._fallback_from_batch(payload, reply['error'].get('message', ''))
+                        return
+                    self._dispatch(reply)
+        except Exception as e:
+            metrics.MCP_ERRORS.inc(method=method)
+            for message_id in ids:
+                self._fail(message_id, e)
+            return
+        finally:
+            metrics.MCP_DURATION.observe(time.perf_counter() - started, method=method)
+
+        # 服务器以 202 受理、响应会从 GET 流上返回时继续等待（GET 流正在重连时也一样，
+        # 重连后服务器按 Last-Event-ID 补发）；没有在运行的监听线程则不会再有响应
+        with self._lock:
+            waiting = [message_id for message_id in ids if message_id in self._pending]
+        if waiting and not self._listening():
+            for message_id in waiting:
+                self._fail(message_id, MCPError(f"服务器没有返回请求 {message_id} 的响应"))
+
+    @staticmethod
+    def _metric_method(message: Dict[str, Any]) -> str:
+        """指标中的方法名，工具调用附带工具名"""
+        if message.get("method") == "tools/call":
+            return f"tools/call:{message.get('params', {}).get('name')}"
+        return message.get("method", "")
+
+    def _fallback_from_batch(self, messages: List[Dict[str, Any]], reason: str) -> None:
+        """服务器拒绝批量消息：记住这一点，并把尚未得到响应的请求逐条重发"""
+        if self.batch_supported:
+            logger.info(f"MCP 服务器不支持 JSON-RPC 批量请求（{reason}），改为逐条并发发送")
+            self.batch_supported = False
+        with self._lock:
+            remaining = [m for m in messages if m["id"] in self._pending]
+        for message in remaining:
+            self._io_executor.submit(self._post, message)
+
+    def _iter_response(self, response: requests.Response) -> Iterator[Any]:
+        """解析响应（可能是 JSON 或 SSE 格式）"""
         content_type = response.headers.get('Content-Type', '')
         
         if 'application/json' in content_type:
-            # 直接返回 JSON
-            return response.json()
-        else:
-            # 解析 SSE 流
-            for line in response.iter_lines():
-                if not line:
-                    continue
-                
-                line = line.decode('utf-8')
-                
-                if line.startswith('data: '):
-                    data = line[6:]
-                    try:
-                        result = json.loads(data)
-                        if 'result' in result or 'error' in result:
-                            return result
-                    except json.JSONDecodeError:
-                        continue
-        
-        return {}
+            yield response.json()
+        elif 'text/event-stream' in content_type:
+            yield from self._iter_sse(response)
+
+    def _iter_sse(self, response: requests.Response, parser: Optional[SSEParser] = None) -> Iterator[Any]:
+        """逐条解析 SSE 流中的 JSON 消息"""
+        parser = parser or SSEParser()
+        # chunk_size=None：分块传输时每收到一块就处理，不等缓冲区填满
+        for chunk in response.iter_content(chunk_size=None):
+            yield from self._decode_events(parser.feed(chunk))
+        yield from self._decode_events(parser.close())
+
+    @staticmethod
+    def _decode_events(events: List[SSEEvent]) -> Iterator[Any]:
+        for event in events:
+            try:
+                yield event.json()
+            except ValueError:
+                logger.debug(f"忽略无法解析的 SSE 事件: {event.event}")
+
+    def _dispatch(self, message: Any) -> None:
+        """把收到的消息交给等待该 id 的请求；其余为服务器主动发来的消息"""
+        if isinstance(message, list):
+            for item in message:
+                self._dispatch(item)
+            return
+        if not isinstance(message, dict):
+            return
+
+        if 'id' in message and ('result' in message or 'error' in message):
+            with self._lock:
+                future = self._pending.pop(message['id'], None)
+            if future is not None and future.set_running_or_notify_cancel():
+                future.set_result(message)
+            return
+
+        self._handle_server_message(message)
+
+    def _handle_server_message(self, message: Dict[str, Any]) -> None:
+        """处理服务器发来的通知和请求"""
+        method = message.get('method')
+        if method == 'ping' and 'id' in message:
+            # 服务器的存活探测需要回复，否则会被认为连接已失效
+            self._io_executor.submit(self._reply, message['id'], {})
+            return
+
+        if method == 'notifications/progress':
+            params = message.get('params') or {}
+            with self._lock:
+                handler = self._progress_handlers.get(params.get('progressToken'))
+            if handler is not None:
+                self._notify(handler, params)
+                return
+
+        logger.debug(f"收到 MCP 服务器消息: {method}")
+        if self.on_message is not None:
+            self._notify(self.on_message, message)
+
+    @staticmethod
+    def _notify(callback: Callable[[Dict[str, Any]], None], payload: Dict[str, Any]) -> None:
+        """调用回调；回调出错不影响消息分发"""
+        try:
+            callback(payload)
+        except Exception as e:
+            logger.warning(f"MCP 消息回调出错: {e}")
+
+    def _reply(self, message_id: Any, result: Dict[str, Any]) -> None:
+        try:
+            self.session.post(
+                self.base_url,
+                json={"jsonrpc": "2.0", "id": message_id, "result": result},
+                headers=self._headers(),
+                timeout=(10, 30)
+            ).close()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"回复 MCP 服务器请求失败: {e}")
+
+    def _fail(self, message_id: Any, error: BaseException) -> None:
+        with self._lock:
+            future = self._pending.pop(message_id, None)
+        if future is not None and future.set_running_or_notify_cancel():
+            future.set_exception(error)
+
+    def _abandon(self, future: Future) -> None:
+        """放弃等待中的请求：不再登记其响应"""
+        with self._lock:
+            for message_id, pending in list(self._pending.items()):
+                if pending is future:
+                    del self._pending[message_id]
+        future.cancel()
+
+    def _wait(self, future: Future, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """同步等待请求完成；超时（默认 request_timeout 秒）后放弃该请求"""
+        timeout = self.request_timeout if timeout is None else timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Python 3.11 之前 concurrent.futures.TimeoutError 不是内置 TimeoutError
+            self._abandon(future)
+            raise MCPError(f"等待 MCP 响应超时（{timeout} 秒）")
+
+    async def _await(self, future: Future) -> Dict[str, Any]:
+        """_wait 的 asyncio 版本：超时或调用方被取消时同样放弃该请求，超时抛出 MCPError"""
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.request_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            raise MCPError(f"等待 MCP 响应超时（{self.request_timeout} 秒）")
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+
+    def _listening(self) -> bool:
+        """监听线程是否在运行（包括已连接和断开后等待重连）"""
+        thread = self._stream_thread
+        return thread is not None and thread.is_alive() and not self._closed
+
+    def _start_listener(self) -> None:
+        if not self.listen or self._stream_thread is not None:
+            return
+        self._stream_thread = threading.Thread(target=self._listen, name='mcp-stream', daemon=True)
+        self._stream_thread.start()
+
+    def _listen(self) -> None:
+        """
+        保持一条 GET SSE 流，接收服务器推送的通知、请求，以及先以 202 受理、之后才返回的响应；
+        断开后按指数退避重连，服务器不支持（405）时退出
+        """
+        attempt = 0
+        parser = SSEParser()
+        while not self._closed:
+            headers = {"Accept": "text/event-stream"}
+            if self.session_id:
+                headers["Mcp-Session-Id"] = self.session_id
+            if parser.last_event_id:
+                # 重连时告诉服务器最后收到的事件，支持续传的服务器会补发断开期间的消息
+                headers["Last-Event-ID"] = parser.last_event_id
+            try:
+                response = self.session.get(self.base_url, headers=headers, stream=True,
+                                            timeout=(10, self.STREAM_IDLE_TIMEOUT))
+                if response.status_code == 405 or 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                    response.close()
+                    logger.info("MCP 服务器不提供独立的 SSE 流，响应只从 POST 返回")
+                    return
+                response.raise_for_status()
+
+                self._stream_response = response
+                attempt = 0
+                with response:
+                    for message in self._iter_sse(response, parser):
+                        self._dispatch(message)
+            except requests.exceptions.ConnectionError as e:
+                # 包括空闲超时：连接长时间没有数据时重新建立，顺便发现已失效的连接
+                if not self._closed:
+                    logger.info(f"MCP SSE 流断开，准备重连: {e}")
+            except Exception as e:
+                if not self._closed:
+                    logger.warning(f"MCP SSE 流异常: {e}")
+            finally:
+                self._stream_response = None
+
+            if not self._closed:
+                # 服务器用 retry 字段指定了重连间隔时以它为准
+                delay = parser.retry / 1000 if parser.retry is not None else min(2 ** attempt, 30)
+                time.sleep(delay)
+                attempt += 1
+                parser.reset()
+
+    def close(self) -> None:
+        """关闭持久流和 IO 线程，未完成的请求以错误结束"""
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        # 持久流由监听线程自己在读到数据或空闲超时后退出；在这里关闭会与正在阻塞读取的线程争用连接
+        self._io_executor.shutdown(wait=False)
+
+        for future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(MCPError("MCP 客户端已关闭"))
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ==================== JSON-RPC 调用 ====================
+    
+    def _send_message(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        发送 JSON-RPC 消息并等待响应
+        
+        Args:
+            method: JSON-RPC 方法名
+            params: 方法参数
+        
+        Returns:
+            响应结果
+        """
+        with tracing.span(f"mcp {method}"):
+            return self._wait(self.send_request(method, params))
+
+    async def _asend_message(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """_send_message 的 asyncio 版本，等待期间不占用事件循环"""
+        with tracing.span(f"mcp {method}"):
+            return await self._await(self.send_request(method, params))
     
     def _send_notification(self, method: str, params: Optional[Dict[str, Any]] = None) -> None:
         """
@@ -112,15 +653,11 @@ class XiaohongshuMCPClient:
         if params is not None:
             message["params"] = params
         
-        headers = {"Content-Type": "application/json"}
-        
-        if self.session_id:
-            headers["Mcp-Session-Id"] = self.session_id
-        
         response = self.session.post(
             self.base_url,
             json=message,
-            headers=headers
+            headers=self._headers(),
+            timeout=(10, 30)
         )
         response.raise_for_status()
     
@@ -141,9 +678,25 @@ class XiaohongshuMCPClient:
         # 发送 initialized 通知完成握手
         self._send_notification("notifications/initialized")
         self.initialized = True
+        self._start_listener()
         
         return result
     
+    def reinitialize(self) -> Dict[str, Any]:
+        """丢弃当前会话（如服务器重启或会话过期后），重新完成握手"""
+        self.session_id = None
+        self.initialized = False
+        return self.initialize()
+
+    def ping(self, timeout: float = 10) -> bool:
+        """探测连接和会话是否仍然有效"""
+        try:
+            response = self._wait(self.send_request("ping"), timeout)
+        except Exception as e:
+            logger.info(f"MCP ping 失败: {e}")
+            return False
+        return 'result' in response
+
     def list_tools(self) -> Dict[str, Any]:
         """获取可用工具列表"""
         if not self.initialized:
@@ -151,13 +704,15 @@ class XiaohongshuMCPClient:
         
         return self._send_message("tools/list", {})
     
-    def call_tool(self, tool_name: str, arguments: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def call_tool(self, tool_name: str, arguments: Optional[Dict[str, Any]] = None,
+                  progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
         调用指定的工具
         
         Args:
             tool_name: 工具名称
             arguments: 工具参数
+            progress: 进度回调，参数为 notifications/progress 的 params（progress、total、message）
         
         Returns:
             工具执行结果
@@ -165,10 +720,139 @@ class XiaohongshuMCPClient:
         if not self.initialized:
             raise Exception("Client not initialized. Call initialize() first.")
         
-        return self._send_message("tools/call", {
+        with tracing.span(f"mcp tools/call:{tool_name}"):
+            return self._wait(self.submit_tool(tool_name, arguments, progress))
+
+    def submit_tool(self, tool_name: str, arguments: Optional[Dict[str, Any]] = None,
+                    progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Future:
+        """
+        调用工具但不等待，可同时发起多个调用
+        
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+            progress: 进度回调（同 call_tool）
+        
+        Returns:
+            Future，结果与 call_tool 的返回值相同
+        """
+        if not self.initialized:
+            raise Exception("Client not initialized. Call initialize() first.")
+
+        cached = self._cached_future(tool_name, arguments)
+        if cached is not None:
+            return cached
+
+        params = {
             "name": tool_name,
             "arguments": arguments or {}
-        })
+        }
+        token = None
+        if progress is not None:
+            # 带上 progressToken，服务器才会为这次调用发送进度通知
+            token = uuid.uuid4().hex
+            params["_meta"] = {"progressToken": token}
+            with self._lock:
+                self._progress_handlers[token] = progress
+
+        future = self.send_request("tools/call", params)
+        if token is not None:
+            future.add_done_callback(lambda _: self._drop_progress_handler(token))
+        self._track(tool_name, arguments, future)
+        return future
+
+    def _drop_progress_handler(self, token: str) -> None:
+        with self._lock:
+            self._progress_handlers.pop(token, None)
+
+    def _cached_future(self, tool_name: str, arguments: Optional[Dict[str, Any]]) -> Optional[Future]:
+        """缓存命中时返回一个已完成的 Future"""
+        if self.cache is None:
+            return None
+        response = self.cache.get(tool_name, arguments)
+        if response is None:
+            return None
+        future = Future()
+        future.set_result(response)
+        return future
+
+    def _track(self, tool_name: str, arguments: Optional[Dict[str, Any]], future: Future) -> None:
+        """调用完成后把结果交给缓存"""
+        if self.cache is None:
+            return
+        # 写调用发出时先清除一次，完成后（record 中）再清除一次，期间缓存的旧结果也不会留下
+        self.cache.invalidate_for(tool_name, arguments)
+
+        def record(done: Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                self.cache.record(tool_name, arguments, done.result())
+        future.add_done_callback(record)
+
+    async def alist_tools(self) -> Dict[str, Any]:
+        """list_tools 的 asyncio 版本"""
+        if not self.initialized:
+            raise Exception("Client not initialized. Call initialize() first.")
+        
+        return await self._asend_message("tools/list", {})
+
+    async def acall_tool(self, tool_name: str, arguments: Optional[Dict[str, Any]] = None,
+                         progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """call_tool 的 asyncio 版本，可用 asyncio.gather 并发多个调用"""
+        with tracing.span(f"mcp tools/call:{tool_name}"):
+            return await self._await(self.submit_tool(tool_name, arguments, progress))
+
+    def call_tools_batch(self, calls: List[Tuple[str, Optional[Dict[str, Any]]]],
+                         chunk_size: int = 20) -> List[Dict[str, Any]]:
+        """
+        批量调用工具，例如对一批笔记点赞、收藏或获取详情
+        
+        每 chunk_size 个调用合并为一个 JSON-RPC 批量请求，各分块同时在途；
+        单个调用失败不影响其余调用
+        
+        Args:
+            calls: (工具名称, 工具参数) 列表
+            chunk_size: 每个批量请求包含的调用数
+        
+        Returns:
+            与 calls 顺序一致的结果列表，每项包含：
+                - tool: 工具名称
+                - ok: 是否成功
+                - response: 完整的 JSON-RPC 响应（传输失败时为 None）
+                - error: 失败原因（成功时为 None）
+        """
+        if not self.initialized:
+            raise Exception("Client not initialized. Call initialize() first.")
+
+        # 命中缓存的调用不再发送
+        futures: List[Optional[Future]] = [self._cached_future(name, arguments) for name, arguments in calls]
+        uncached = [i for i, future in enumerate(futures) if future is None]
+
+        for start in range(0, len(uncached), chunk_size):
+            chunk = uncached[start:start + chunk_size]
+            sent = self.send_batch([
+                ("tools/call", {"name": calls[i][0], "arguments": calls[i][1] or {}}) for i in chunk
+            ])
+            for i, future in zip(chunk, sent):
+                self._track(calls[i][0], calls[i][1], future)
+                futures[i] = future
+
+        results = []
+        for (name, _), future in zip(calls, futures):
+            try:
+                response = self._wait(future)
+            except Exception as e:
+                results.append({"tool": name, "ok": False, "response": None, "error": str(e)})
+                continue
+
+            if 'error' in response:
+                error = response['error'].get('message', str(response['error']))
+            elif response.get('result', {}).get('isError'):
+                content = response['result'].get('content') or [{}]
+                error = content[0].get('text', '工具执行失败')
+            else:
+                error = None
+            results.append({"tool": name, "ok": error is None, "response": response, "error": error})
+        return results
     
     # ==================== 便捷方法：封装小红书功能 ====================
     
@@ -305,6 +989,17 @@ class XiaohongshuMCPClient:
         Returns:
             发布结果
         """
+        return self.call_tool("publish_content", self._publish_content_args(title, content, images, tags))
+
+    async def apublish_content(self, title: str, content: str, images: List[str],
+                               tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """publish_content 的 asyncio 版本"""
+        return await self.acall_tool("publish_content", self._publish_content_args(title, content, images, tags))
+
+    @staticmethod
+    def _publish_content_args(title: str, content: str, images: List[str],
+                              tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """构造 publish_content 工具的参数"""
         # 如果 title 或 content 为空，设置为默认值 "test"
         if not title:
             title = "test"
@@ -327,11 +1022,11 @@ class XiaohongshuMCPClient:
         }
         if tags:
             args["tags"] = tags
-        
-        return self.call_tool("publish_content", args)
+        return args
     
     def publish_video(self, title: str, content: str, video: str,
-                     tags: Optional[List[str]] = None) -> Dict[str, Any]:
+                     tags: Optional[List[str]] = None,
+                     progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
         发布视频内容
         
@@ -340,10 +1035,25 @@ class XiaohongshuMCPClient:
             content: 正文内容
             video: 本地视频文件绝对路径
             tags: 话题标签列表（可选）
+            progress: 上传进度回调（服务器支持进度通知时）
         
         Returns:
             发布结果
         """
+        return self.call_tool("publish_with_video", self._publish_video_args(title, content, video, tags),
+                              progress=progress)
+
+    async def apublish_video(self, title: str, content: str, video: str,
+                             tags: Optional[List[str]] = None,
+                             progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """publish_video 的 asyncio 版本"""
+        return await self.acall_tool("publish_with_video", self._publish_video_args(title, content, video, tags),
+                                     progress=progress)
+
+    @staticmethod
+    def _publish_video_args(title: str, content: str, video: str,
+                            tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """构造 publish_with_video 工具的参数"""
         args = {
             "title": title,
             "content": content,
@@ -351,8 +1061,178 @@ class XiaohongshuMCPClient:
         }
         if tags:
             args["tags"] = tags
+        return args
+
+
+class XiaohongshuMCPClientPool:
+    def __init__(self, base_url: str = "http://localhost:18060/mcp", size: int = 2,
+                 health_check_interval: float = 60, acquire_timeout: float = 60, **client_kwargs):
+        """
+        共享的 MCP 客户端池：每个客户端同一时间只借给一个调用方，
+        空闲过久的客户端在借出前先做健康检查，会话失效时自动重新握手
+        
+        Args:
+            base_url: MCP 服务器的 URL
+            size: 最多创建的客户端数
+            health_check_interval: 客户端空闲超过该时间（秒）后，借出前先 ping 一次
+            acquire_timeout: 等待空闲客户端的超时时间（秒）
+            client_kwargs: 传给 XiaohongshuMCPClient 的其他参数
+        """
+        self.base_url = base_url
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.client_kwargs = client_kwargs
+
+        # 空闲客户端及其归还时间，后进先出，常用的客户端保持活跃
+        self._idle: List[Tuple[XiaohongshuMCPClient, float]] = []
+        self._created = 0
+        self._closed = False
+        self._available = threading.Condition()
+
+    def warm_up(self, count: Optional[int] = None) -> int:
+        """
+        预先创建并初始化客户端，首个请求不再承担握手开销
+        
+        Returns:
+            成功初始化的客户端数
+        """
+        clients = []
+        try:
+            for _ in range(min(count or self.size, self.size)):
+                clients.append(self.acquire())
+        except Exception as e:
+            logger.warning(f"MCP 客户端预热失败: {e}")
+        finally:
+            for client in clients:
+                self.release(client)
+        logger.info(f"MCP 客户端池预热完成: {len(clients)}/{self.size}")
+        return len(clients)
+
+    def acquire(self) -> XiaohongshuMCPClient:
+        """借出一个可用（已初始化）的客户端"""
+        deadline = time.time() + self.acquire_timeout
+        with self._available:
+            while True:
+                if self._closed:
+                    raise MCPUnavailableError("MCP 客户端池已关闭")
+                if self._idle:
+                    client, released_at = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    client, released_at = None, None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise MCPUnavailableError(f"等待空闲的 MCP 客户端超时（{self.acquire_timeout} 秒）")
+                self._available.wait(remaining)
+
+        try:
+            if client is None:
+                client = XiaohongshuMCPClient(self.base_url, **self.client_kwargs)
+                client.initialize()
+                logger.info(f"MCP 客户端已初始化，会话: {client.session_id}")
+            elif not client.initialized:
+                client.reinitialize()
+            elif time.time() - released_at > self.health_check_interval and not client.ping():
+                logger.info("MCP 客户端健康检查失败，重新初始化会话")
+                client.reinitialize()
+        except Exception as e:
+            self._discard(client)
+            raise MCPUnavailableError(f"MCP客户端初始化失败: {e}") from e
+        return client
+
+    def release(self, client: XiaohongshuMCPClient) -> None:
+        """归还客户端"""
+        with self._available:
+            if self._closed:
+                client.close()
+                return
+            self._idle.append((client, time.time()))
+            self._available.notify()
+
+    def _discard(self, client: Optional[XiaohongshuMCPClient]) -> None:
+        """丢弃无法使用的客户端，空出名额供重新创建"""
+        if client is not None:
+            client.close()
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    @staticmethod
+    def _session_rejected(error: Exception) -> bool:
+        """请求被服务器以 4xx 拒绝（会话过期或服务器重启后会话不存在），重新握手后可以重试"""
+        if not isinstance(error, requests.exceptions.HTTPError) or error.response is None:
+            return False
+        return 400 <= error.response.status_code < 500 and error.response.status_code != 429
+
+    @staticmethod
+    def not_delivered(error: Exception) -> bool:
+        """
+        请求确定没有被服务器执行：未能发出（连接被拒绝、连接超时、没有可用客户端），或被服务器以 429/503 拒绝。
+        读超时、连接中途断开、等待响应超时等情况无法确定服务器是否已执行，返回 False
+        """
+        if isinstance(error, (MCPUnavailableError, requests.exceptions.ConnectTimeout)):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code in (429, 503)
+        if isinstance(error, requests.exceptions.ConnectionError):
+            # 连接被拒绝时，urllib3 的 NewConnectionError 包在 MaxRetryError 中
+            reason = getattr(error.args[0], 'reason', None) if error.args else None
+            return isinstance(reason, NewConnectionError)
+        return False
+
+    def call(self, fn: Callable[[XiaohongshuMCPClient], Any]) -> Any:
+        """
+        借出客户端执行 fn(client)；请求因会话失效被拒绝时，重新握手后重试一次
         
-        return self.call_tool("publish_with_video", args)
+        请求已被服务器拒绝，重试不会导致重复发布；连接中途断开的情况无法确定是否已执行，不重试
+        """
+        client = self.acquire()
+        try:
+            try:
+                return fn(client)
+            except Exception as e:
+                if not self._session_rejected(e):
+                    if isinstance(e, requests.exceptions.ConnectionError):
+                        # 下次借出时重新握手
+                        client.initialized = False
+                    raise
+                logger.info(f"MCP 会话已失效（{e}），重新初始化后重试")
+                client.reinitialize()
+                return fn(client)
+        finally:
+            self.release(client)
+
+    async def acall(self, fn: Callable[[XiaohongshuMCPClient], Awaitable[Any]]) -> Any:
+        """
+        call 的 asyncio 版本：fn(client) 返回协程（如 client.acall_tool(...)）
+
+        借出客户端可能要等待空闲客户端或完成握手，放在线程中进行，不阻塞事件循环
+        """
+        client = await asyncio.to_thread(self.acquire)
+        try:
+            try:
+                return await fn(client)
+            except Exception as e:
+                if not self._session_rejected(e):
+                    if isinstance(e, requests.exceptions.ConnectionError):
+                        client.initialized = False
+                    raise
+                logger.info(f"MCP 会话已失效（{e}），重新初始化后重试")
+                await asyncio.to_thread(client.reinitialize)
+                return await fn(client)
+        finally:
+            self.release(client)
+
+    def close(self) -> None:
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._available.notify_all()
+        for client, _ in idle:
+            client.close()
 
 
 def main():
@@ -397,6 +1277,8 @@ def main():
         print(f"✗ 请求错误: {e}")
     except Exception as e:
         print(f"✗ 发生错误: {e}")
+    finally:
+        client.close()
 
 
 if __name__ == "__main__":
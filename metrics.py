@@ -0,0 +1,311 @@
+"""
+运行指标
+计数器、仪表和直方图按标签记录在进程内，/metrics 以 Prometheus 文本格式输出。
+不依赖 prometheus_client；多进程部署时每个进程各自统计
+"""
+
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 覆盖毫秒级的本地处理到数分钟的模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("计数器只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        """代码块执行期间仪表值加一"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 标签 -> [各桶计数（非累计）, 总和, 次数]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录代码块的耗时（出错时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# ===== 指标定义 =====
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'hackerchain_http_request_duration_seconds', 'HTTP请求耗时（流式响应计到发送完毕）',
+    ['route', 'method', 'status']))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'hackerchain_http_requests_in_flight', '正在处理的HTTP请求数', ['route']))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    'hackerchain_http_request_errors_total', '返回 4xx/5xx 的HTTP请求数', ['route', 'status']))
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'hackerchain_stage_duration_seconds', '各处理阶段的耗时', ['stage']))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'hackerchain_stage_errors_total', '各处理阶段抛出异常的次数', ['stage']))
+
+MODEL_DURATION = REGISTRY.register(Histogram(
+    'hackerchain_model_request_duration_seconds', '单次上游模型请求的耗时（流式请求计到建立流）', ['model']))
+MODEL_IN_FLIGHT = REGISTRY.register(Gauge(
+    'hackerchain_model_requests_in_flight', '正在进行的上游模型请求数（含未读完的流）', ['model']))
+MODEL_ERRORS = REGISTRY.register(Counter(
+    'hackerchain_model_request_errors_total', '上游模型请求失败次数（含重试）', ['model']))
+MODEL_TOKENS = REGISTRY.register(Counter(
+    'hackerchain_model_tokens_total', '上游返回的 usage 中的 token 数', ['model', 'type']))
+
+MCP_DURATION = REGISTRY.register(Histogram(
+    'hackerchain_mcp_request_duration_seconds', 'MCP 请求往返耗时', ['method']))
+MCP_ERRORS = REGISTRY.register(Counter(
+    'hackerchain_mcp_request_errors_total', 'MCP 请求失败次数', ['method']))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    记录一个处理阶段的耗时，阶段内抛出异常时计入错误数
+
+    Args:
+        name: 阶段名（prompt_build / json_parse / file_write 等）
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=name)
+
+
+def _usage_value(usage: Any, field: str) -> int:
+    value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+    return value if isinstance(value, int) else 0
+
+
+def record_usage(model: str, usage: Any) -> None:
+    """
+    累加一次调用的 token 用量
+
+    Args:
+        model: 模型名
+        usage: 响应中的 usage（SDK 对象或字典），None 时忽略
+    """
+    if not usage:
+        return
+    for field, kind in (('prompt_tokens', 'prompt'), ('completion_tokens', 'completion')):
+        tokens = _usage_value(usage, field)
+        if tokens:
+            MODEL_TOKENS.inc(tokens, model=model, type=kind)
+
+
+def init_app(app, endpoint: str = '/metrics') -> None:
+    """
+    为 Flask 应用注册请求指标和 /metrics 接口
+
+    Args:
+        app: Flask 应用
+        endpoint: 指标接口的路径
+    """
+    from flask import Response, g, request
+
+    def route_label() -> str:
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def _start_request_metrics():
+        if request.path == endpoint:
+            return
+        g.metrics_started = time.perf_counter()
+        g.metrics_route = route_label()
+        REQUESTS_IN_FLIGHT.inc(route=g.metrics_route)
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        route, method, status = g.pop('metrics_route'), request.method, response.status_code
+
+        def finish():
+            REQUESTS_IN_FLIGHT.dec(route=route)
+            REQUEST_DURATION.observe(time.perf_counter() - started, route=route, method=method, status=status)
+            if status >= 400:
+                REQUEST_ERRORS.inc(route=route, status=status)
+
+        # 流式响应在内容发送完毕、连接关闭时才算结束
+        response.call_on_close(finish)
+        return response
+
+    @app.route(endpoint, methods=['GET'])
+    def metrics():
+        """Prometheus 指标"""
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,880 @@
+"""
+模型调用网关
+所有上游模型（DeepSeek、OpenRouter）统一经过这里：按 base URL 共享长连接池、
+按模型限制并发、对瞬时错误做带抖动的指数退避重试，并在上游持续故障时熔断
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx2
+import openai
+import requests
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 视为瞬时故障、可以重试的 HTTP 状态码
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class GatewayError(Exception):
+    """网关错误基类"""
+
+
+class CircuitOpenError(GatewayError):
+    """熔断器打开，暂停向该模型发送请求"""
+
+
+class GatewayBusyError(GatewayError):
+    """等待并发配额超时"""
+
+
+def normalize_messages(messages) -> List[Dict[str, Any]]:
+    """
+    把各种形式的输入统一为 OpenAI chat 消息列表
+
+    支持：字符串、消息字典列表、带 content/type 属性的消息对象列表，其他类型转为字符串
+    """
+    if isinstance(messages, str):
+        return [{'role': 'user', 'content': messages}]
+
+    if isinstance(messages, list):
+        formatted_messages = []
+        for msg in messages:
+            if isinstance(msg, dict):
+                formatted_messages.append(msg)
+            elif hasattr(msg, 'content'):
+                role = 'user'
+                if hasattr(msg, 'type'):
+                    role = 'user' if msg.type == 'human' else 'assistant'
+                formatted_messages.append({
+                    'role': role,
+                    'content': msg.content
+                })
+        return formatted_messages
+
+    return [{'role': 'user', 'content': str(messages)}]
+
+
+def _parse_concurrency_limits(spec: str) -> Dict[str, int]:
+    """解析形如 "deepseek-reasoner=4,deepseek-chat=16" 的并发配置"""
+    limits = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        model, value = item.split('=', 1)
+        try:
+            limits[model.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"忽略无效的并发配置: {item}")
+    return limits
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        连续失败达到阈值后打开；冷却时间过后进入半开状态，只放行一个试探请求
+
+        Args:
+            failure_threshold: 打开熔断所需的连续失败次数
+            recovery_timeout: 打开后到允许试探的秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return 'half_open'
+            return 'open'
+
+    def before_call(self, name: str) -> bool:
+        """
+        调用前检查熔断状态；熔断打开时抛出 CircuitOpenError
+
+        Returns:
+            本次调用是否占用了半开状态下唯一的试探名额
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at < self.recovery_timeout or self._trial_in_flight:
+                raise CircuitOpenError(f"{name} 上游持续失败，已暂时熔断，请稍后重试")
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                # 试探失败或达到阈值：重新计时
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """试探请求以非瞬时错误结束时，归还试探名额"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class _Waiter:
+    __slots__ = ('granted', 'wake')
+
+    def __init__(self, wake: Callable[[], None]):
+        self.granted = False
+        self.wake = wake
+
+
+def _resolve(future: 'asyncio.Future') -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int):
+        """
+        并发配额：线程（同步接口）和事件循环（异步接口）中的调用方共用同一个计数。
+        等待者按到达顺序排队，配额归还时直接交给队首，不需要轮询
+
+        Args:
+            limit: 最大并发数
+        """
+        self.limit = limit
+        self._available = limit
+        self._waiters: 'deque[_Waiter]' = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> bool:
+        """调用方需持有锁；有人排队时新来的不插队"""
+        if self._available > 0 and not self._waiters:
+            self._available -= 1
+            return True
+        return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """放弃等待；放弃前已经分到配额时返回 True"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """在线程中等待配额，超时返回 False"""
+        with self._lock:
+            if self._try_acquire():
+                return True
+            event = threading.Event()
+            waiter = _Waiter(event.set)
+            self._waiters.append(waiter)
+        if event.wait(timeout):
+            return True
+        return self._abandon(waiter)
+
+    async def aacquire(self, timeout: Optional[float] = None) -> bool:
+        """在事件循环中等待配额（不占用线程），超时返回 False"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return True
+            future = loop.create_future()
+            # release 可能在其他线程中调用
+            waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, future))
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._abandon(waiter)
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                # 已分到的配额转交给下一个等待者
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                if self._available >= self.limit:
+                    raise ValueError("并发配额归还次数多于获取次数")
+                self._available += 1
+                return
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+        try:
+            waiter.wake()
+        except RuntimeError:
+            # 等待者所在的事件循环已关闭，配额转交给下一个
+            self.release()
+
+
+class _ManagedStream:
+    """
+    流式响应的包装：迭代期间占用模型并发配额（以及半开状态下的熔断试探名额），结束、关闭或被回收时释放
+    """
+
+    def __init__(self, gateway: 'ModelGateway', model: str, stream, semaphore: ConcurrencyLimiter,
+                 trial: bool = False):
+        self._gateway = gateway
+        self._model = model
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._semaphore = semaphore
+        self._closed = False
+        # 持有试探名额且尚未把结果记入熔断器；提前关闭或非瞬时错误时需要归还名额
+        self._trial = trial
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._trial = False
+            self._gateway._breaker(self._model).record_success()
+            self.close()
+            raise
+        except Exception as e:
+            metrics.MODEL_ERRORS.inc(model=self._model)
+            if self._gateway.is_retryable(e):
+                self._trial = False
+                self._gateway._breaker(self._model).record_failure()
+            self.close()
+            raise
+        # 请求了 include_usage 时，最后一个 chunk 带有本次的 token 用量
+        metrics.record_usage(self._model, getattr(chunk, 'usage', None))
+        return chunk
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._stream, 'close', None)
+            if close:
+                close()
+        finally:
+            self._semaphore.release()
+            metrics.MODEL_IN_FLIGHT.dec(model=self._model)
+            if self._trial:
+                # 提前关闭（如客户端断开）或非瞬时错误：结果不计入熔断，归还试探名额
+                self._trial = False
+                self._gateway._breaker(self._model).release_trial()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class _AsyncManagedStream:
+    """
+    _ManagedStream 的 asyncio 版本：迭代期间占用模型并发配额，结束或 aclose() 时释放
+    """
+
+    def __init__(self, gateway: 'ModelGateway', model: str, stream, semaphore: ConcurrencyLimiter,
+                 trial: bool = False):
+        self._gateway = gateway
+        self._model = model
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._semaphore = semaphore
+        self._closed = False
+        self._trial = trial
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._trial = False
+            self._gateway._breaker(self._model).record_success()
+            await self.aclose()
+            raise
+        except Exception as e:
+            metrics.MODEL_ERRORS.inc(model=self._model)
+            if self._gateway.is_retryable(e):
+                self._trial = False
+                self._gateway._breaker(self._model).record_failure()
+            await self.aclose()
+            raise
+        metrics.record_usage(self._model, getattr(chunk, 'usage', None))
+        return chunk
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._stream, 'close', None)
+            if close:
+                await close()
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self._semaphore.release()
+        metrics.MODEL_IN_FLIGHT.dec(model=self._model)
+        if self._trial:
+            self._trial = False
+            self._gateway._breaker(self._model).release_trial()
+
+    def __del__(self):
+        # 没有读完也没有 aclose 就被回收时，至少归还配额（连接由连接池回收）
+        if not self._closed:
+            self._closed = True
+            try:
+                self._release()
+            except Exception:
+                pass
+
+
+class ModelGateway:
+    def __init__(self, max_connections: int = 50, max_keepalive: int = 20, connect_timeout: float = 10.0,
+                 read_timeout: float = 600.0, max_retries: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, default_concurrency: int = 8,
+                 concurrency_limits: Optional[Dict[str, int]] = None, acquire_timeout: float = 120.0,
+                 breaker_threshold: int = 5, breaker_timeout: float = 30.0):
+        """
+        初始化模型网关
+
+        Args:
+            max_connections: 每个 base URL 连接池的最大连接数
+            max_keepalive: 每个连接池保持的空闲长连接数
+            connect_timeout: 建连超时
+            read_timeout: 读取超时（推理模型可能需要数分钟）
+            max_retries: 瞬时错误的最大重试次数
+            backoff_base: 退避基数（秒）
+            backoff_max: 单次退避上限（秒）
+            default_concurrency: 未单独配置的模型的并发上限
+            concurrency_limits: 按模型名配置的并发上限
+            acquire_timeout: 等待并发配额的最长时间
+            breaker_threshold: 熔断阈值（连续失败次数）
+            breaker_timeout: 熔断冷却时间（秒）
+        """
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_concurrency = default_concurrency
+        self.concurrency_limits = concurrency_limits or {}
+        self.acquire_timeout = acquire_timeout
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+
+        self._lock = threading.Lock()
+        self._pools: Dict[str, Any] = {}
+        self._sessions: Dict[str, requests.Session] = {}
+        self._clients: Dict[Tuple[str, str], OpenAI] = {}
+        self._async_pools: Dict[str, Any] = {}
+        self._async_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+        self._semaphores: Dict[str, ConcurrencyLimiter] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_env(cls) -> 'ModelGateway':
+        """从环境变量读取配置"""
+        return cls(
+            max_connections=int(os.getenv('MODEL_MAX_CONNECTIONS', '50')),
+            max_keepalive=int(os.getenv('MODEL_MAX_KEEPALIVE', '20')),
+            read_timeout=float(os.getenv('MODEL_READ_TIMEOUT', '600')),
+            max_retries=int(os.getenv('MODEL_MAX_RETRIES', '3')),
+            default_concurrency=int(os.getenv('MODEL_DEFAULT_CONCURRENCY', '8')),
+            concurrency_limits=_parse_concurrency_limits(
+                os.getenv('MODEL_CONCURRENCY', 'deepseek-reasoner=4,deepseek-chat=16')
+            ),
+            breaker_threshold=int(os.getenv('MODEL_BREAKER_THRESHOLD', '5')),
+            breaker_timeout=float(os.getenv('MODEL_BREAKER_TIMEOUT', '30'))
+        )
+
+    # ==================== 连接池 ====================
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _pool_options(self) -> Dict[str, Any]:
+        """SDK 连接池的连接数上限和超时（同步、异步连接池共用）"""
+        return {
+            'limits': httpx2.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive),
+            'timeout': httpx2.Timeout(self.read_timeout, connect=self.connect_timeout)
+        }
+
+    def http_pool(self, url: str):
+        """获取 url 所在源站共享的 SDK 长连接池（同一源站的多个 OpenAI 客户端共用）"""
+        origin = self._origin(url)
+        with self._lock:
+            pool = self._pools.get(origin)
+            if pool is None:
+                pool = openai.DefaultHttpxClient(**self._pool_options())
+                self._pools[origin] = pool
+            return pool
+
+    def http_session(self, url: str) -> requests.Session:
+        """获取 url 所在源站共享的 requests 长连接会话（用于非 SDK 的接口）"""
+        origin = self._origin(url)
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_keepalive)
+                session.mount(origin, adapter)
+                self._sessions[origin] = session
+            return session
+
+    def get_client(self, base_url: str, api_key: str) -> OpenAI:
+        """获取共享连接池的 OpenAI 兼容客户端（重试由网关负责，SDK 自身不重试）"""
+        key = (base_url, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.http_pool(base_url),
+            timeout=self.read_timeout,
+            max_retries=0
+        )
+        with self._lock:
+            return self._clients.setdefault(key, client)
+
+    def warm_up(self, base_url: str, api_key: str) -> None:
+        """
+        预先创建客户端并建立到源站的长连接，让进程处理的第一个请求不必等待握手
+
+        多进程部署时在每个 worker fork 之后调用；上游不可用时只记录日志
+        """
+        client = self.get_client(base_url, api_key)
+        self.http_session(base_url)
+        started = time.perf_counter()
+        try:
+            client.with_options(timeout=self.connect_timeout + 5).models.list()
+        except Exception as e:
+            logger.warning(f"预热 {self._origin(base_url)} 失败: {e}")
+            return
+        logger.info(f"已预热 {self._origin(base_url)}（{time.perf_counter() - started:.2f} 秒）")
+
+    # ==================== 并发与熔断 ====================
+
+    def _semaphore(self, model: str) -> ConcurrencyLimiter:
+        with self._lock:
+            semaphore = self._semaphores.get(model)
+            if semaphore is None:
+                limit = self.concurrency_limits.get(model, self.default_concurrency)
+                semaphore = ConcurrencyLimiter(limit)
+                self._semaphores[model] = semaphore
+            return semaphore
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = CircuitBreaker(self.breaker_threshold, self.breaker_timeout)
+                self._breakers[model] = breaker
+            return breaker
+
+    def _acquire(self, model: str) -> ConcurrencyLimiter:
+        semaphore = self._semaphore(model)
+        if not semaphore.acquire(timeout=self.acquire_timeout):
+            raise GatewayBusyError(f"{model} 并发已满，等待 {self.acquire_timeout:.0f} 秒仍未获得配额")
+        return semaphore
+
+    # ==================== 重试 ====================
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        """判断错误是否为可重试的瞬时故障"""
+        if isinstance(error, (openai.APIConnectionError, requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """带完全抖动的指数退避；上游给出 Retry-After 时以其为下限"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return delay
+
+    def _attempt(self, model: str, fn: Callable[[], Any]) -> Any:
+        """在熔断器与并发配额保护下执行一次调用"""
+        breaker = self._breaker(model)
+        breaker.before_call(model)
+        try:
+            semaphore = self._acquire(model)
+        except GatewayBusyError:
+            breaker.release_trial()
+            raise
+        metrics.MODEL_IN_FLIGHT.inc(model=model)
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            metrics.MODEL_ERRORS.inc(model=model)
+            if self.is_retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.release_trial()
+            raise
+        finally:
+            semaphore.release()
+            metrics.MODEL_IN_FLIGHT.dec(model=model)
+            metrics.MODEL_DURATION.observe(time.perf_counter() - started, model=model)
+        breaker.record_success()
+        return result
+
+    def call(self, model: str, fn: Callable[[], Any]) -> Any:
+        """
+        执行一次上游调用：限并发、熔断、对瞬时错误重试
+
+        Args:
+            model: 模型名（并发和熔断按模型隔离）
+            fn: 实际发出请求的函数
+        """
+        attempt = 0
+        while True:
+            try:
+                with tracing.span(f"upstream {model}", attempt=attempt):
+                    return self._attempt(model, fn)
+            except Exception as e:
+                if not self.is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"{model} 调用失败（{e}），{delay:.2f} 秒后第 {attempt} 次重试")
+                time.sleep(delay)
+
+    # ==================== 对外接口 ====================
+
+    def chat_completion(self, model: str, messages, base_url: str, api_key: str, **kwargs):
+        """非流式 chat completion，返回完整响应对象"""
+        client = self.get_client(base_url, api_key)
+        formatted_messages = normalize_messages(messages)
+        response = self.call(model, lambda: client.chat.completions.create(
+            model=model,
+            messages=formatted_messages,
+            **kwargs
+        ))
+        metrics.record_usage(model, getattr(response, 'usage', None))
+        return response
+
+    def stream_chat_completion(self, model: str, messages, base_url: str, api_key: str, **kwargs) -> Iterator[Any]:
+        """
+        流式 chat completion，返回逐个产出 chunk 的迭代器
+
+        只有建立流之前的错误会重试；迭代期间一直占用该模型的并发配额。
+        默认请求 include_usage，流的最后一个 chunk 带有 token 用量（choices 为空）
+        """
+        client = self.get_client(base_url, api_key)
+        formatted_messages = normalize_messages(messages)
+        kwargs.setdefault('stream_options', {'include_usage': True})
+        breaker = self._breaker(model)
+        attempt = 0
+        while True:
+            trial = breaker.before_call(model)
+            try:
+                semaphore = self._acquire(model)
+            except GatewayBusyError:
+                breaker.release_trial()
+                raise
+            metrics.MODEL_IN_FLIGHT.inc(model=model)
+            started = time.perf_counter()
+            try:
+                with tracing.span(f"upstream {model} (connect)", attempt=attempt):
+                    stream = client.chat.completions.create(
+                        model=model,
+                        messages=formatted_messages,
+                        stream=True,
+                        **kwargs
+                    )
+                metrics.MODEL_DURATION.observe(time.perf_counter() - started, model=model)
+                return _ManagedStream(self, model, stream, semaphore, trial)
+            except Exception as e:
+                semaphore.release()
+                metrics.MODEL_IN_FLIGHT.dec(model=model)
+                metrics.MODEL_ERRORS.inc(model=model)
+                metrics.MODEL_DURATION.observe(time.perf_counter() - started, model=model)
+                if not self.is_retryable(e):
+                    breaker.release_trial()
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"{model} 流式调用失败（{e}），{delay:.2f} 秒后第 {attempt} 次重试")
+                time.sleep(delay)
+
+    def post_json(self, model: str, url: str, payload: Dict[str, Any],
+                  headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        通过共享连接池发送 JSON POST 请求（用于非 SDK 的接口，如 OpenRouter 图像生成）
+
+        4xx/5xx 状态码抛出 requests.HTTPError（RETRYABLE_STATUS_CODES 中的状态码会重试），
+        与 apost_json 一致，鉴权或参数错误不会被当作空结果返回
+        """
+        session = self.http_session(url)
+
+        def send():
+            response = session.post(url, json=payload, headers=headers,
+                                    timeout=(self.connect_timeout, self.read_timeout))
+            response.raise_for_status()
+            return response
+
+        return self.call(model, send)
+
+    def get_bytes(self, url: str) -> bytes:
+        """通过共享连接池下载资源（如模型返回的图片链接）"""
+        session = self.http_session(url)
+
+        def fetch():
+            response = session.get(url, timeout=(self.connect_timeout, self.read_timeout))
+            response.raise_for_status()
+            return response.content
+
+        return self.call(self._origin(url), fetch)
+
+    # ==================== 异步接口 ====================
+    # 供 ASGI 模式使用：等待上游期间不占用线程。并发配额、熔断器与同步接口共用，
+    # 两种模式同时运行时限流仍按模型统一计算
+
+    def async_http_pool(self, url: str):
+        """获取 url 所在源站共享的异步长连接池（绑定首次使用它的事件循环）"""
+        origin = self._origin(url)
+        with self._lock:
+            pool = self._async_pools.get(origin)
+            if pool is None:
+                pool = openai.DefaultAsyncHttpxClient(**self._pool_options())
+                self._async_pools[origin] = pool
+            return pool
+
+    def aget_client(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        """获取共享异步连接池的 OpenAI 兼容客户端"""
+        key = (base_url, api_key)
+        with self._lock:
+            client = self._async_clients.get(key)
+        if client is not None:
+            return client
+
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.async_http_pool(base_url),
+            timeout=self.read_timeout,
+            max_retries=0
+        )
+        with self._lock:
+            return self._async_clients.setdefault(key, client)
+
+    async def _aacquire(self, model: str) -> ConcurrencyLimiter:
+        """不阻塞事件循环地获取并发配额，与同步接口的调用方按到达顺序排队"""
+        semaphore = self._semaphore(model)
+        if not await semaphore.aacquire(timeout=self.acquire_timeout):
+            raise GatewayBusyError(f"{model} 并发已满，等待 {self.acquire_timeout:.0f} 秒仍未获得配额")
+        return semaphore
+
+    async def _aattempt(self, model: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """_attempt 的 asyncio 版本"""
+        breaker = self._breaker(model)
+        breaker.before_call(model)
+        try:
+            semaphore = await self._aacquire(model)
+        except GatewayBusyError:
+            breaker.release_trial()
+            raise
+        metrics.MODEL_IN_FLIGHT.inc(model=model)
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except Exception as e:
+            metrics.MODEL_ERRORS.inc(model=model)
+            if self.is_retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.release_trial()
+            raise
+        except BaseException:
+            # 请求被取消（如客户端断开），不计入熔断
+            breaker.release_trial()
+            raise
+        finally:
+            semaphore.release()
+            metrics.MODEL_IN_FLIGHT.dec(model=model)
+            metrics.MODEL_DURATION.observe(time.perf_counter() - started, model=model)
+        breaker.record_success()
+        return result
+
+    async def acall(self, model: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        call 的 asyncio 版本
+
+        Args:
+            model: 模型名
+            fn: 返回协程的函数（每次重试重新调用）
+        """
+        attempt = 0
+        while True:
+            try:
+                with tracing.span(f"upstream {model}", attempt=attempt):
+                    return await self._aattempt(model, fn)
+            except Exception as e:
+                if not self.is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"{model} 调用失败（{e}），{delay:.2f} 秒后第 {attempt} 次重试")
+                await asyncio.sleep(delay)
+
+    async def achat_completion(self, model: str, messages, base_url: str, api_key: str, **kwargs):
+        """chat_completion 的 asyncio 版本"""
+        client = self.aget_client(base_url, api_key)
+        formatted_messages = normalize_messages(messages)
+        response = await self.acall(model, lambda: client.chat.completions.create(
+            model=model,
+            messages=formatted_messages,
+            **kwargs
+        ))
+        metrics.record_usage(model, getattr(response, 'usage', None))
+        return response
+
+    async def astream_chat_completion(self, model: str, messages, base_url: str, api_key: str,
+                                      **kwargs) -> AsyncIterator[Any]:
+        """stream_chat_completion 的 asyncio 版本，返回异步迭代器（用完或中途放弃时调用 aclose()）"""
+        client = self.aget_client(base_url, api_key)
+        formatted_messages = normalize_messages(messages)
+        kwargs.setdefault('stream_options', {'include_usage': True})
+        breaker = self._breaker(model)
+        attempt = 0
+        while True:
+            trial = breaker.before_call(model)
+            try:
+                semaphore = await self._aacquire(model)
+            except GatewayBusyError:
+                breaker.release_trial()
+                raise
+            metrics.MODEL_IN_FLIGHT.inc(model=model)
+            started = time.perf_counter()
+            try:
+                with tracing.span(f"upstream {model} (connect)", attempt=attempt):
+                    stream = await client.chat.completions.create(
+                        model=model,
+                        messages=formatted_messages,
+                        stream=True,
+                        **kwargs
+                    )
+                metrics.MODEL_DURATION.observe(time.perf_counter() - started, model=model)
+                return _AsyncManagedStream(self, model, stream, semaphore, trial)
+            except BaseException as e:
+                semaphore.release()
+                metrics.MODEL_IN_FLIGHT.dec(model=model)
+                metrics.MODEL_DURATION.observe(time.perf_counter() - started, model=model)
+                if not isinstance(e, Exception):
+                    breaker.release_trial()
+                    raise
+                metrics.MODEL_ERRORS.inc(model=model)
+                if not self.is_retryable(e):
+                    breaker.release_trial()
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"{model} 流式调用失败（{e}），{delay:.2f} 秒后第 {attempt} 次重试")
+                await asyncio.sleep(delay)
+
+    async def apost_json(self, model: str, url: str, payload: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None) -> Any:
+        """
+        post_json 的 asyncio 版本，返回解析后的 JSON
+
+        经由 SDK 的底层请求发送（鉴权由 headers 提供），连接错误和 4xx/5xx 状态码
+        转换为 openai 的异常，重试判断与同步接口一致
+        """
+        client = self.aget_client(self._origin(url), 'unused')
+        return await self.acall(model, lambda: client.post(
+            url, cast_to=object, body=payload, options={'headers': headers or {}}
+        ))
+
+    async def aget_bytes(self, url: str) -> bytes:
+        """get_bytes 的 asyncio 版本"""
+        pool = self.async_http_pool(url)
+
+        async def fetch():
+            response = await pool.get(url, timeout=self.read_timeout)
+            if response.status_code >= 400:
+                raise openai.APIStatusError(f"下载失败: HTTP {response.status_code}", response=response, body=None)
+            return response.content
+
+        return await self.acall(self._origin(url), fetch)
+
+    async def aclose(self) -> None:
+        """关闭所有异步连接池（在创建它们的事件循环中调用）"""
+        with self._lock:
+            pools = list(self._async_pools.values())
+            self._async_pools.clear()
+            self._async_clients.clear()
+        for pool in pools:
+            await pool.aclose()
+
+    def close(self) -> None:
+        """关闭所有连接池"""
+        with self._lock:
+            pools = list(self._pools.values()) + list(self._sessions.values())
+            self._pools.clear()
+            self._sessions.clear()
+            self._clients.clear()
+        for pool in pools:
+            pool.close()
+
+
+# 进程内共享的网关实例
+gateway = ModelGateway.from_env()
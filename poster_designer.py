@@ -1,16 +1,32 @@
 import json, os
-import requests
-from openai import OpenAI
+import asyncio
 import base64
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from model_gateway import gateway
+import metrics
+import tracing
+from artifact_store import ArtifactStore, guess_image_extension, new_job_id
+
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")
+BRANDING_MODEL = "openai/gpt-5"
+IMAGE_MODEL = "google/gemini-2.5-flash-image-preview"
+OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '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')
+
+# 多变体生成时并发请求图像模型的线程池（所有请求共用，限制总并发）
+_variant_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('POSTER_VARIANT_WORKERS', '4')),
+    thread_name_prefix='poster-variant'
+)
 
 # --------------------
 # 1) 调用文本模型（生成 branding JSON）
 # --------------------
 def generate_branding(client, idea):
     # 你可以把下面的 system/user prompt 替换为你现有的 prompt 模板
-    completion = client.chat.completions.create(
+    completion = gateway.call(BRANDING_MODEL, lambda: client.chat.completions.create(
         extra_body={},
-        model="openai/gpt-5",
+        model=BRANDING_MODEL,
         messages=[
             {
                 "role": "system",
@@ -39,8 +55,9 @@ def generate_branding(client, idea):
                 ]
             }
         ]
-    )
+    ))
 
+    metrics.record_usage(BRANDING_MODEL, getattr(completion, 'usage', None))
     raw = completion.choices[0].message.content
     # 尝试解析 JSON
     try:
@@ -109,15 +126,16 @@ def build_image_prompt_from_branding(branding, fallback_raw_text=None):
 # --------------------
 # 3) 调用图像模型（OpenRouter 示例）
 # --------------------
-def call_image_model(api_key, image_prompt_text, output_dir="output"):
-    url = "https://openrouter.ai/api/v1/chat/completions"
+def _image_request(api_key, image_prompt_text, seed=None):
+    """构造图像模型请求，返回 (url, headers, payload)"""
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
 
     payload = {
-        "model": "google/gemini-2.5-flash-image-preview",
+        "model": IMAGE_MODEL,
         "messages": [
             {
                 "role": "user",
@@ -130,61 +148,149 @@ def call_image_model(api_key, image_prompt_text, output_dir="output"):
             "aspect_ratio": "2:3"
         }
     }
+    if seed is not None:
+        payload["seed"] = seed
+    return url, headers, payload
+
+def _image_urls(result):
+    """从图像模型的响应中取出图片地址（data URL 或可下载链接）"""
+    metrics.record_usage(IMAGE_MODEL, result.get("usage"))
+    if not result.get("choices"):
+        return []
+    message = result["choices"][0]["message"]
+    return [image["image_url"]["url"] for image in message.get("images", [])]
+
+def _save_data_url(store, job_id, image_data_url):
+    """保存 Base64 编码的图片，比如 data:image/png;base64,xxxxxx"""
+    header, encoded = image_data_url.split(",", 1)
+    with metrics.stage('base64_decode'):
+        image_bytes = base64.b64decode(encoded)
 
-    response = requests.post(url, headers=headers, json=payload)
-    result = response.json()
+    # 自动识别文件类型（png、jpeg等）
+    ext = header.split("/")[1].split(";")[0]
+    with metrics.stage('file_write'):
+        return store.save_bytes(job_id, image_bytes, ext)
+
+def _save_downloaded(store, job_id, img_data):
+    with metrics.stage('file_write'):
+        return store.save_bytes(job_id, img_data, guess_image_extension(img_data))
+
+@tracing.traced('call_image_model')
+def call_image_model(api_key, image_prompt_text, output_dir="output", job_id=None, seed=None):
+    """
+    调用图像模型并保存图片，返回本次保存的文件路径列表
+
+    图片保存在 output_dir/<job_id>/ 下并按内容哈希命名，并发的生成任务互不覆盖
+    """
+    store = ArtifactStore(output_dir)
+    job_id = job_id or new_job_id()
+    url, headers, payload = _image_request(api_key, image_prompt_text, seed)
+
+    response = gateway.post_json(IMAGE_MODEL, url, payload, headers=headers)
+    with metrics.stage('json_parse'):
+        result = response.json()
 
     # 提取并保存生成的图片
-    if result.get("choices"):
-        message = result["choices"][0]["message"]
-        if "images" in message:
-            for i, image in enumerate(message["images"]):
-                image_data_url = image["image_url"]["url"]
-
-                # 如果是Base64编码格式，比如 data:image/png;base64,xxxxxx
-                if image_data_url.startswith("data:image"):
-                    header, encoded = image_data_url.split(",", 1)
-                    image_bytes = base64.b64decode(encoded)
-
-                    # 自动识别文件类型（png、jpeg等）
-                    ext = header.split("/")[1].split(";")[0]
-                    filename = f"{output_dir}/generated_image_{i}.{ext}"
-
-                    with open(filename, "wb") as f:
-                        f.write(image_bytes)
-                else:
-                    # 如果返回的是真实URL（可下载链接）
-                    img_data = requests.get(image_data_url).content
-                    filename = f"generated_image_{i}.png"
-                    with open(filename, "wb") as f:
-                        f.write(img_data)
+    saved_paths = []
+    for image_data_url in _image_urls(result):
+        if image_data_url.startswith("data:image"):
+            filename = _save_data_url(store, job_id, image_data_url)
+        else:
+            # 如果返回的是真实URL（可下载链接）
+            filename = _save_downloaded(store, job_id, gateway.get_bytes(image_data_url))
+
+        if filename not in saved_paths:
+            saved_paths.append(filename)
+    return saved_paths
+
+async def acall_image_model(api_key, image_prompt_text, output_dir="output", job_id=None, seed=None):
+    """
+    call_image_model 的 asyncio 版本（ASGI 模式）：等待图像模型和下载时不占用线程，
+    解码和写文件放到线程中执行，不阻塞事件循环
+    """
+    with tracing.span('call_image_model'):
+        store = ArtifactStore(output_dir)
+        job_id = job_id or new_job_id()
+        url, headers, payload = _image_request(api_key, image_prompt_text, seed)
+
+        result = await gateway.apost_json(IMAGE_MODEL, url, payload, headers=headers)
+
+        saved_paths = []
+        for image_data_url in _image_urls(result):
+            if image_data_url.startswith("data:image"):
+                filename = await asyncio.to_thread(_save_data_url, store, job_id, image_data_url)
+            else:
+                img_data = await gateway.aget_bytes(image_data_url)
+                filename = await asyncio.to_thread(_save_downloaded, store, job_id, img_data)
+
+            if filename not in saved_paths:
+                saved_paths.append(filename)
+        return saved_paths
 
 # --------------------
 # 4) 完整调用示例（把上面三步串起来）
 # --------------------
-def generate_poster_pipeline(client, api_key, idea, output_dir):
+def generate_poster_pipeline(client, api_key, idea, output_dir, job_id=None):
     branding, raw = generate_branding(client, idea)
     image_prompt = build_image_prompt_from_branding(branding, fallback_raw_text=raw)
     print("=== Image Prompt ===\n", image_prompt[:2000].encode('utf-8', errors='replace').decode('utf-8'))
-    call_image_model(api_key, image_prompt, output_dir)
+    return call_image_model(api_key, image_prompt, output_dir, job_id)
 
-def design(idea, output_dir="output", image_prompt=None):
+def design(idea, output_dir="output", image_prompt=None, job_id=None):
+    """生成海报，返回本次生成的图片路径列表"""
     os.makedirs(output_dir, exist_ok=True)
 
-    API_KEY_REF = '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'
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=API_KEY_REF,
-        )
+    API_KEY_REF = OPENROUTER_API_KEY
+    client = gateway.get_client(OPENROUTER_BASE_URL, API_KEY_REF)
 
     # 如果提供了image_prompt，直接使用它；否则使用原有的pipeline
     if image_prompt:
         print("=== Using provided image prompt ===\n", image_prompt[:2000].encode('utf-8', errors='replace').decode('utf-8'))
-        call_image_model(API_KEY_REF, image_prompt, output_dir)
+        return call_image_model(API_KEY_REF, image_prompt, output_dir, job_id)
     else:
-        generate_poster_pipeline(client, API_KEY_REF, idea, output_dir)
+        return generate_poster_pipeline(client, API_KEY_REF, idea, output_dir, job_id)
     # print("Image model response:", json.dumps(result, ensure_ascii=False, indent=2))
     
+def design_variants(image_prompt=None, n=4, image_prompts=None, output_dir="output", job_id=None, seeds=None):
+    """
+    并发生成多个海报变体，按完成顺序逐个产出结果
+
+    Args:
+        image_prompt: 所有变体共用的 prompt（配合不同 seed）
+        n: 变体数量（提供 image_prompts 时以其长度为准）
+        image_prompts: 每个变体各自的 prompt
+        output_dir: 输出根目录
+        job_id: 任务ID，所有变体写入同一任务目录
+        seeds: 每个变体的随机种子；共用 prompt 且未指定时随机生成
+
+    Yields:
+        {"index", "seed", "prompt", "status": "success"|"empty"|"error", "paths", "error"}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    job_id = job_id or new_job_id()
+
+    prompts = list(image_prompts) if image_prompts else [image_prompt] * n
+    if seeds is None:
+        seeds = [None] * len(prompts) if image_prompts else [random.randint(0, 2 ** 31 - 1) for _ in prompts]
+
+    futures = {}
+    for index, (prompt, seed) in enumerate(zip(prompts, seeds)):
+        future = tracing.submit(_variant_executor, call_image_model, OPENROUTER_API_KEY, prompt, output_dir, job_id, seed)
+        futures[future] = (index, prompt, seed)
+
+    for future in as_completed(futures):
+        index, prompt, seed = futures[future]
+        variant = {"index": index, "seed": seed, "prompt": prompt, "paths": [], "error": None}
+        try:
+            variant["paths"] = future.result()
+            variant["status"] = "success" if variant["paths"] else "empty"
+        except Exception as e:
+            # 单个变体失败不影响其他变体
+            print(f"Warning: poster variant {index} failed:", e)
+            variant["status"] = "error"
+            variant["error"] = str(e)
+        yield variant
+
 # --------------------
 # 示例使用（替换 client, API_KEY_REF, idea）
 # --------------------
@@ -0,0 +1,305 @@
+"""
+小红书发布队列
+发布任务先写入 SQLite，再由后台线程按速率限制逐个执行。
+只有确定没有送达服务器的失败才按指数退避重试；结果不确定的失败（读超时、连接中途断开、
+执行中进程退出）标记为 unknown 等待人工确认，避免重复发布。
+队列可被多个进程共享，速率限制按所有进程合计
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# 无法确定是否已经发布，不再自动重试
+UNKNOWN = 'unknown'
+
+
+class PublishError(Exception):
+    """发布失败（服务器返回了错误结果），属于业务拒绝，不重试"""
+
+
+class PublishQueue:
+    def __init__(self, publisher: Callable[[str, Dict[str, Any]], Any], path: str = "state/publish_queue.db",
+                 rate_limit: int = 1, rate_window: float = 60, max_attempts: int = 5,
+                 retry_base: float = 30, retry_max: float = 900, stale_after: float = 1800,
+                 poll_interval: float = 1.0, retryable: Optional[Callable[[Exception], bool]] = None):
+        """
+        初始化发布队列
+
+        Args:
+            publisher: 执行发布的函数 (任务类型, 参数) -> 结果；抛出异常表示失败
+            path: 数据库文件路径
+            rate_limit: 每个时间窗口内最多开始执行的发布数
+            rate_window: 速率限制的时间窗口（秒）
+            max_attempts: 最多尝试次数，用完后任务标记为失败
+            retry_base: 重试退避的基础间隔（秒），每次失败翻倍
+            retry_max: 重试间隔上限（秒）
+            stale_after: 执行中的任务超过该时间没有结果（如进程崩溃），标记为 unknown
+            poll_interval: 队列为空时的轮询间隔（秒）
+            retryable: 判断异常是否确定发生在请求送达服务器之前（可以安全重试）；
+                None 表示任何异常都不重试
+        """
+        self.publisher = publisher
+        self.path = path
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.retryable = retryable
+
+        self._local = threading.local()
+        self._worker: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS publish_jobs (
+                id TEXT PRIMARY KEY,
+                idempotency_key TEXT UNIQUE,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                started_at REAL,
+                next_attempt_at REAL NOT NULL,
+                trace_id TEXT
+            )
+        """)
+        # 旧版本创建的表没有 trace_id 列
+        columns = {column['name'] for column in conn.execute("PRAGMA table_info(publish_jobs)")}
+        if 'trace_id' not in columns:
+            conn.execute("ALTER TABLE publish_jobs ADD COLUMN trace_id TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_jobs_ready ON publish_jobs (status, next_attempt_at)")
+        # 每次开始执行的时间，用于跨进程的速率限制
+        conn.execute("CREATE TABLE IF NOT EXISTS publish_starts (started_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程一个连接；fork 之后的子进程重新建立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'trace_id': row['trace_id'],
+            'next_attempt_at': row['next_attempt_at'] if row['status'] == PENDING else None
+        }
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        加入一个发布任务
+
+        Args:
+            kind: 任务类型（publish_content / publish_video）
+            payload: 发布参数
+            idempotency_key: 幂等键；已有相同键的排队中、执行中或已成功的任务时直接返回该任务，不会重复发布；
+                相同键的任务已失败或结果未知时视为重新提交，加入新任务
+
+        Returns:
+            任务信息
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if idempotency_key is not None:
+                # 已结束但没有发布成功的旧任务让出幂等键（旧任务记录保留）
+                conn.execute(
+                    "UPDATE publish_jobs SET idempotency_key = NULL WHERE idempotency_key = ? AND status IN (?, ?)",
+                    (idempotency_key, FAILED, UNKNOWN)
+                )
+            # 记录提交任务的请求的 trace ID，执行时写入任务自己的 trace 以便关联
+            conn.execute(
+                "INSERT INTO publish_jobs (id, idempotency_key, kind, payload, status, created_at, updated_at, "
+                "next_attempt_at, trace_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, idempotency_key, kind, json.dumps(payload, ensure_ascii=False), PENDING, now, now, now,
+                 tracing.current_trace_id())
+            )
+        except sqlite3.IntegrityError:
+            row = conn.execute("SELECT * FROM publish_jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+            conn.execute("ROLLBACK")
+            logger.info(f"幂等键 {idempotency_key} 已有发布任务 {row['id']}，不再重复加入")
+            return self._to_dict(row)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        logger.info(f"发布任务已加入队列: {job_id}（{kind}）")
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT * FROM publish_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """
+        取出下一个可执行的任务并标记为执行中；达到速率限制或没有任务时返回 None。
+        在写事务中完成，多个进程不会取到同一个任务
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 进程崩溃等原因遗留的执行中任务：发布可能已经完成，不能再放回队列
+            conn.execute(
+                "UPDATE publish_jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND started_at < ?",
+                (UNKNOWN, '执行中断（进程退出或超时），无法确定是否已发布，请人工确认', now,
+                 RUNNING, now - self.stale_after)
+            )
+
+            conn.execute("DELETE FROM publish_starts WHERE started_at <= ?", (now - self.rate_window,))
+            started = conn.execute("SELECT COUNT(*) FROM publish_starts").fetchone()[0]
+            if started >= self.rate_limit:
+                conn.execute("COMMIT")
+                return None
+
+            row = conn.execute(
+                "SELECT * FROM publish_jobs WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, created_at LIMIT 1",
+                (PENDING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                "UPDATE publish_jobs SET status = ?, attempts = attempts + 1, started_at = ?, updated_at = ? "
+                "WHERE id = ?",
+                (RUNNING, now, now, row['id'])
+            )
+            conn.execute("INSERT INTO publish_starts (started_at) VALUES (?)", (now,))
+            conn.execute("COMMIT")
+            return row
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _finish(self, job_id: str, result: Any) -> None:
+        self._connection().execute(
+            "UPDATE publish_jobs SET status = ?, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (SUCCEEDED, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+        )
+
+    def _fail(self, job_id: str, status: str, error: str) -> None:
+        self._connection().execute(
+            "UPDATE publish_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+
+    def _retry_or_fail(self, job_id: str, attempts: int, error: str) -> None:
+        """请求确定没有送达服务器的失败：按指数退避重试，用完尝试次数后标记为失败"""
+        now = time.time()
+        if attempts >= self.max_attempts:
+            self._fail(job_id, FAILED, error)
+            logger.error(f"发布任务 {job_id} 已失败 {attempts} 次，不再重试: {error}")
+            return
+
+        # 指数退避并加随机抖动，避免一批任务同时重试
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        self._connection().execute(
+            "UPDATE publish_jobs SET status = ?, error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+            (PENDING, error, now + delay, now, job_id)
+        )
+        logger.warning(f"发布任务 {job_id} 第 {attempts} 次失败，{delay:.0f} 秒后重试: {error}")
+
+    def run_once(self) -> bool:
+        """
+        执行一个任务
+
+        Returns:
+            是否执行了任务
+        """
+        row = self._claim()
+        if row is None:
+            return False
+
+        job_id, attempts = row['id'], row['attempts'] + 1
+        logger.info(f"开始执行发布任务 {job_id}（第 {attempts} 次）")
+        try:
+            with tracing.trace(f"publish {row['kind']}", job_id=job_id, attempt=attempts,
+                               parent_trace_id=row['trace_id']):
+                result = self.publisher(row['kind'], json.loads(row['payload']))
+        except PublishError as e:
+            # 服务器明确拒绝（如内容不合规），重试也不会成功
+            self._fail(job_id, FAILED, str(e))
+            logger.error(f"发布任务 {job_id} 被服务器拒绝: {e}")
+        except Exception as e:
+            if self.retryable is not None and self.retryable(e):
+                self._retry_or_fail(job_id, attempts, str(e))
+            else:
+                # 请求可能已被服务器执行，自动重试可能重复发布
+                self._fail(job_id, UNKNOWN, f"无法确定是否已发布，请人工确认: {e}")
+                logger.error(f"发布任务 {job_id} 结果未知，不再重试: {e}")
+        else:
+            self._finish(job_id, result)
+            logger.info(f"发布任务 {job_id} 已完成")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.error(f"发布队列处理出错: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        """启动后台处理线程"""
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run, name='publish-queue', daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+            self._worker = None
@@ -0,0 +1,347 @@
+"""
+会话级状态存储
+按键保存可 JSON 序列化的状态（如每个客户端最近一次的分析结果），支持 TTL 和容量淘汰。
+内存后端适用于单进程；SQLite 后端可在同一台机器的多个进程之间共享，
+Redis 后端（需要安装 redis）可在多台机器之间共享
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Sequence
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore(ABC):
+    """状态存储接口"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, key: str, fn: Callable[[Optional[Any]], Optional[Any]], ttl: Optional[float] = None) -> Optional[Any]:
+        """
+        原子地读取-修改-写回一个键（多个进程同时修改同一个键时不会丢失更新）
+
+        Args:
+            key: 键
+            fn: 传入当前值（不存在时为 None），返回新值；返回 None 时删除该键
+            ttl: 新值的有效期（秒），None 表示使用默认有效期
+
+        Returns:
+            写入的新值
+        """
+        raise NotImplementedError
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 default_ttl: Optional[float] = None):
+        """
+        进程内状态存储，按最近使用顺序淘汰
+
+        Args:
+            max_entries: 最多保留的条目数
+            max_bytes: 所有值序列化后的总字节数上限
+            default_ttl: 默认有效期（秒），None 表示不过期
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # key -> (过期时间, 序列化后的值)；保存序列化结果，调用方拿到的是独立副本
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str) -> None:
+        _, raw = self._entries.pop(key)
+        self._bytes -= len(raw)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, raw = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raw = json.dumps(value, ensure_ascii=False)
+        ttl = ttl if ttl is not None else self.default_ttl
+        expires_at = time.time() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, raw)
+            self._bytes += len(raw)
+            self._evict()
+
+    def _evict(self) -> None:
+        """先清理过期条目，再按 LRU 淘汰到容量以内（调用方需持有锁）"""
+        if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        now = time.time()
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at is not None and expires_at <= now]:
+            self._remove(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Optional[Any]], ttl: Optional[float] = None) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            current = None
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                current = json.loads(entry[1])
+            value = fn(current)
+            if key in self._entries:
+                self._remove(key)
+            if value is None:
+                return None
+            raw = json.dumps(value, ensure_ascii=False)
+            ttl = ttl if ttl is not None else self.default_ttl
+            self._entries[key] = (time.time() + ttl if ttl else None, raw)
+            self._bytes += len(raw)
+            self._evict()
+        return value
+
+
+class SQLiteStateStore(StateStore):
+    # 每写入多少次做一次过期清理和容量淘汰
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: str = "state/state.db", max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, default_ttl: Optional[float] = None,
+                 pinned_prefixes: Sequence[str] = ()):
+        """
+        基于 SQLite 的状态存储（WAL 模式），可被同一台机器上的多个进程共享
+
+        Args:
+            path: 数据库文件路径
+            max_entries: 最多保留的条目数
+            max_bytes: 所有值的总字节数上限
+            default_ttl: 默认有效期（秒），None 表示不过期
+            pinned_prefixes: 这些前缀的键不计入容量、不会被容量淘汰，只按有效期过期
+                （如进行中的聊天会话和后台任务）
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.pinned_prefixes = tuple(pinned_prefixes)
+        # 可淘汰条目的过滤条件及其参数
+        self._evictable = ' AND '.join(['substr(key, 1, ?) != ?'] * len(self.pinned_prefixes)) or '1'
+        self._evictable_params = tuple(x for prefix in self.pinned_prefixes for x in (len(prefix), prefix))
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_updated_at ON state (updated_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程一个连接；fork 之后的子进程重新建立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        raw, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            conn.execute("DELETE FROM state WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            return None
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raw = json.dumps(value, ensure_ascii=False)
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+            (key, raw, expires_at, now)
+        )
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % self.PRUNE_INTERVAL == 0
+        if should_prune:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Optional[Any]], ttl: Optional[float] = None) -> Optional[Any]:
+        conn = self._connection()
+        ttl = ttl if ttl is not None else self.default_ttl
+        # BEGIN IMMEDIATE 立即取得写锁，其他进程的修改在此期间等待
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+            current = json.loads(row[0]) if row is not None and (row[1] is None or row[1] > now) else None
+            value = fn(current)
+            if value is None:
+                conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now + ttl if ttl else None, now)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def prune(self) -> None:
+        """删除过期条目，并按更新时间淘汰超出容量的旧条目（pinned_prefixes 的键除外）"""
+        conn = self._connection()
+        evictable, params = self._evictable, self._evictable_params
+        try:
+            conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            count, total = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM state WHERE {evictable}", params
+            ).fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    f"DELETE FROM state WHERE key IN "
+                    f"(SELECT key FROM state WHERE {evictable} ORDER BY updated_at LIMIT ?)",
+                    params + (count - self.max_entries,)
+                )
+            if total > self.max_bytes:
+                # 按更新时间从旧到新累计，删除超出部分
+                conn.execute(f"""
+                    DELETE FROM state WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(LENGTH(value)) OVER (ORDER BY updated_at DESC) AS running
+                            FROM state WHERE {evictable}
+                        ) WHERE running > ?
+                    )
+                """, params + (self.max_bytes,))
+        except sqlite3.Error as e:
+            logger.warning(f"状态存储清理失败: {e}")
+
+
+class RedisStateStore(StateStore):
+    # update() 遇到并发修改时的最大重试次数
+    MAX_UPDATE_RETRIES = 50
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "hackerchain:",
+                 default_ttl: Optional[float] = None):
+        """
+        基于 Redis（或兼容 Redis 协议的存储）的状态存储，可被多个进程、多台机器共享
+
+        容量由 Redis 自身的 maxmemory 策略控制；redis-py 的连接池在 fork 后会自动重建连接
+
+        Args:
+            url: Redis 地址
+            prefix: 键前缀，多个应用共用一个 Redis 时避免冲突
+            default_ttl: 默认有效期（秒），None 表示不过期
+        """
+        if redis is None:
+            raise RuntimeError("Redis 状态存储需要安装 redis：pip install redis")
+        self.url = url
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._client = redis.Redis.from_url(url)
+
+    def _ttl_ms(self, ttl: Optional[float]) -> Optional[int]:
+        ttl = ttl if ttl is not None else self.default_ttl
+        return max(1, int(ttl * 1000)) if ttl else None
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), px=self._ttl_ms(ttl))
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self.prefix + key)
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Optional[Any]], ttl: Optional[float] = None) -> Optional[Any]:
+        name = self.prefix + key
+        with self._client.pipeline() as pipe:
+            for _ in range(self.MAX_UPDATE_RETRIES):
+                try:
+                    # WATCH 之后键被其他客户端修改时 EXEC 失败，重新读取后再试
+                    pipe.watch(name)
+                    raw = pipe.get(name)
+                    value = fn(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    if value is None:
+                        pipe.delete(name)
+                    else:
+                        pipe.set(name, json.dumps(value, ensure_ascii=False), px=self._ttl_ms(ttl))
+                    pipe.execute()
+                    return value
+                except redis.WatchError:
+                    continue
+        raise RuntimeError(f"状态 {key} 被频繁并发修改，更新失败")
+
+
+def create_state_store(backend: str = 'memory', sqlite_path: str = "state/state.db",
+                       max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                       default_ttl: Optional[float] = None, redis_url: str = "redis://localhost:6379/0",
+                       pinned_prefixes: Sequence[str] = ()) -> StateStore:
+    """根据配置创建状态存储；pinned_prefixes 只对 SQLite 后端有意义（内存后端不共享，Redis 由 maxmemory 控制容量）"""
+    if backend == 'memory':
+        return MemoryStateStore(max_entries=max_entries, max_bytes=max_bytes, default_ttl=default_ttl)
+    if backend == 'sqlite':
+        return SQLiteStateStore(sqlite_path, max_entries=max_entries, max_bytes=max_bytes, default_ttl=default_ttl,
+                                pinned_prefixes=pinned_prefixes)
+    if backend == 'redis':
+        return RedisStateStore(redis_url, default_ttl=default_ttl)
+    raise ValueError(f"不支持的状态存储后端: {backend}")
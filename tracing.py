@@ -0,0 +1,293 @@
+"""
+请求追踪
+每个 Flask 请求（以及后台任务）对应一个 trace，模型、图像和 MCP 调用在其中记录 span。
+当前 trace 保存在 contextvars 中；提交到线程池的函数需通过 submit() 带上上下文。
+耗时超过阈值的 trace 连同完整的 span 明细追加写入 JSONL 慢请求日志
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 单个 trace 最多记录的 span 数，超出的只计数（避免长连接无限增长）
+MAX_SPANS = 1000
+
+_current_trace: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('span', default=None)
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.started - self.trace.started, 6),
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attributes):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self._spans: List[Span] = []
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self.root = self.start_span(name, None)
+
+    def start_span(self, name: str, parent_id: Optional[str], **attributes) -> Span:
+        span = Span(self, name, parent_id, attributes)
+        with self._lock:
+            if len(self._spans) < MAX_SPANS:
+                self._spans.append(span)
+            else:
+                self._dropped += 1
+        return span
+
+    @property
+    def duration(self) -> float:
+        if self.root.duration is not None:
+            return self.root.duration
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self._spans]
+            dropped = self._dropped
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='milliseconds'),
+            'duration': round(self.duration, 6),
+            'attributes': self.attributes,
+            'spans': spans,
+            'dropped_spans': dropped
+        }
+
+
+class SlowTraceLog:
+    """把耗时超过阈值的 trace 追加写入 JSONL 文件"""
+
+    def __init__(self, path: str, threshold: float):
+        """
+        Args:
+            path: 日志文件路径
+            threshold: 阈值（秒），小于 0 表示不记录
+        """
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace: Trace) -> None:
+        if self.threshold < 0 or trace.duration < self.threshold:
+            return
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logger.warning(f"写入慢请求日志失败 {self.path}: {e}")
+            return
+        logger.warning(f"慢请求 {trace.name}（{trace.duration:.2f} 秒，trace {trace.trace_id}）")
+
+
+_exporter: Optional[SlowTraceLog] = None
+
+
+def configure(path: str, threshold: float) -> None:
+    """
+    配置慢请求日志
+
+    Args:
+        path: JSONL 文件路径
+        threshold: 耗时阈值（秒），小于 0 表示关闭
+    """
+    global _exporter
+    _exporter = SlowTraceLog(path, threshold)
+
+
+def finish(trace: Trace, error: Optional[BaseException] = None) -> None:
+    """结束 trace 并按阈值导出"""
+    trace.root.end(error)
+    if _exporter is not None:
+        _exporter.export(trace)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def activate(trace: Trace) -> None:
+    """把 trace 设为当前上下文的 trace，之后的 span 都记录在它的根 span 下"""
+    _current_trace.set(trace)
+    _current_span.set(trace.root)
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[Trace]:
+    """
+    在新的 trace 中执行代码块（用于后台任务等不在请求中的工作），结束后按阈值导出
+
+    Args:
+        name: trace 名称
+        trace_id: 指定 trace ID，默认随机生成
+    """
+    new_trace = Trace(name, trace_id, **attributes)
+    trace_token = _current_trace.set(new_trace)
+    span_token = _current_span.set(new_trace.root)
+    try:
+        yield new_trace
+    except BaseException as e:
+        finish(new_trace, e)
+        raise
+    else:
+        finish(new_trace)
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """
+    开始一个 span 但不设为当前 span（用于生成器等跨越多次调用的工作），需自行调用 end()
+
+    Returns:
+        span；当前没有 trace 时返回 None
+    """
+    current = _current_trace.get()
+    if current is None:
+        return None
+    parent = _current_span.get()
+    return current.start_span(name, parent.span_id if parent is not None else None, **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    记录代码块为当前 trace 的一个 span，代码块中的 span 成为它的子 span；没有 trace 时不记录
+
+    Args:
+        name: span 名称
+        attributes: 附加信息
+    """
+    new_span = start_span(name, **attributes)
+    if new_span is None:
+        yield None
+        return
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.end(e)
+        raise
+    finally:
+        new_span.end()
+        _current_span.reset(token)
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """装饰器：把函数的每次调用记录为一个 span"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+    """提交到线程池，并带上当前上下文（trace 和父 span）"""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+
+class TraceIdFilter(logging.Filter):
+    """为日志记录加上 trace_id 字段（不在 trace 中时为 -）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or '-'
+        return True
+
+
+def init_app(app, header: str = 'X-Request-Id') -> None:
+    """
+    为 Flask 应用的每个请求建立 trace
+
+    请求头带 header 时沿用其值作为 trace ID，响应头返回 trace ID；
+    流式响应在内容发送完毕时才结束 trace
+
+    Args:
+        app: Flask 应用
+        header: 传递 trace ID 的请求头/响应头
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        incoming = (request.headers.get(header) or '').strip()
+        # 只接受合理长度的可打印ID，避免日志注入
+        trace_id = incoming if incoming and len(incoming) <= 128 and incoming.isprintable() else None
+        new_trace = Trace(f"{request.method} {route}", trace_id, path=request.path)
+        activate(new_trace)
+        g.trace = new_trace
+
+    @app.after_request
+    def _finish_trace(response):
+        current = g.pop('trace', None)
+        if current is None:
+            return response
+        response.headers[header] = current.trace_id
+        current.root.set(status=response.status_code)
+        response.call_on_close(lambda: finish(current))
+        return response